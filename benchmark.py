@@ -0,0 +1,404 @@
+"""Benchmark e teste de carga das rotas quentes e do fan-out do Socket.IO.
+
+Sobe o servidor (`python menu.py`) em um DATA_DIR temporário com um gestao.db
+sintético (gerar_dados.py), mede cada cenário com N clientes concorrentes (conexões keep-alive)
+e imprime p50/p95/p99 e vazão. O resultado é gravado em benchmarks/<data>.json
+e comparado com a execução anterior.
+
+Uso:
+    python benchmark.py
+    python benchmark.py --itens 5000 --insumos 50000 --concorrencia 32 --workers 4
+    python benchmark.py --cenarios insumos,atender --duracao 5
+    python benchmark.py --comparar benchmarks/20261018-101500.json
+
+Só usa a biblioteca padrão (e o Pillow, já dependência do app, para as fotos).
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+from http.client import HTTPConnection, HTTPException
+
+from gerar_dados import MAQUINAS, OPERADORES, gerar
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTADOS = os.path.join(ROOT, "benchmarks")
+
+CENARIOS = ('itens_cadastro', 'insumos', 'atendidos', 'solicitar_insumo', 'atender', 'relatorio')
+
+
+# --- Servidor --------------------------------------------------------------
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def esperar(port, timeout=60):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            conn = HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except (OSError, HTTPException):
+            time.sleep(0.3)
+    raise SystemExit(f'Servidor não respondeu na porta {port}')
+
+
+def iniciar_servidor(data_dir, port, workers, log_path):
+    env = dict(os.environ, DATA_DIR=data_dir, PORT=str(port), WORKERS=str(workers))
+    log = open(log_path, 'w')
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'menu.py')], env=env, cwd=ROOT,
+                            stdout=log, stderr=subprocess.STDOUT)
+    esperar(port)
+    return proc
+
+
+def login(port, db_path):
+    conn = sqlite3.connect(db_path)
+    usuario, senha = conn.execute('SELECT username, password FROM admin LIMIT 1').fetchone()
+    conn.close()
+    http = HTTPConnection('127.0.0.1', port, timeout=30)
+    http.request('POST', '/login', urllib.parse.urlencode({'username': usuario, 'password': senha}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    resp = http.getresponse()
+    resp.read()
+    cookie = resp.getheader('Set-Cookie', '').split(';', 1)[0]
+    http.close()
+    return cookie
+
+
+# --- Carga HTTP ------------------------------------------------------------
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    k = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[k]
+
+
+def resumir(latencias, erros, duracao):
+    ordenados = sorted(latencias)
+    return {
+        'requisicoes': len(latencias),
+        'erros': erros,
+        'rps': round(len(latencias) / duracao, 1) if duracao else 0.0,
+        'p50_ms': round(percentil(ordenados, 50) * 1000, 2),
+        'p95_ms': round(percentil(ordenados, 95) * 1000, 2),
+        'p99_ms': round(percentil(ordenados, 99) * 1000, 2),
+        'max_ms': round((ordenados[-1] if ordenados else 0) * 1000, 2),
+    }
+
+
+def carga(port, montar, concorrencia, duracao):
+    """`concorrencia` threads com uma conexão keep-alive cada, pelo tempo `duracao`.
+
+    No modo multi-processo o kernel distribui as conexões entre os workers.
+    """
+    resultados = [([], [0]) for _ in range(concorrencia)]
+    inicio = time.perf_counter()
+    fim = inicio + duracao
+
+    def cliente(indice):
+        latencias, erros = resultados[indice]
+        http = HTTPConnection('127.0.0.1', port, timeout=120)
+        while time.perf_counter() < fim:
+            method, path, body, headers = montar()
+            t0 = time.perf_counter()
+            try:
+                http.request(method, path, body, headers)
+                resp = http.getresponse()
+                resp.read()
+                if resp.status >= 400:
+                    erros[0] += 1
+                    continue
+            except (OSError, HTTPException):
+                erros[0] += 1
+                http.close()
+                http = HTTPConnection('127.0.0.1', port, timeout=120)
+                continue
+            latencias.append(time.perf_counter() - t0)
+        http.close()
+
+    threads = [threading.Thread(target=cliente, args=(i,)) for i in range(concorrencia)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    decorrido = time.perf_counter() - inicio
+    latencias = [lat for lats, _ in resultados for lat in lats]
+    return resumir(latencias, sum(e[0] for _, e in resultados), decorrido)
+
+
+def montadores(cookie, insumo_ids, pendentes, seed):
+    rnd = random.Random(seed)
+    lock = threading.Lock()
+    fila = list(pendentes)
+    form = {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'}
+    gzip_json = {'Accept-Encoding': 'gzip', 'Accept': 'application/json'}
+
+    def solicitar():
+        with lock:
+            item = rnd.choice(insumo_ids)
+            dados = {'item_id': item, 'nome': f'Insumo {item}', 'operador': rnd.choice(OPERADORES),
+                     'maquina': rnd.choice(MAQUINAS), 'quantidade': rnd.randint(1, 5),
+                     'urgencia': rnd.choice(['baixa', 'media', 'alta']), 'justificativa': 'benchmark'}
+        return 'POST', '/solicitar_insumo', urllib.parse.urlencode(dados), form
+
+    def atender():
+        with lock:
+            alvo = fila.pop() if fila else rnd.choice(pendentes)
+        return ('PUT', f'/api/insumo/{alvo}/atender',
+                urllib.parse.urlencode({'status': 'Atendido', 'sem_fotos': 'true', 'atendida_por': 'bench'}), form)
+
+    return {
+        'itens_cadastro': lambda: ('GET', '/api/itens_cadastro', None, gzip_json),
+        'insumos': lambda: ('GET', '/api/insumos', None, gzip_json),
+        'atendidos': lambda: ('GET', '/api/atendidos?limit=50', None, gzip_json),
+        'solicitar_insumo': solicitar,
+        'atender': atender,
+        'relatorio': lambda: ('GET', '/relatorio/ocorrencias?prioridade=alta', None, {'Cookie': cookie}),
+    }
+
+
+# --- Fan-out do Socket.IO (Engine.IO v4 por websocket, só stdlib) ------------
+
+class ClienteSocket(threading.Thread):
+    """Cliente /gestao inscrito na sala 'gestao'; anota quando cada insumo.created chega."""
+
+    def __init__(self, port, recebidos, pronto):
+        super().__init__(daemon=True)
+        self.port = port
+        self.recebidos = recebidos
+        self.pronto = pronto
+        self.parar = False
+
+    def _conectar(self):
+        sock = socket.create_connection(('127.0.0.1', self.port), timeout=60)
+        chave = base64.b64encode(os.urandom(16)).decode('ascii')
+        sock.sendall((f'GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n'
+                      f'Host: 127.0.0.1:{self.port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      f'Sec-WebSocket-Key: {chave}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode('ascii'))
+        leitor = sock.makefile('rb')
+        status = leitor.readline()
+        if b' 101 ' not in status:
+            raise SystemExit(f'Handshake websocket recusado: {status!r}')
+        while leitor.readline() not in (b'\r\n', b''):
+            pass
+        return sock, leitor
+
+    def _enviar(self, sock, texto):
+        # Quadro de texto do cliente: sempre mascarado (RFC 6455)
+        dados = texto.encode('utf-8')
+        mascara = os.urandom(4)
+        cabecalho = bytes([0x81])
+        if len(dados) < 126:
+            cabecalho += bytes([0x80 | len(dados)])
+        else:
+            cabecalho += bytes([0x80 | 126]) + struct.pack('!H', len(dados))
+        sock.sendall(cabecalho + mascara + bytes(b ^ mascara[i % 4] for i, b in enumerate(dados)))
+
+    def _receber(self, leitor):
+        """Próxima mensagem de texto do servidor (quadros do servidor não são mascarados)."""
+        while True:
+            cabecalho = leitor.read(2)
+            if len(cabecalho) < 2:
+                raise OSError('conexão fechada')
+            opcode, tamanho = cabecalho[0] & 0x0f, cabecalho[1] & 0x7f
+            if tamanho == 126:
+                tamanho = struct.unpack('!H', leitor.read(2))[0]
+            elif tamanho == 127:
+                tamanho = struct.unpack('!Q', leitor.read(8))[0]
+            dados = leitor.read(tamanho)
+            if opcode == 0x8:
+                raise OSError('conexão fechada')
+            if opcode == 0x1:
+                return dados.decode('utf-8')
+
+    def run(self):
+        sock, leitor = self._conectar()
+        self._receber(leitor)  # pacote "0" (open)
+        self._enviar(sock, '40/gestao,')
+        self._receber(leitor)  # "40/gestao,{sid}"
+        self._enviar(sock, '42/gestao,["subscribe",{"views":["gestao"]}]')
+        self.pronto.release()
+        while not self.parar:
+            try:
+                pacote = self._receber(leitor)
+            except OSError:
+                return
+            agora = time.perf_counter()
+            if pacote == '2':
+                self._enviar(sock, '3')
+            elif pacote.startswith('42/gestao,'):
+                nome, dados = json.loads(pacote[len('42/gestao,'):])[:2]
+                if nome == 'insumo.created':
+                    self.recebidos.append((dados['id'], agora))
+        sock.close()
+
+
+def fanout(port, n_clientes, n_eventos, insumo_ids, intervalo=0.05):
+    recebidos = []
+    pronto = threading.Semaphore(0)
+    clientes = [ClienteSocket(port, recebidos, pronto) for _ in range(n_clientes)]
+    for c in clientes:
+        c.start()
+    for _ in clientes:
+        if not pronto.acquire(timeout=30):
+            raise SystemExit('Clientes Socket.IO não conectaram')
+    time.sleep(0.5)
+
+    enviados = {}
+    http = HTTPConnection('127.0.0.1', port, timeout=60)
+    form = {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'}
+    for n in range(n_eventos):
+        item = insumo_ids[n % len(insumo_ids)]
+        corpo = urllib.parse.urlencode({'item_id': item, 'nome': 'fanout', 'operador': 'bench', 'maquina': MAQUINAS[0],
+                                        'quantidade': 1, 'urgencia': 'alta', 'justificativa': 'fanout'})
+        t0 = time.perf_counter()
+        http.request('POST', '/solicitar_insumo', corpo, form)
+        resp = http.getresponse()
+        enviados[json.loads(resp.read())['id']] = t0
+        time.sleep(intervalo)
+    time.sleep(2)
+    for c in clientes:
+        c.parar = True
+
+    latencias = [chegada - enviados[i] for i, chegada in list(recebidos) if i in enviados]
+    resumo = resumir(latencias, 0, 0)
+    resumo.pop('rps')
+    resumo.update({'clientes': n_clientes, 'eventos': n_eventos,
+                   'entregues': len(latencias), 'esperados': n_clientes * n_eventos})
+    return resumo
+
+
+# --- Resultados --------------------------------------------------------------
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(atual, anterior):
+    print(f"\nComparação com {anterior.get('quando')} (commit {anterior.get('commit')}):")
+    print(f"{'cenário':<18}{'p50 ms':>18}{'p95 ms':>18}{'req/s':>18}")
+    for nome, r in atual['cenarios'].items():
+        a = anterior.get('cenarios', {}).get(nome)
+        if not a:
+            continue
+
+        def delta(chave):
+            antes, agora = a.get(chave) or 0, r.get(chave) or 0
+            pct = f'{(agora - antes) / antes * 100:+.0f}%' if antes else 'n/a'
+            return f'{agora:>9} ({pct:>5})'
+        print(f"{nome:<18}{delta('p50_ms'):>18}{delta('p95_ms'):>18}{delta('rps'):>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--itens', type=int, default=2000, help='itens do cadastro (1/4 ferramentas)')
+    parser.add_argument('--insumos', type=int, default=20000, help='histórico de solicitações')
+    parser.add_argument('--ocorrencias', type=int, default=2000)
+    parser.add_argument('--fotos', type=int, default=50, help='fotos distintas nos atendimentos')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--concorrencia', type=int, default=16, help='clientes HTTP simultâneos')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos por cenário')
+    parser.add_argument('--cenarios', default=','.join(CENARIOS), help='lista separada por vírgula')
+    parser.add_argument('--workers', type=int, default=1, help='WORKERS do servidor (multi-processo)')
+    parser.add_argument('--clientes-socket', type=int, default=50, help='clientes Socket.IO no fan-out (0 pula)')
+    parser.add_argument('--eventos-socket', type=int, default=20)
+    parser.add_argument('--comparar', help='arquivo de resultado anterior (padrão: o mais recente)')
+    parser.add_argument('--manter', action='store_true', help='não apaga o DATA_DIR temporário')
+    args = parser.parse_args()
+
+    cenarios = [c for c in args.cenarios.split(',') if c]
+    desconhecidos = set(cenarios) - set(CENARIOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    data_dir = tempfile.mkdtemp(prefix='gestao-bench-')
+    proc = None
+    try:
+        t0 = time.perf_counter()
+        gerar(data_dir, args.itens, args.insumos, args.ocorrencias, fotos=args.fotos, seed=args.seed)
+        db_path = os.path.join(data_dir, 'gestao.db')
+        conn = sqlite3.connect(db_path)
+        insumo_ids = [r[0] for r in conn.execute("SELECT id FROM itens_cadastro WHERE tipo_item = 'insumo'")]
+        pendentes = [r[0] for r in conn.execute("SELECT id FROM insumos WHERE status = 'Pendente'")]
+        conn.close()
+        print(f'Base sintética pronta em {time.perf_counter() - t0:.1f}s ({data_dir})')
+
+        port = porta_livre()
+        proc = iniciar_servidor(data_dir, port, args.workers, os.path.join(data_dir, 'servidor.log'))
+        cookie = login(port, db_path)
+        montar = montadores(cookie, insumo_ids, pendentes, args.seed)
+
+        resultado = {
+            'quando': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit_atual(),
+            'parametros': vars(args),
+            'cenarios': {},
+        }
+        print(f"{'cenário':<18}{'req':>8}{'erros':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for nome in cenarios:
+            # Relatório é pesado (PDF): poucos clientes para medir latência, não fila
+            concorrencia = min(args.concorrencia, 2) if nome == 'relatorio' else args.concorrencia
+            r = carga(port, montar[nome], concorrencia, args.duracao)
+            r['concorrencia'] = concorrencia
+            resultado['cenarios'][nome] = r
+            print(f"{nome:<18}{r['requisicoes']:>8}{r['erros']:>7}{r['rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}")
+
+        if args.clientes_socket:
+            # Com vários workers o evento sai de um e cruza a fila até os clientes dos outros
+            r = fanout(port, args.clientes_socket, args.eventos_socket, insumo_ids)
+            resultado['socketio_fanout'] = r
+            print(f"\nFan-out Socket.IO: {r['entregues']}/{r['esperados']} entregues, "
+                  f"p50 {r['p50_ms']} ms, p95 {r['p95_ms']} ms, p99 {r['p99_ms']} ms")
+
+        os.makedirs(RESULTADOS, exist_ok=True)
+        anteriores = sorted(glob.glob(os.path.join(RESULTADOS, '*.json')))
+        destino = os.path.join(RESULTADOS, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+        with open(destino, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f'\nResultado gravado em {destino}')
+
+        base = args.comparar or (anteriores[-1] if anteriores else None)
+        if base:
+            with open(base, encoding='utf-8') as f:
+                comparar(resultado, json.load(f))
+    finally:
+        if proc is not None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if args.manter:
+            print(f'DATA_DIR mantido em {data_dir}')
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+"""Gerador de dados sintéticos para o esquema do gestao.db.
+
+Produz bases determinísticas (mesma semente e mesmos parâmetros = mesmo banco,
+byte a byte no conteúdo das tabelas) para todas as tabelas criadas pelas
+migrações do menu.py: itens_cadastro (ferramentas e insumos), composicao_ferramentas,
+itens_maquinas, itens_celulas, itens excluídos com a composição deles, anos de
+insumos e ocorrências, fotos em disco e o admin.
+
+Uso:
+    python gerar_dados.py --destino /tmp/dados --escala 100k
+    python gerar_dados.py --destino /tmp/dados --itens 5000 --insumos 200000 --fotos 300 --seed 7
+    DATA_DIR=/tmp/dados python menu.py   # sobe o app sobre a base gerada
+
+O esquema vem das próprias migrações do app (o banco é criado vazio e o menu.py é
+importado uma vez); os dados entram com executemany em uma única transação, com
+as linhas geradas sob demanda, então até a escala 1m a memória fica pequena.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Linhas aproximadas (somando as tabelas filhas) por escala
+ESCALAS = {
+    '1k': {'itens': 100, 'insumos': 500, 'ocorrencias': 60, 'excluidos': 5, 'fotos': 10},
+    '10k': {'itens': 800, 'insumos': 6000, 'ocorrencias': 600, 'excluidos': 20, 'fotos': 50},
+    '100k': {'itens': 5000, 'insumos': 70000, 'ocorrencias': 6000, 'excluidos': 100, 'fotos': 200},
+    '1m': {'itens': 20000, 'insumos': 800000, 'ocorrencias': 60000, 'excluidos': 500, 'fotos': 500},
+}
+
+FERRAMENTAS = ['Fresa de topo', 'Broca', 'Macho', 'Alargador', 'Cabeçote de fresar', 'Porta-ferramenta', 'Bedame']
+INSUMOS = ['Pastilha', 'Inserto', 'Parafuso de fixação', 'Calço', 'Óleo de corte', 'Lima', 'Disco de corte', 'Lixa']
+CATEGORIAS = ['Usinagem', 'Furação', 'Torneamento', 'Rosqueamento', 'Acabamento']
+MATERIAIS = ['Metal duro', 'HSS', 'Cerâmica', 'CBN', 'Aço rápido']
+MAQUINAS = ['Torno CNC 01', 'Torno CNC 02', 'Torno CNC 03', 'Centro de Usinagem 01', 'Centro de Usinagem 02',
+            'Fresadora 01', 'Fresadora 02', 'Retífica 01', 'Furadeira Radial', 'Serra Fita', 'Mandrilhadora']
+CELULAS = ['Célula A', 'Célula B', 'Célula C', 'Célula D', 'Célula E', 'Ferramentaria', 'Manutenção']
+OPERADORES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Elisa', 'Fábio', 'Gabriela', 'Hugo', 'Igor', 'Júlia']
+JUSTIFICATIVAS = ['Desgaste', 'Quebra', 'Troca preventiva', 'Setup de novo lote', 'Perda']
+TIPOS_OCORRENCIA = ['máquina', 'segurança', 'qualidade', 'manutenção']
+TITULOS_OCORRENCIA = ['Vazamento de óleo', 'Ruído anormal', 'Peça fora de medida', 'Falta de EPI',
+                      'Quebra de ferramenta', 'Alarme no CNC', 'Refrigeração parada']
+FMT = '%d/%m/%Y %H:%M'  # formato gravado pelas rotas
+
+
+def migrar(data_dir):
+    """Cria um gestao.db vazio em `data_dir` e aplica as migrações do app.
+
+    O arquivo vazio impede que o menu.py copie o gestao.db do repositório.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    db_path = os.path.join(data_dir, 'gestao.db')
+    if os.path.exists(db_path):
+        raise SystemExit(f'{db_path} já existe; use um destino vazio')
+    sqlite3.connect(db_path).close()
+    subprocess.run([sys.executable, '-c', 'import menu'], cwd=ROOT, check=True,
+                   env=dict(os.environ, DATA_DIR=data_dir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return db_path
+
+
+def gerar_fotos(pasta, quantidade, rnd, prefixo=b''):
+    """JPEGs determinísticos, nomeados pelo sha256 do conteúdo como no ingest do app."""
+    if not quantidade:
+        return []
+    from PIL import Image, ImageDraw
+    os.makedirs(pasta, exist_ok=True)
+    nomes = []
+    for n in range(quantidade):
+        img = Image.new('RGB', (1600, 1200), tuple(rnd.randint(0, 255) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(6):
+            x, y = rnd.randint(0, 1400), rnd.randint(0, 1000)
+            draw.rectangle((x, y, x + rnd.randint(50, 200), y + rnd.randint(50, 200)),
+                           fill=tuple(rnd.randint(0, 255) for _ in range(3)))
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=85)
+        data = buf.getvalue()
+        nome = hashlib.sha256(prefixo + data).hexdigest()[:32] + '.jpg'
+        with open(os.path.join(pasta, nome), 'wb') as f:
+            f.write(data)
+        nomes.append(nome)
+    return nomes
+
+
+def _enviesado(rnd, seq, expoente=2.0):
+    """Elemento de `seq` com viés para o começo (poucos itens concentram o consumo)."""
+    return seq[int(len(seq) * rnd.random() ** expoente)]
+
+
+class Calendario:
+    """Datas do histórico como minutos desde `inicio`.
+
+    Os rótulos de dia e de hora são montados uma vez: strftime por linha domina o tempo na escala 1m.
+    """
+    HORAS = [f'{h:02d}:{m:02d}' for h in range(24) for m in range(60)]
+
+    def __init__(self, rnd, inicio, dias):
+        self.dias = dias
+        # Folga de alguns dias para atendimentos que terminam depois da data de referência
+        self.rotulos = [(inicio + timedelta(days=n)).strftime('%d/%m/%Y') for n in range(dias + 3)]
+        # Dias úteis, mais alguns fins de semana com plantão
+        self.uteis = [n for n in range(dias)
+                      if (inicio + timedelta(days=n)).weekday() < 5 or rnd.random() < 0.15] or [0]
+
+    def sortear(self, rnd):
+        """Minuto em um dia de trabalho, no horário de turno (06h-22h)."""
+        return self.uteis[int(rnd.random() * len(self.uteis))] * 1440 + rnd.randrange(6 * 60, 22 * 60)
+
+    def formatar(self, minuto):
+        return f'{self.rotulos[minuto // 1440]} {self.HORAS[minuto % 1440]}'
+
+
+def _itens(rnd, n_itens, n_ferramentas, data_ref, fotos_cadastro):
+    for i in range(1, n_itens + 1):
+        ferramenta = i <= n_ferramentas
+        base = rnd.choice(FERRAMENTAS if ferramenta else INSUMOS)
+        prefixo = 'FER' if ferramenta else 'INS'
+        yield (
+            'ferramenta' if ferramenta else 'insumo',
+            f'FAB-{rnd.randint(100000, 999999)}',
+            f'{prefixo}-{i:06d}',
+            f'{base} {rnd.choice(MATERIAIS)} ø{rnd.randint(2, 63)} mm #{i}',
+            fotos_cadastro[i % len(fotos_cadastro)] if fotos_cadastro and rnd.random() < 0.6 else None,
+            rnd.choice(CATEGORIAS),
+            rnd.choice(MATERIAIS),
+            rnd.choice(MAQUINAS),
+            round(rnd.uniform(5, 50), 1),
+            round(rnd.uniform(50, 120), 1),
+            rnd.randrange(500, 12000, 50),
+            round(rnd.uniform(0.05, 0.5), 2),
+            (data_ref - timedelta(days=rnd.randint(0, 5 * 365), minutes=rnd.randint(0, 1439))).strftime(FMT),
+        )
+
+
+def _composicao(rnd, ferramentas, insumos):
+    for ferramenta in ferramentas:
+        escolhidos = {_enviesado(rnd, insumos, 1.5) for _ in range(rnd.randint(1, 5))}
+        for insumo in sorted(escolhidos):
+            yield ferramenta, insumo, rnd.randint(1, 4)
+
+
+def _multivalor(rnd, ids, valores, minimo, maximo):
+    for item_id in ids:
+        for valor in sorted(rnd.sample(valores, rnd.randint(minimo, maximo))):
+            yield item_id, valor
+
+
+def _insumos(rnd, n, insumo_ids, codigos, calendario, fotos):
+    pendentes_desde = (calendario.dias - 14) * 1440
+    urgencias = ['baixa'] * 5 + ['media'] * 3 + ['alta'] * 2
+    for _ in range(n):
+        item = _enviesado(rnd, insumo_ids)
+        data = calendario.sortear(rnd)
+        # Recentes ficam pendentes com mais frequência; o histórico é quase todo atendido
+        atendido = rnd.random() < (0.6 if data >= pendentes_desde else 0.98)
+        fotos_item = []
+        if atendido and fotos and rnd.random() < 0.7:
+            fotos_item = sorted({rnd.choice(fotos) for _ in range(rnd.randint(1, 3))})
+        yield (
+            item,
+            f'Solicitação {codigos[item]}',
+            rnd.choice(OPERADORES),
+            rnd.choice(MAQUINAS),
+            rnd.randint(1, 10),
+            rnd.choice(urgencias),
+            rnd.choice(JUSTIFICATIVAS),
+            calendario.formatar(data),
+            'Atendido' if atendido else 'Pendente',
+            codigos[item] if atendido else None,
+            json.dumps(fotos_item) if atendido else None,
+            0 if fotos_item or not atendido else 1,
+            calendario.formatar(data + rnd.randrange(10, 48 * 60)) if atendido else None,
+            rnd.choice(OPERADORES) if atendido else None,
+        )
+
+
+def _ocorrencias(rnd, n, calendario):
+    abertas_desde = (calendario.dias - 30) * 1440
+    prioridades = ['baixa'] * 4 + ['media'] * 4 + ['alta'] * 2
+    for _ in range(n):
+        data = calendario.sortear(rnd)
+        aberta = rnd.random() < (0.5 if data >= abertas_desde else 0.03)
+        yield (
+            rnd.choice(TITULOS_OCORRENCIA),
+            f'Registrada na {rnd.choice(MAQUINAS)} ({rnd.choice(CELULAS)})',
+            rnd.choice(TIPOS_OCORRENCIA),
+            rnd.choice(prioridades),
+            calendario.formatar(data),
+            'Aberta' if aberta else rnd.choice(['Fechada', 'Atendida']),
+        )
+
+
+def gerar(data_dir, itens, insumos, ocorrencias, excluidos=0, fotos=0, anos=3, seed=42,
+          data_ref=datetime(2026, 1, 1)):
+    """Cria e popula `data_dir`/gestao.db; retorna as contagens por tabela.
+
+    Determinístico por `seed`; as datas são relativas a `data_ref`, não ao relógio.
+    """
+    rnd = random.Random(seed)
+    inicio_total = time.perf_counter()
+    db_path = migrar(data_dir)
+    fotos_insumos = gerar_fotos(os.path.join(data_dir, 'fotos_insumos'), fotos, rnd)
+    fotos_cadastro = gerar_fotos(os.path.join(data_dir, 'fotos_cadastro'), max(1, fotos // 4) if fotos else 0,
+                                 rnd, prefixo=b'cadastro')
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -200000')
+    try:
+        conn.execute('BEGIN')
+        n_ferramentas = max(1, itens // 4)
+        conn.executemany('''
+            INSERT INTO itens_cadastro (tipo_item, codigo_fabricacao, codigo_interno, nome_descricao, foto,
+                categoria, material, maquina, altura_min, altura_max, rpm, avanco, data_cadastro)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _itens(rnd, itens, n_ferramentas, data_ref, fotos_cadastro))
+        codigos = dict(conn.execute('SELECT id, codigo_interno FROM itens_cadastro'))
+        ids = sorted(codigos)
+        ferramentas, insumo_ids = ids[:n_ferramentas], ids[n_ferramentas:] or ids
+
+        conn.executemany('INSERT INTO composicao_ferramentas (ferramenta_id, insumo_id, quantidade) VALUES (?, ?, ?)',
+                         _composicao(rnd, ferramentas, insumo_ids))
+        conn.executemany('INSERT INTO itens_maquinas (item_id, maquina) VALUES (?, ?)',
+                         _multivalor(rnd, ids, MAQUINAS, 1, 3))
+        conn.executemany('INSERT INTO itens_celulas (item_id, celula) VALUES (?, ?)',
+                         _multivalor(rnd, ids, CELULAS, 0, 2))
+
+        # Excluídos (lixeira do "desfazer"): ids depois dos vivos, como se tivessem sido removidos
+        excluidos_rows = [
+            (itens + n, *linha, (data_ref - timedelta(days=rnd.randint(0, 90))).strftime(FMT))
+            for n, linha in enumerate(_itens(rnd, excluidos, excluidos // 2, data_ref, []), start=1)
+        ]
+        # O código ganha sufixo para não colidir com o item vivo de mesmo número
+        conn.executemany('''
+            INSERT INTO itens_cadastro_deleted (id, tipo_item, codigo_fabricacao, codigo_interno, nome_descricao, foto,
+                categoria, material, maquina, altura_min, altura_max, rpm, avanco, data_cadastro, deleted_at)
+            VALUES (?, ?, ?, ? || '-X', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', excluidos_rows)
+        conn.executemany('''
+            INSERT INTO composicao_ferramentas_deleted (ferramenta_id, insumo_id, quantidade, deleted_at)
+            VALUES (?, ?, ?, ?)
+        ''', [(row[0], ins, q, row[14]) for row in excluidos_rows if row[1] == 'ferramenta'
+              for _, ins, q in _composicao(rnd, [row[0]], insumo_ids)])
+        if excluidos_rows:
+            # AUTOINCREMENT não pode reutilizar os ids da lixeira
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'itens_cadastro'", (itens + excluidos,))
+
+        dias = max(1, int(anos * 365))
+        calendario = Calendario(rnd, data_ref - timedelta(days=dias), dias)
+        # Carga inicial não é "alteração": sem os gatilhos do change_log durante o histórico, o feed
+        # começa depois dela (clientes com versão antiga recarregam tudo). Os índices do histórico são
+        # recriados no fim, com uma ordenação só, em vez de mantidos linha a linha
+        suspensos = conn.execute("""
+            SELECT type, name, sql FROM sqlite_master
+            WHERE (type = 'trigger' AND name LIKE 'change_log_%')
+               OR (type = 'index' AND tbl_name IN ('insumos', 'ocorrencias') AND sql IS NOT NULL)
+        """).fetchall()
+        for tipo, nome, _ in suspensos:
+            conn.execute(f'DROP {tipo.upper()} {nome}')
+        conn.executemany('''
+            INSERT INTO insumos (item_id, nome, operador, maquina, quantidade, urgencia, justificativa, data, status,
+                codigo_interno, fotos, sem_fotos, data_atendimento, atendida_por)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _insumos(rnd, insumos, insumo_ids, codigos, calendario, fotos_insumos))
+        conn.executemany('INSERT INTO ocorrencias (titulo, descricao, tipo, prioridade, data, status) VALUES (?, ?, ?, ?, ?, ?)',
+                         _ocorrencias(rnd, ocorrencias, calendario))
+        for _, _, sql in suspensos:
+            conn.execute(sql)
+        conn.execute("""
+            UPDATE app_meta SET value = (SELECT ifnull(max(seq), 0) FROM sqlite_sequence WHERE name = 'change_log')
+            WHERE key = 'change_log_min_version'
+        """)
+        conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'catalog_version'")
+        conn.execute('COMMIT')
+        conn.execute('ANALYZE')
+        contagens = {tabela: conn.execute(f'SELECT COUNT(*) FROM {tabela}').fetchone()[0] for tabela in (
+            'itens_cadastro', 'composicao_ferramentas', 'itens_maquinas', 'itens_celulas',
+            'itens_cadastro_deleted', 'composicao_ferramentas_deleted', 'insumos', 'ocorrencias', 'admin')}
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    contagens['fotos'] = len(fotos_insumos) + len(fotos_cadastro)
+    contagens['segundos'] = round(time.perf_counter() - inicio_total, 1)
+    return contagens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--destino', required=True, help='DATA_DIR a criar (gestao.db + pastas de fotos)')
+    parser.add_argument('--escala', choices=sorted(ESCALAS), default='10k', help='tamanho base (linhas aproximadas)')
+    parser.add_argument('--itens', type=int, help='itens do cadastro (1/4 ferramentas)')
+    parser.add_argument('--insumos', type=int, help='solicitações de insumo no histórico')
+    parser.add_argument('--ocorrencias', type=int)
+    parser.add_argument('--excluidos', type=int, help='itens na lixeira (itens_cadastro_deleted)')
+    parser.add_argument('--fotos', type=int, help='fotos distintas dos atendimentos')
+    parser.add_argument('--anos', type=float, default=3, help='anos de histórico até a data de referência')
+    parser.add_argument('--data-ref', default='2026-01-01', help='data de referência (AAAA-MM-DD)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    params = dict(ESCALAS[args.escala])
+    for chave in params:
+        if getattr(args, chave) is not None:
+            params[chave] = getattr(args, chave)
+    contagens = gerar(args.destino, anos=args.anos, seed=args.seed,
+                      data_ref=datetime.strptime(args.data_ref, '%Y-%m-%d'), **params)
+    for tabela, total in contagens.items():
+        print(f'{tabela:<32}{total:>10}')
+
+
+if __name__ == '__main__':
+    main()
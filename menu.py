@@ -1,17 +1,42 @@
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, session, send_file, make_response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, session, send_file, make_response, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
-from flask_socketio import SocketIO, Namespace, emit
+from markupsafe import Markup
+from jinja2 import meta as jinja2_meta
+from flask_socketio import SocketIO, Namespace, join_room, leave_room
+from socketio import PubSubManager
 import sqlite3
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import NotFound
+import click
 import logging
+import logging.handlers
+import gzip
+import io
+import mimetypes
 import json
+import base64
+import bisect
+import hashlib
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from queue import LifoQueue, Queue, Empty
 from threading import Lock
+from eventlet import tpool
 import socket
+import struct
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,22 +47,567 @@ app.config['SECRET_KEY'] = 'sua_chave_secreta_aqui'
 DATA_DIR = os.environ.get("DATA_DIR", "/data")
 app.config['UPLOAD_FOLDER'] = os.path.join(DATA_DIR, "fotos_cadastro")
 app.config['FOTOS_INSUMOS_FOLDER'] = os.path.join(DATA_DIR, "fotos_insumos")
+app.config['RELATORIOS_FOLDER'] = os.path.join(DATA_DIR, "relatorios")
+app.config['RELATORIO_THUMBS_FOLDER'] = os.path.join(DATA_DIR, "cache", "relatorio_thumbs")
+app.config['UPLOADS_STAGING_FOLDER'] = os.path.join(DATA_DIR, "uploads_staging")
 DATABASE = os.path.join(DATA_DIR, "gestao.db")
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB limit
+app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE") == '1'  # Apache/lighttpd servem as fotos
 app.config['JSON_AS_ASCII'] = False  # garante acentuação correta no JSON
 app.config['JSONIFY_MIMETYPE'] = 'application/json; charset=utf-8'
+# Vários processos (WORKERS > 1): cada um tem seus próprios clientes Socket.IO, então
+# os emits passam por uma fila de mensagens. O Socket.IO é só websocket: a conexão
+# inteira fica no worker que a aceitou, sem precisar de sessão fixa.
+# SOCKETIO_MESSAGE_QUEUE aceita as URLs do Flask-SocketIO (redis://, amqp://, ...)
+# ou unix:///caminho.sock para o MessageBroker local do supervisor (sem rede nem
+# Redis). Vazio = processo único, sem fila.
+WORKERS = int(os.environ.get("WORKERS", "1"))
+WORKER_INDEX = int(os.environ["WORKER_INDEX"]) if os.environ.get("WORKER_INDEX") else None
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+app.config['RUN_FOLDER'] = os.path.join(DATA_DIR, "run")
+
+def send_frame(sock, payload):
+    """Quadro da fila local: tamanho (4 bytes, big-endian) + payload."""
+    sock.sendall(struct.pack('!I', len(payload)) + payload)
+
+def read_frame(reader):
+    """Lê um quadro de `reader` (arquivo binário); None quando a conexão fecha."""
+    head = reader.read(4)
+    if len(head) < 4:
+        return None
+    (size,) = struct.unpack('!I', head)
+    payload = reader.read(size)
+    return payload if len(payload) == size else None
+
+class UnixSocketManager(PubSubManager):
+    """Gerenciador de clientes do Socket.IO que troca mensagens pelo MessageBroker local.
+
+    Uma conexão publica (papel 'P') e outra assina (papel 'S'); o broker entrega
+    cada mensagem a todos os assinantes e o PubSubManager ignora as do próprio
+    processo, que já foram entregues localmente. Mensagens publicadas com o broker
+    fora do ar se perdem: as telas se acertam pelo /api/changes ao reconectar.
+    """
+
+    name = 'unix'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = url[len('unix://'):]
+        self._pub = None
+        self._pub_lock = Lock()
+
+    def _connect(self, role):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(role)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _publish(self, data):
+        payload = self.json.dumps(data).encode('utf-8')
+        with self._pub_lock:
+            # Uma nova tentativa se a conexão caiu (broker reiniciado)
+            for tentativa in range(2):
+                try:
+                    if self._pub is None:
+                        self._pub = self._connect(b'P')
+                    send_frame(self._pub, payload)
+                    return
+                except OSError as e:
+                    if self._pub is not None:
+                        self._pub.close()
+                        self._pub = None
+                    if tentativa:
+                        logger.error(f"Fila de mensagens indisponível ({self.path}): {str(e)}")
+
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connect(b'S')
+            except OSError as e:
+                logger.warning(f"Aguardando fila de mensagens em {self.path}: {str(e)}")
+                eventlet.sleep(1)
+                continue
+            try:
+                reader = sock.makefile('rb')
+                while True:
+                    payload = read_frame(reader)
+                    if payload is None:
+                        break
+                    yield payload
+            except OSError as e:
+                logger.warning(f"Conexão com a fila de mensagens perdida: {str(e)}")
+            finally:
+                sock.close()
+            eventlet.sleep(1)
+
+def socketio_queue_options(url):
+    """Argumentos do SocketIO para a fila de mensagens configurada."""
+    if not url:
+        return {}
+    if url.startswith('unix://'):
+        return {'client_manager': UnixSocketManager(url)}
+    return {'message_queue': url}
+
 # Initialize SocketIO with eventlet
-socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*", logger=True, engineio_logger=True)
+socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*", logger=True, engineio_logger=True,
+                    transports=['websocket'], **socketio_queue_options(SOCKETIO_MESSAGE_QUEUE))
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-db_lock = Lock()  # Thread lock for database operations
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Fotos: cada upload é decodificado uma vez e regravado em tamanhos fixos (maior lado, px)
+PHOTO_HASH_LEN = 32  # caracteres hex do sha256 no nome do arquivo
+PHOTO_SIZES = {'thumb': 320, 'medium': 1280, 'original': 2560}
+PHOTO_QUALITY = {'thumb': 70, 'medium': 80, 'original': 85}
+PHOTO_FORMAT = 'jpeg' if os.environ.get("PHOTO_FORMAT", "webp").lower() in ('jpg', 'jpeg') else 'webp'
+PHOTO_EXT = 'jpg' if PHOTO_FORMAT == 'jpeg' else 'webp'
+
+def photo_variant_name(filename):
+    """Nome do arquivo das variantes (thumb/medium) de uma foto, na subpasta do tamanho."""
+    return f"{os.path.splitext(filename)[0]}.{PHOTO_EXT}"
+
+def _write_photo_variants(src, folder, filename, sizes):
+    """Decodifica `src` (bytes ou caminho) e grava as variantes pedidas.
+
+    Aplica a orientação do EXIF e descarta os metadados. Cada arquivo é gravado
+    em .tmp e renomeado; a original vai por último, então sua existência indica
+    que as variantes também estão prontas. Roda em thread do tpool.
+    """
+    from PIL import Image as PILImage, ImageOps
+    with PILImage.open(io.BytesIO(src) if isinstance(src, bytes) else src) as im:
+        im = ImageOps.exif_transpose(im)
+        transparente = im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info)
+        im = im.convert('RGBA' if transparente and PHOTO_FORMAT == 'webp' else 'RGB')
+    for size in sorted(sizes, key=lambda k: PHOTO_SIZES[k]):
+        if size == 'original':
+            path = os.path.join(folder, filename)
+        else:
+            os.makedirs(os.path.join(folder, size), exist_ok=True)
+            path = os.path.join(folder, size, photo_variant_name(filename))
+        variant = im.copy()
+        variant.thumbnail((PHOTO_SIZES[size], PHOTO_SIZES[size]), PILImage.LANCZOS, reducing_gap=3.0)
+        if PHOTO_FORMAT == 'webp':
+            options = {'quality': PHOTO_QUALITY[size], 'method': 4}
+        else:
+            options = {'quality': PHOTO_QUALITY[size], 'optimize': True, 'progressive': True}
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            variant.save(tmp_path, PHOTO_FORMAT.upper(), **options)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def photo_content_name(digest):
+    """Nome da foto no armazenamento endereçado por conteúdo (sha256 do arquivo enviado)."""
+    return f"{digest.hexdigest()[:PHOTO_HASH_LEN]}.{PHOTO_EXT}"
+
+def reuse_photo(folder, filename):
+    """True se a foto já está gravada (mesmo conteúdo enviado antes).
+
+    Atualiza o mtime: o GC não apaga arquivos tocados há menos de PHOTO_GC_GRACE,
+    então a foto não some entre o upload repetido e o registro no banco.
+    """
+    path = os.path.join(folder, filename)
+    if not os.path.exists(path):
+        return False
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+def ingest_photo(file, folder, novas=None):
+    """Processa um upload: grava thumb, medium e original reencodados em `folder`.
+
+    Retorna o nome a guardar no banco, derivado do conteúdo: a mesma foto enviada
+    de novo reaproveita o arquivo existente sem reprocessar. Levanta ValueError se
+    o arquivo não é uma imagem válida. O Pillow roda no tpool, fora do hub.
+    Se `novas` é uma lista, recebe (nome, mtime) quando o arquivo foi gravado por
+    esta chamada (e não reaproveitado), para discard_new_photo() se o registro falhar.
+    """
+    data = file.read()
+    filename = photo_content_name(hashlib.sha256(data))
+    if reuse_photo(folder, filename):
+        return filename
+    os.makedirs(folder, exist_ok=True)
+    try:
+        tpool.execute(_write_photo_variants, data, folder, filename, list(PHOTO_SIZES))
+    except Exception as e:
+        remove_photo(folder, filename)
+        logger.error(f"Falha ao processar foto {file.filename}: {str(e)}")
+        raise ValueError(f"Imagem inválida: {file.filename}")
+    if novas is not None:
+        try:
+            novas.append((filename, os.path.getmtime(os.path.join(folder, filename))))
+        except OSError:
+            pass
+    return filename
+
+def remove_photo(folder, filename):
+    """Apaga a foto e suas variantes (ignora as que não existem)."""
+    paths = [os.path.join(folder, filename)]
+    paths += [os.path.join(folder, size, photo_variant_name(filename)) for size in PHOTO_SIZES if size != 'original']
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Fotos são imutáveis (nome com timestamp/id): cache longo no cliente e proxies
+PHOTO_MAX_AGE = int(os.environ.get("PHOTO_MAX_AGE", str(365 * 24 * 3600)))
+# Com nginx na frente: location interna apontando para DATA_DIR (ex.: /_data); vazio = Flask serve
+PHOTO_X_ACCEL_PREFIX = os.environ.get("PHOTO_X_ACCEL_PREFIX", "").rstrip('/')
+
+def send_photo(folder, filename, size):
+    """Resposta com a variante `size` da foto; fotos antigas ganham a variante na primeira vez.
+
+    send_file já cuida de ETag forte, 304 (If-None-Match/If-Modified-Since) e
+    Range; aqui entram o Cache-Control immutable e o repasse opcional para o
+    nginx (X-Accel-Redirect) ou X-Sendfile (USE_X_SENDFILE).
+    """
+    path = filename
+    if size not in (None, '', 'original') and os.path.exists(os.path.join(folder, filename)):
+        path = os.path.join(size, photo_variant_name(filename))
+        if not os.path.exists(os.path.join(folder, path)):
+            tpool.execute(_write_photo_variants, os.path.join(folder, filename), folder, filename, [size])
+    if PHOTO_X_ACCEL_PREFIX:
+        full_path = safe_join(folder, path)
+        if full_path is None or not os.path.isfile(full_path):
+            raise NotFound()
+        resp = make_response('')
+        resp.headers['X-Accel-Redirect'] = f"{PHOTO_X_ACCEL_PREFIX}/{os.path.relpath(full_path, DATA_DIR)}"
+        resp.mimetype = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    else:
+        resp = send_from_directory(folder, path, max_age=PHOTO_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = PHOTO_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp
+
+# Métricas em memória, expostas em /metrics no formato texto do Prometheus (sem
+# dependência externa). Por processo: no modo multi-processo raspe cada worker.
+METRICS_ENABLED = os.environ.get("METRICS", "1") != '0'
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # se definido, exige Authorization: Bearer <token>
+METRICS_MAX_QUERIES = 300  # consultas distintas acompanhadas; as demais entram como 'other'
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Metrics:
+    """Registro de contadores e histogramas, uma série por (nome, labels)."""
+
+    def __init__(self):
+        # Lock nativo: a seção crítica nunca cede ao hub, e o green lock custaria mais que a medição
+        self._lock = eventlet.patcher.original('threading').Lock()
+        self._meta = {}  # nome -> (tipo, ajuda, buckets)
+        self._series = {}  # nome -> {labels: valor | [contagens por bucket..., soma, total]}
+
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+        self._series[name] = {}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ('histogram', help_text, buckets)
+        self._series[name] = {}
+
+    def inc(self, name, value=1, **labels):
+        self.inc_key(name, tuple(sorted(labels.items())), value)
+
+    def inc_key(self, name, key, value=1):
+        """inc() com a chave de labels já montada (caminhos quentes guardam a chave)."""
+        with self._lock:
+            series = self._series[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        self.observe_key(name, tuple(sorted(labels.items())), value)
+
+    def observe_key(self, name, key, value):
+        buckets = self._meta[name][2]
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._series[name]
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [0] * (len(buckets) + 2)
+            if index < len(buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        def esc(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+    def render(self, gauges=()):
+        """Texto de exposição; `gauges` são (nome, ajuda, [(labels, valor)]) lidos na hora."""
+        lines = []
+        with self._lock:
+            snapshot = {name: {k: (list(v) if isinstance(v, list) else v) for k, v in series.items()}
+                        for name, series in self._series.items()}
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, data in snapshot[name].items():
+                if kind == 'counter':
+                    lines.append(f'{name}{self._labels(key)} {data}')
+                    continue
+                acc = 0
+                for bound, count in zip(buckets, data):
+                    acc += count
+                    lines.append(f'{name}_bucket{self._labels(key + (("le", bound),))} {acc}')
+                lines.append(f'{name}_bucket{self._labels(key + (("le", "+Inf"),))} {data[-1]}')
+                lines.append(f'{name}_sum{self._labels(key)} {data[-2]:.6f}')
+                lines.append(f'{name}_count{self._labels(key)} {data[-1]}')
+        for name, help_text, samples in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                lines.append(f'{name}{self._labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.histogram('http_request_duration_seconds', 'Tempo por rota até a resposta sair (streaming: até o primeiro pedaço).')
+metrics.histogram('http_response_size_bytes', 'Tamanho do corpo enviado por rota (após compressão).', SIZE_BUCKETS)
+metrics.counter('http_responses_streamed_total', 'Respostas em streaming (tamanho desconhecido) por rota.')
+metrics.histogram('db_query_seconds', 'Tempo do execute() por consulta SQL normalizada.')
+metrics.counter('db_fetch_seconds_total', 'Tempo em fetchall/fetchmany por consulta SQL normalizada.')
+metrics.histogram('db_pool_wait_seconds', 'Espera por uma conexão livre do pool de leitura.')
+metrics.histogram('db_writer_queue_wait_seconds', 'Espera de um job na fila do escritor até o início do lote.')
+metrics.histogram('db_writer_commit_seconds', 'Duração de cada lote do escritor (jobs + COMMIT).')
+metrics.counter('socketio_emits_total', 'Eventos publicados pelo servidor no Socket.IO, por tipo.')
+
+_SQL_SPACE = re.compile(r'\s+')
+_SQL_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SQL_NUMBER = re.compile(r'\b\d+\b')
+_query_keys = {}
+
+def query_key(sql):
+    """Chave de labels da consulta: SQL sem espaços repetidos, listas IN (?, ?, ...) e
+    números literais, para que cada formato de consulta seja uma série só."""
+    key = _query_keys.get(sql)
+    if key is None:
+        label = _SQL_NUMBER.sub('N', _SQL_IN_LIST.sub('(?...)', _SQL_SPACE.sub(' ', sql).strip()))[:200]
+        if len(_query_keys) >= METRICS_MAX_QUERIES * 4:
+            _query_keys.clear()
+        key = (('query', label),)
+        if len({*_query_keys.values()}) >= METRICS_MAX_QUERIES and key not in _query_keys.values():
+            key = (('query', 'other'),)
+        _query_keys[sql] = key
+    return key
+
+# Perfil de SQL opcional: com SLOW_QUERY_MS=<ms>, consultas acima do limite vão para
+# um log rotativo (JSON por linha) e para /admin/consultas-lentas com o EXPLAIN QUERY
+# PLAN, o formato dos parâmetros (só tipos, nunca valores) e a rota de origem.
+SLOW_QUERY_MS = float(os.environ["SLOW_QUERY_MS"]) if os.environ.get("SLOW_QUERY_MS") else None
+SLOW_QUERY_LOG = os.path.join(DATA_DIR, "logs", "slow_queries.log")
+SLOW_QUERY_LOG_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+SLOW_QUERY_PLAN_TTL = 300  # segundos: o EXPLAIN da mesma consulta roda no máximo uma vez nesse intervalo
+SLOW_QUERY_RECENT = 200  # ocorrências recentes mantidas em memória para a página
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+def params_shape(parameters):
+    """Tipos dos parâmetros ligados ('str', 'int', 'None'...), por posição ou por nome."""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    try:
+        return [type(value).__name__ for value in parameters]
+    except TypeError:
+        return None
+
+def query_origin():
+    """Rota que originou a consulta; jobs do escritor herdam a rota de quem os submeteu."""
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule is not None else request.path
+    return db_writer.current_origin or 'background'
+
+def plan_flags(plan):
+    flags = []
+    for line in plan:
+        if line.startswith('SCAN ') and ' INDEX ' not in line:
+            flags.append('scan')
+        if 'TEMP B-TREE' in line:
+            flags.append('temp_btree')
+    return sorted(set(flags))
+
+class SlowQueryLog:
+    """Consultas lentas: agregado por consulta normalizada + últimas ocorrências.
+
+    O plano é capturado na primeira ocorrência e de novo a cada `plan_ttl`; se
+    mudar em relação ao anterior, a troca é logada (regressão de plano).
+    """
+
+    def __init__(self, threshold_ms, path, max_bytes, backups, recent, plan_ttl):
+        self.threshold = threshold_ms / 1000
+        self.path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._plan_ttl = plan_ttl
+        self._recent = deque(maxlen=recent)
+        self._by_query = {}
+        self._file_logger = None
+
+    def _file(self):
+        if self._file_logger is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self._max_bytes, backupCount=self._backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            file_logger = logging.getLogger(f'{__name__}.slow_queries')
+            file_logger.propagate = False
+            file_logger.setLevel(logging.INFO)
+            file_logger.addHandler(handler)
+            self._file_logger = file_logger
+        return self._file_logger
+
+    def _explain(self, conn, sql, parameters):
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return []
+        try:
+            # Cursor base: o EXPLAIN não entra nas métricas nem neste log
+            cur = sqlite3.Cursor(conn)
+            rows = cur.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+            return [row[3] for row in rows]
+        except sqlite3.Error as e:
+            return [f'(EXPLAIN falhou: {str(e)})']
+
+    def record(self, conn, sql, parameters, label, elapsed):
+        now = time.time()
+        elapsed_ms = round(elapsed * 1000, 2)
+        origin = query_origin()
+        agg = self._by_query.get(label)
+        if agg is None:
+            agg = self._by_query[label] = {'query': label, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                           'plan': None, 'plan_at': 0, 'flags': [], 'routes': {}}
+        agg['count'] += 1
+        agg['total_ms'] += elapsed_ms
+        agg['max_ms'] = max(agg['max_ms'], elapsed_ms)
+        agg['last_at'] = now
+        agg['routes'][origin] = agg['routes'].get(origin, 0) + 1
+        if parameters is not None and now - agg['plan_at'] > self._plan_ttl:
+            plan = self._explain(conn, sql, parameters)
+            if agg['plan'] is not None and plan != agg['plan']:
+                logger.warning(f"Plano de consulta mudou ({label[:80]}): {agg['plan']} -> {plan}")
+            agg['plan'], agg['plan_at'], agg['flags'] = plan, now, plan_flags(plan)
+        entry = {
+            'at': datetime.fromtimestamp(now).strftime('%Y-%m-%dT%H:%M:%S'),
+            'ms': elapsed_ms,
+            'query': label,
+            'params': params_shape(parameters) if parameters is not None else None,
+            'route': origin,
+            'plan': agg['plan'],
+            'flags': agg['flags'],
+        }
+        self._recent.append(entry)
+        self._file().info(json.dumps(entry, ensure_ascii=False))
+
+    def summary(self):
+        queries = sorted(self._by_query.values(), key=lambda agg: agg['total_ms'], reverse=True)
+        return {
+            'threshold_ms': self.threshold * 1000,
+            'log': self.path,
+            'queries': [dict(agg, avg_ms=round(agg['total_ms'] / agg['count'], 2), total_ms=round(agg['total_ms'], 2))
+                        for agg in queries],
+            'recent': list(reversed(self._recent)),
+        }
+
+slow_queries = (SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_LOG, SLOW_QUERY_LOG_BYTES, SLOW_QUERY_LOG_BACKUPS,
+                             SLOW_QUERY_RECENT, SLOW_QUERY_PLAN_TTL)
+                if SLOW_QUERY_MS is not None else None)
+
+class MetricsCursor(sqlite3.Cursor):
+    """Cursor que mede execute/executemany e os fetch em lote da consulta.
+
+    Com o log de consultas lentas ativo, também registra as que passam do limite.
+    """
+
+    _key = (('query', 'other'),)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._key = query_key(sql)
+            metrics.observe_key('db_query_seconds', self._key, elapsed)
+            if slow_queries is not None and elapsed >= slow_queries.threshold:
+                slow_queries.record(self.connection, sql, parameters, self._key[0][1], elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._key = query_key(sql)
+            metrics.observe_key('db_query_seconds', self._key, elapsed)
+            if slow_queries is not None and elapsed >= slow_queries.threshold:
+                # Só a primeira linha de parâmetros serve para o EXPLAIN (se for lista)
+                first = seq_of_parameters[0] if isinstance(seq_of_parameters, list) and seq_of_parameters else None
+                slow_queries.record(self.connection, sql, first, self._key[0][1], elapsed)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.inc_key('db_fetch_seconds_total', self._key, time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            metrics.inc_key('db_fetch_seconds_total', self._key, time.perf_counter() - start)
+
+class MetricsConnection(sqlite3.Connection):
+    """Conexão cujos cursores (inclusive os de conn.execute) são MetricsCursor."""
+
+    def cursor(self, factory=MetricsCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+@app.before_request
+def _metrics_start():
+    g.metrics_start = time.perf_counter()
+
+# Registrado antes de compress_response, então roda depois dele (tamanho comprimido)
+@app.after_request
+def _metrics_record(resp):
+    start = g.pop('metrics_start', None)
+    if start is None or not METRICS_ENABLED:
+        return resp
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                    method=request.method, route=route, status=resp.status_code)
+    if resp.is_streamed:
+        metrics.inc('http_responses_streamed_total', route=route)
+    else:
+        metrics.observe('http_response_size_bytes', resp.content_length or 0, route=route)
+    return resp
+
 def get_db_connection():
     try:
-        conn = sqlite3.connect(DATABASE, check_same_thread=False)
+        instrumented = METRICS_ENABLED or slow_queries is not None
+        conn = sqlite3.connect(DATABASE, check_same_thread=False,
+                               factory=MetricsConnection if instrumented else sqlite3.Connection)
         conn.row_factory = sqlite3.Row
         conn.text_factory = str  # garante unicode
         return conn
@@ -46,6 +616,301 @@ def get_db_connection():
         raise
 
 
+# Pool de conexões SQLite
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))  # segundos esperando conexão livre
+DB_POOL_HEALTHCHECK_IDLE = float(os.environ.get("DB_POOL_HEALTHCHECK_IDLE", "30"))  # segundos ociosa antes do SELECT 1
+
+# Aplicados a cada conexão nova do pool
+DB_PRAGMAS = (
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA synchronous = NORMAL',  # seguro em WAL: só o checkpoint faz fsync
+    'PRAGMA cache_size = -16000',  # ~16MB de cache de páginas por conexão
+    'PRAGMA temp_store = MEMORY',
+)
+
+class SQLitePool:
+    """Pool limitado de conexões SQLite, compatível com eventlet.
+
+    - Conexões ociosas são reutilizadas em ordem LIFO (cache de páginas quente)
+    - Reentrante por greenlet: chamadas aninhadas recebem a mesma conexão
+    - Conexões ociosas há mais de `healthcheck_idle` segundos passam por SELECT 1
+    - Transações não confirmadas são desfeitas na devolução
+    """
+
+    def __init__(self, factory, size, timeout, healthcheck_idle, pragmas=()):
+        self._factory = factory
+        self._size = size
+        self._timeout = timeout
+        self._healthcheck_idle = healthcheck_idle
+        self._pragmas = pragmas
+        self._idle = LifoQueue()
+        self._slots = threading.Semaphore(size)
+        self._local = threading.local()  # greenlet-local após monkey_patch
+        self._stats_lock = Lock()
+        self._stats = {
+            'checkouts': 0,
+            'hits': 0,
+            'created': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'in_use': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+            'hold_ms_total': 0.0,
+            'hold_ms_max': 0.0,
+        }
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def _open(self):
+        conn = self._factory()
+        for pragma in self._pragmas:
+            conn.execute(pragma)
+        self._count(created=1)
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        self._count(discarded=1)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self):
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            self._count(waits=1)
+            if not self._slots.acquire(timeout=self._timeout):
+                self._count(timeouts=1)
+                raise sqlite3.OperationalError('Pool de conexões esgotado')
+        try:
+            conn = None
+            try:
+                conn, last_used = self._idle.get_nowait()
+                if time.monotonic() - last_used > self._healthcheck_idle and not self._healthy(conn):
+                    self._discard(conn)
+                    conn = None
+                else:
+                    self._count(hits=1)
+            except Empty:
+                pass
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited_ms = (time.monotonic() - start) * 1000
+        metrics.observe('db_pool_wait_seconds', waited_ms / 1000)
+        with self._stats_lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_ms_total'] += waited_ms
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], waited_ms)
+        self._local.conn = conn
+        self._local.depth = 1
+        self._local.since = time.monotonic()
+        return conn
+
+    def release(self, conn):
+        if getattr(self._local, 'conn', None) is not conn:
+            raise RuntimeError('Conexão devolvida por greenlet que não a retirou')
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+
+        held_ms = (time.monotonic() - self._local.since) * 1000
+        self._local.conn = None
+        with self._stats_lock:
+            self._stats['in_use'] -= 1
+            self._stats['hold_ms_total'] += held_ms
+            self._stats['hold_ms_max'] = max(self._stats['hold_ms_max'], held_ms)
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put((conn, time.monotonic()))
+        except sqlite3.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def clear(self):
+        """Fecha todas as conexões ociosas (ex.: arquivo do banco recriado)."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['size'] = self._size
+        snapshot['idle'] = self._idle.qsize()
+        return snapshot
+
+db_pool = SQLitePool(get_db_connection, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_IDLE, DB_PRAGMAS)
+
+def db_connection():
+    """Context manager que empresta uma conexão do pool: `with db_connection() as conn:`"""
+    return db_pool.connection()
+
+
+# Escritor único (WAL): leitores usam o pool sem bloqueio, escritas passam por uma fila
+DB_WRITER_BATCH = int(os.environ.get("DB_WRITER_BATCH", "32"))  # máximo de jobs por COMMIT
+
+class DBWriter:
+    """Fila de escrita servida por um único greenlet dono da conexão de escrita.
+
+    Cada job é uma função `fn(conn)` que não faz commit: ela roda dentro de um
+    SAVEPOINT próprio (uma falha desfaz só aquele job) e todos os jobs que
+    chegaram enquanto o escritor estava ocupado são confirmados juntos em um
+    único COMMIT (group commit). `submit` só retorna depois do COMMIT.
+    Jobs rodam fora do contexto da requisição: leia `request` antes de submeter.
+    """
+
+    def __init__(self, factory, batch_size, pragmas=()):
+        self._factory = factory
+        self._batch_size = batch_size
+        self._pragmas = pragmas
+        self._queue = Queue()
+        self._conn = None
+        self._worker = None
+        self.current_origin = None  # rota que submeteu o job em execução (perfil de SQL)
+        self._stats_lock = Lock()
+        self._stats = {
+            'jobs': 0,
+            'failed_jobs': 0,
+            'commits': 0,
+            'batch_max': 0,
+            'queue_wait_ms_total': 0.0,
+            'queue_wait_ms_max': 0.0,
+            'commit_ms_total': 0.0,
+        }
+
+    def _connect(self):
+        conn = self._factory()
+        # journal_mode é persistente no arquivo; precisa rodar fora de transação
+        conn.execute('PRAGMA journal_mode = WAL')
+        for pragma in self._pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def submit(self, fn):
+        if self._worker is None or self._worker.dead:
+            self._worker = eventlet.spawn(self._run)
+        done = eventlet.event.Event()
+        origin = query_origin() if slow_queries is not None else None
+        self._queue.put((fn, done, time.monotonic(), origin))
+        return done.wait()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.monotonic()
+        outcomes = []
+        try:
+            if self._conn is None:
+                self._conn = self._connect()
+            conn = self._conn
+            self.current_origin = 'db_writer'  # BEGIN do lote não pertence a um job só
+            conn.execute('BEGIN IMMEDIATE')
+            with app.app_context():
+                for fn, _, _, origin in batch:
+                    self.current_origin = origin
+                    conn.execute('SAVEPOINT job')
+                    try:
+                        outcomes.append((True, fn(conn)))
+                        conn.execute('RELEASE SAVEPOINT job')
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO SAVEPOINT job')
+                        conn.execute('RELEASE SAVEPOINT job')
+                        outcomes.append((False, e))
+            self.current_origin = None
+            conn.commit()
+        except Exception as e:
+            self.current_origin = None
+            logger.error(f"Falha no lote de escrita ({len(batch)} jobs): {str(e)}")
+            try:
+                if self._conn is not None:
+                    self._conn.rollback()
+            except sqlite3.Error:
+                self.reset()
+            outcomes = [(False, e)] * len(batch)
+
+        commit_ms = (time.monotonic() - started) * 1000
+        metrics.observe('db_writer_commit_seconds', commit_ms / 1000)
+        for _, _, queued_at, _ in batch:
+            metrics.observe('db_writer_queue_wait_seconds', started - queued_at)
+        with self._stats_lock:
+            self._stats['jobs'] += len(batch)
+            self._stats['failed_jobs'] += sum(1 for ok, _ in outcomes if not ok)
+            self._stats['commits'] += 1
+            self._stats['batch_max'] = max(self._stats['batch_max'], len(batch))
+            self._stats['commit_ms_total'] += commit_ms
+            for _, _, queued_at, _ in batch:
+                waited_ms = (started - queued_at) * 1000
+                self._stats['queue_wait_ms_total'] += waited_ms
+                self._stats['queue_wait_ms_max'] = max(self._stats['queue_wait_ms_max'], waited_ms)
+
+        for (_, done, _, _), (ok, value) in zip(batch, outcomes):
+            if ok:
+                done.send(value)
+            else:
+                done.send_exception(value)
+
+    def reset(self):
+        """Descarta a conexão de escrita; a próxima escrita reabre o arquivo."""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['queued'] = self._queue.qsize()
+        return snapshot
+
+db_writer = DBWriter(get_db_connection, DB_WRITER_BATCH, DB_PRAGMAS)
+
+
 import shutil
 
 DB_DST = DATABASE  # já é /data/gestao.db
@@ -61,255 +926,758 @@ if os.path.exists(DB_SRC) and not os.path.exists(DB_DST):
 # garante pastas de fotos
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['FOTOS_INSUMOS_FOLDER'], exist_ok=True)
+os.makedirs(app.config['RELATORIOS_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOADS_STAGING_FOLDER'], exist_ok=True)
+
+
+# Migrações do esquema, em ordem. PRAGMA user_version guarda a última aplicada;
+# bancos anteriores ao controle de versão ficam em 0 e passam por todas, por isso
+# os passos antigos continuam idempotentes (IF NOT EXISTS / checagem de colunas).
+def _migration_base_schema(conn):
+    """Tabelas originais, colunas adicionadas depois e o admin padrão."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS itens_cadastro (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo_item TEXT NOT NULL,
+            codigo_fabricacao TEXT,
+            codigo_interno TEXT NOT NULL UNIQUE,
+            nome_descricao TEXT NOT NULL,
+            foto TEXT,
+            categoria TEXT,
+            material TEXT,
+            maquina TEXT,
+            altura_min REAL,
+            altura_max REAL,
+            rpm INTEGER,
+            avanco REAL,
+            data_cadastro TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS composicao_ferramentas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ferramenta_id INTEGER,
+            insumo_id INTEGER,
+            quantidade INTEGER DEFAULT 1,
+            FOREIGN KEY (ferramenta_id) REFERENCES itens_cadastro (id),
+            FOREIGN KEY (insumo_id) REFERENCES itens_cadastro (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS itens_cadastro_deleted (
+            id INTEGER PRIMARY KEY,
+            tipo_item TEXT NOT NULL,
+            codigo_fabricacao TEXT,
+            codigo_interno TEXT NOT NULL,
+            nome_descricao TEXT NOT NULL,
+            foto TEXT,
+            categoria TEXT,
+            material TEXT,
+            maquina TEXT,
+            altura_min REAL,
+            altura_max REAL,
+            rpm INTEGER,
+            avanco REAL,
+            data_cadastro TEXT NOT NULL,
+            deleted_at TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS composicao_ferramentas_deleted (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ferramenta_id INTEGER,
+            insumo_id INTEGER,
+            quantidade INTEGER DEFAULT 1,
+            deleted_at TEXT NOT NULL,
+            FOREIGN KEY (ferramenta_id) REFERENCES itens_cadastro (id),
+            FOREIGN KEY (insumo_id) REFERENCES itens_cadastro (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ocorrencias (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            descricao TEXT,
+            tipo TEXT,
+            prioridade TEXT,
+            data TEXT,
+            status TEXT
+        )
+    ''')
+
+    # Localização por Células (opcional, mÃºltiplas por item)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS itens_celulas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            celula TEXT NOT NULL,
+            FOREIGN KEY (item_id) REFERENCES itens_cadastro (id)
+        )
+    ''')
+
+    # Máquinas por item (múltiplas)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS itens_maquinas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            maquina TEXT NOT NULL,
+            FOREIGN KEY (item_id) REFERENCES itens_cadastro (id)
+        )
+    ''')
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    tables = [t[0] for t in cursor.fetchall()]
+
+    if 'insumos' not in tables:
+        cursor.execute('''
+            CREATE TABLE insumos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                item_id INTEGER,
+                nome TEXT NOT NULL,
+                operador TEXT,
+                maquina TEXT,
+                quantidade INTEGER,
+                urgencia TEXT,
+                justificativa TEXT,
+                data TEXT,
+                status TEXT,
+                codigo_interno TEXT,
+                fotos TEXT,
+                sem_fotos INTEGER DEFAULT 0,
+                data_atendimento TEXT,
+                atendida_por TEXT,
+                FOREIGN KEY (item_id) REFERENCES itens_cadastro (id)
+            )
+        ''')
+    else:
+        cursor.execute("PRAGMA table_info(insumos)")
+        columns = [col['name'] for col in cursor.fetchall()]
+
+        # Verificar e adicionar colunas necessárias
+        if 'item_id' not in columns:
+            cursor.execute('ALTER TABLE insumos ADD COLUMN item_id INTEGER')
+        if 'codigo_interno' not in columns:
+            cursor.execute('ALTER TABLE insumos ADD COLUMN codigo_interno TEXT')
+        if 'fotos' not in columns:
+            cursor.execute('ALTER TABLE insumos ADD COLUMN fotos TEXT')
+        if 'sem_fotos' not in columns:
+            cursor.execute('ALTER TABLE insumos ADD COLUMN sem_fotos INTEGER DEFAULT 0')
+        if 'data_atendimento' not in columns:
+            cursor.execute('ALTER TABLE insumos ADD COLUMN data_atendimento TEXT')
+        if 'atendida_por' not in columns:
+            cursor.execute('ALTER TABLE insumos ADD COLUMN atendida_por TEXT')
+
+    # Admin auth table (for gestão)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admin (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM admin')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('INSERT INTO admin (username, password) VALUES (?, ?)', (
+            'ADMINISTRADOR', 'tooltag12345'
+        ))
+    # Migrate itens_cadastro and itens_cadastro_deleted for new columns if needed
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(itens_cadastro)")
+    ic_cols = [col['name'] for col in cursor.fetchall()]
+    if 'maquina' not in ic_cols:
+        cursor.execute('ALTER TABLE itens_cadastro ADD COLUMN maquina TEXT')
+
+    cursor.execute("PRAGMA table_info(itens_cadastro_deleted)")
+    icd_cols = [col['name'] for col in cursor.fetchall()]
+    if 'maquina' not in icd_cols:
+        cursor.execute('ALTER TABLE itens_cadastro_deleted ADD COLUMN maquina TEXT')
+
+    # Contadores globais (versão do catálogo para cache/ETag)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    # Começa no epoch: um banco recriado nunca repete versões já vistas pelos clientes
+    cursor.execute("""
+        INSERT OR IGNORE INTO app_meta (key, value)
+        VALUES ('catalog_version', CAST(strftime('%s', 'now') AS INTEGER))
+    """)
+
+def _migration_catalog_search(conn):
+    """Índices da busca paginada e índice FTS5 do cadastro."""
+    cursor = conn.cursor()
+    # Índices da busca paginada (ordenação por chave + filtros por máquina/célula)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_cadastro_nome ON itens_cadastro (nome_descricao)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_cadastro_tipo_nome ON itens_cadastro (tipo_item, nome_descricao)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_cadastro_tipo_codigo ON itens_cadastro (tipo_item, codigo_interno)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_maquinas_maquina ON itens_maquinas (maquina, item_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_maquinas_item ON itens_maquinas (item_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_celulas_celula ON itens_celulas (celula, item_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_celulas_item ON itens_celulas (item_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_composicao_ferramenta ON composicao_ferramentas (ferramenta_id)')
+
+    # Busca textual: FTS5 sobre o cadastro, sincronizada por triggers (qualquer rota de escrita)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'itens_cadastro_fts'")
+    fts_exists = cursor.fetchone() is not None
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS itens_cadastro_fts USING fts5(
+                nome_descricao, codigo_interno, codigo_fabricacao, categoria, material,
+                content='itens_cadastro', content_rowid='id',
+                tokenize="unicode61 remove_diacritics 2"
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite compilado sem FTS5: a busca continua funcionando com LIKE
+        logger.warning(f"FTS5 indisponível, busca do cadastro usará LIKE: {str(e)}")
+    else:
+        fts_cols = 'nome_descricao, codigo_interno, codigo_fabricacao, categoria, material'
+        new_vals = 'new.nome_descricao, new.codigo_interno, new.codigo_fabricacao, new.categoria, new.material'
+        old_vals = 'old.nome_descricao, old.codigo_interno, old.codigo_fabricacao, old.categoria, old.material'
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS itens_cadastro_fts_ai AFTER INSERT ON itens_cadastro BEGIN
+                INSERT INTO itens_cadastro_fts (rowid, {fts_cols}) VALUES (new.id, {new_vals});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS itens_cadastro_fts_ad AFTER DELETE ON itens_cadastro BEGIN
+                INSERT INTO itens_cadastro_fts (itens_cadastro_fts, rowid, {fts_cols}) VALUES ('delete', old.id, {old_vals});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS itens_cadastro_fts_au AFTER UPDATE ON itens_cadastro BEGIN
+                INSERT INTO itens_cadastro_fts (itens_cadastro_fts, rowid, {fts_cols}) VALUES ('delete', old.id, {old_vals});
+                INSERT INTO itens_cadastro_fts (rowid, {fts_cols}) VALUES (new.id, {new_vals});
+            END
+        ''')
+        if not fts_exists:
+            # Banco já populado antes do índice existir
+            cursor.execute("INSERT INTO itens_cadastro_fts (itens_cadastro_fts) VALUES ('rebuild')")
+
+def _migration_index_pack(conn):
+    """Índices das consultas quentes: código sem caixa, composição e insumos por item.
+
+    Os de fila e histórico (por data) ficam na migração 4, já sobre as colunas ISO.
+    """
+    cursor = conn.cursor()
+    # Duplicidade de código: WHERE lower(codigo_interno) = lower(?)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_itens_cadastro_codigo_lower ON itens_cadastro (lower(codigo_interno))')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_composicao_insumo ON composicao_ferramentas (insumo_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_composicao_deleted_ferramenta ON composicao_ferramentas_deleted (ferramenta_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_insumos_item ON insumos (item_id)')
 
+def iso_from_br_sql(column):
+    """Expressão SQL que converte 'dd/mm/aaaa HH:MM' (formato gravado pelas rotas) em ISO-8601.
 
-def init_db():
-    with db_lock:
-        with app.app_context():  # Ensure application context
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS itens_cadastro (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tipo_item TEXT NOT NULL,
-                    codigo_fabricacao TEXT,
-                    codigo_interno TEXT NOT NULL UNIQUE,
-                    nome_descricao TEXT NOT NULL,
-                    foto TEXT,
-                    categoria TEXT,
-                    material TEXT,
-                    maquina TEXT,
-                    altura_min REAL,
-                    altura_max REAL,
-                    rpm INTEGER,
-                    avanco REAL,
-                    data_cadastro TEXT NOT NULL
-                )
+    Aceita também só a data e valores já em ISO; qualquer outra coisa vira NULL.
+    """
+    return f"""CASE
+        WHEN {column} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9] [0-9][0-9]:[0-9][0-9]*'
+            THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) || 'T' || substr({column}, 12, 5)
+        WHEN {column} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'
+            THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) || 'T00:00'
+        WHEN {column} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9][ T][0-9][0-9]:[0-9][0-9]*'
+            THEN substr({column}, 1, 10) || 'T' || substr({column}, 12, 5)
+    END"""
+
+def _migration_iso_timestamps(conn):
+    """Datas ordenáveis: colunas geradas em ISO-8601 ao lado das datas de exibição.
+
+    Colunas VIRTUAL são calculadas na leitura, então valem para as linhas antigas
+    sem backfill e acompanham qualquer escrita; os índices de fila e histórico
+    materializam os valores (o texto dd/mm/aaaa não serve para intervalos).
+    """
+    cursor = conn.cursor()
+    for table, column in (('insumos', 'data'), ('insumos', 'data_atendimento'), ('ocorrencias', 'data')):
+        cols = [col['name'] for col in cursor.execute(f'PRAGMA table_xinfo({table})').fetchall()]
+        if f'{column}_iso' not in cols:
+            cursor.execute(f'''
+                ALTER TABLE {table} ADD COLUMN {column}_iso TEXT
+                GENERATED ALWAYS AS ({iso_from_br_sql(column)}) VIRTUAL
             ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS composicao_ferramentas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ferramenta_id INTEGER,
-                    insumo_id INTEGER,
-                    quantidade INTEGER DEFAULT 1,
-                    FOREIGN KEY (ferramenta_id) REFERENCES itens_cadastro (id),
-                    FOREIGN KEY (insumo_id) REFERENCES itens_cadastro (id)
-                )
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_insumos_data ON insumos (data_iso, id)')
+    # Parciais: a expressão do WHERE é a mesma das consultas, senão o planejador não usa
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_insumos_pendentes ON insumos (data_iso, id)
+        WHERE lower(ifnull(status,'')) <> 'atendido'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_insumos_atendidos ON insumos (COALESCE(data_atendimento_iso, data_iso), id)
+        WHERE lower(ifnull(status,'')) = 'atendido'
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ocorrencias_data ON ocorrencias (data_iso, id)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ocorrencias_fechadas ON ocorrencias (data_iso, id)
+        WHERE lower(ifnull(status,'')) IN ('fechada','atendida')
+    ''')
+
+# Tabelas acompanhadas pelo feed de alterações (/api/changes)
+CHANGE_LOG_TABLES = ('insumos', 'ocorrencias')
+
+def _migration_change_log(conn):
+    """Log de alterações de insumos/ocorrências mantido por triggers.
+
+    Uma linha por registro alterado: cada escrita substitui a linha anterior do
+    mesmo registro com uma versão nova (AUTOINCREMENT, nunca reutilizada), então o
+    log cresce com o número de registros, não de escritas. Exclusões ficam como
+    'delete' até serem podadas.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now'))
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_change_log_row ON change_log (tabela, row_id)')
+    for table in CHANGE_LOG_TABLES:
+        for suffix, event, ref, op in (('ai', 'INSERT', 'NEW', 'upsert'), ('au', 'UPDATE', 'NEW', 'upsert'),
+                                       ('ad', 'DELETE', 'OLD', 'delete')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS change_log_{table}_{suffix} AFTER {event} ON {table} BEGIN
+                    INSERT OR REPLACE INTO change_log (tabela, row_id, op) VALUES ('{table}', {ref}.id, '{op}');
+                END
             ''')
+    cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('change_log_min_version', 0)")
 
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS itens_cadastro_deleted (
-                    id INTEGER PRIMARY KEY,
-                    tipo_item TEXT NOT NULL,
-                    codigo_fabricacao TEXT,
-                    codigo_interno TEXT NOT NULL,
-                    nome_descricao TEXT NOT NULL,
-                    foto TEXT,
-                    categoria TEXT,
-                    material TEXT,
-                    maquina TEXT,
-                    altura_min REAL,
-                    altura_max REAL,
-                    rpm INTEGER,
-                    avanco REAL,
-                    data_cadastro TEXT NOT NULL,
-                    deleted_at TEXT NOT NULL
-                )
-            ''')
+def _migration_item_docs(conn):
+    """Ficha de cada item já serializada (item_docs) e a fila de fichas a regravar.
 
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS composicao_ferramentas_deleted (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ferramenta_id INTEGER,
-                    insumo_id INTEGER,
-                    quantidade INTEGER DEFAULT 1,
-                    deleted_at TEXT NOT NULL,
-                    FOREIGN KEY (ferramenta_id) REFERENCES itens_cadastro (id),
-                    FOREIGN KEY (insumo_id) REFERENCES itens_cadastro (id)
-                )
+    Triggers marcam em item_docs_dirty todo item cuja ficha mudou, inclusive as
+    ferramentas que trazem na composição o nome de um insumo alterado ou excluído;
+    refresh_item_docs() regrava só esses, na mesma transação da escrita. A leitura
+    por código (QR) vira um acesso pela chave primária que devolve os bytes prontos.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS item_docs (
+            codigo_interno TEXT PRIMARY KEY,
+            item_id INTEGER NOT NULL UNIQUE,
+            doc BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE TABLE IF NOT EXISTS item_docs_dirty (item_id INTEGER PRIMARY KEY)')
+    mark = 'INSERT OR IGNORE INTO item_docs_dirty (item_id)'
+    for suffix, event, ref in (('ai', 'INSERT', 'NEW'), ('au', 'UPDATE', 'NEW'), ('ad', 'DELETE', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS item_docs_itens_{suffix} AFTER {event} ON itens_cadastro BEGIN
+                {mark} VALUES ({ref}.id);
+                {mark} SELECT ferramenta_id FROM composicao_ferramentas WHERE insumo_id = {ref}.id;
+            END
+        ''')
+        for table, column in (('composicao_ferramentas', 'ferramenta_id'), ('itens_maquinas', 'item_id'),
+                              ('itens_celulas', 'item_id')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS item_docs_{table}_{suffix} AFTER {event} ON {table} BEGIN
+                    {mark} VALUES ({ref}.{column});
+                END
             ''')
+    # Fichas de todo o cadastro atual; init_db() grava logo depois das migrações
+    cursor.execute(f'{mark} SELECT id FROM itens_cadastro')
 
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ocorrencias (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    titulo TEXT NOT NULL,
-                    descricao TEXT,
-                    tipo TEXT,
-                    prioridade TEXT,
-                    data TEXT,
-                    status TEXT
-                )
-            ''')
+def _migration_foto_refs(conn):
+    """Contagem de referências de cada foto (foto_refs), mantida por triggers.
 
-            # Localização por Células (opcional, mÃºltiplas por item)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS itens_celulas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    item_id INTEGER NOT NULL,
-                    celula TEXT NOT NULL,
-                    FOREIGN KEY (item_id) REFERENCES itens_cadastro (id)
-                )
+    `pasta` é 'insumos' (nomes no JSON de insumos.fotos) ou 'cadastro'
+    (itens_cadastro.foto e a lixeira itens_cadastro_deleted). Linha com
+    contagem zero é apagada: foto ausente da tabela = sem referência.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS foto_refs (
+            pasta TEXT NOT NULL,
+            name TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (pasta, name)
+        ) WITHOUT ROWID
+    ''')
+    fotos = "json_each(CASE WHEN json_valid({ref}.fotos) THEN {ref}.fotos ELSE '[]' END)"
+    add_insumo = '''
+        INSERT INTO foto_refs (pasta, name, count)
+            SELECT 'insumos', value, COUNT(*) FROM {fotos} WHERE true GROUP BY value
+            ON CONFLICT (pasta, name) DO UPDATE SET count = count + excluded.count;
+    '''
+    del_insumo = '''
+        UPDATE foto_refs SET count = count - (SELECT COUNT(*) FROM {fotos} WHERE value = foto_refs.name)
+            WHERE pasta = 'insumos' AND name IN (SELECT value FROM {fotos});
+        DELETE FROM foto_refs WHERE pasta = 'insumos' AND count <= 0 AND name IN (SELECT value FROM {fotos});
+    '''
+    for suffix, event, body in (
+        ('ai', 'INSERT', add_insumo.format(fotos=fotos.format(ref='NEW'))),
+        ('ad', 'DELETE', del_insumo.format(fotos=fotos.format(ref='OLD'))),
+        ('au', 'UPDATE OF fotos', del_insumo.format(fotos=fotos.format(ref='OLD')) + add_insumo.format(fotos=fotos.format(ref='NEW'))),
+    ):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS foto_refs_insumos_{suffix} AFTER {event} ON insumos BEGIN
+                {body}
+            END
+        ''')
+    add_foto = '''
+        INSERT INTO foto_refs (pasta, name, count) SELECT 'cadastro', NEW.foto, 1 WHERE NEW.foto IS NOT NULL
+            ON CONFLICT (pasta, name) DO UPDATE SET count = count + 1;
+    '''
+    del_foto = '''
+        UPDATE foto_refs SET count = count - 1 WHERE pasta = 'cadastro' AND name = OLD.foto;
+        DELETE FROM foto_refs WHERE pasta = 'cadastro' AND name = OLD.foto AND count <= 0;
+    '''
+    for table in ('itens_cadastro', 'itens_cadastro_deleted'):
+        for suffix, event, body in (('ai', 'INSERT', add_foto), ('ad', 'DELETE', del_foto),
+                                    ('au', 'UPDATE OF foto', del_foto + add_foto)):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS foto_refs_{table}_{suffix} AFTER {event} ON {table} BEGIN
+                    {body}
+                END
             ''')
+    # Contagem inicial a partir do banco atual
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO foto_refs (pasta, name, count)
+            SELECT 'insumos', j.value, COUNT(*) FROM insumos, {fotos.format(ref='insumos')} j WHERE true GROUP BY j.value
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO foto_refs (pasta, name, count)
+            SELECT 'cadastro', foto, COUNT(*) FROM (
+                SELECT foto FROM itens_cadastro
+                UNION ALL
+                SELECT foto FROM itens_cadastro_deleted
+            ) WHERE foto IS NOT NULL GROUP BY foto
+    ''')
+
+MIGRATIONS = [
+    (1, 'esquema base', _migration_base_schema),
+    (2, 'busca do cadastro', _migration_catalog_search),
+    (3, 'índices de consultas', _migration_index_pack),
+    (4, 'datas ISO-8601', _migration_iso_timestamps),
+    (5, 'log de alterações', _migration_change_log),
+    (6, 'fichas pré-montadas dos itens', _migration_item_docs),
+    (7, 'referências das fotos', _migration_foto_refs),
+]
+
+def run_migrations(conn):
+    """Aplica as migrações pendentes; roda dentro de um job do escritor (BEGIN IMMEDIATE).
+
+    Com o lock de escrita tomado, dois processos subindo juntos não aplicam a mesma
+    migração duas vezes: o segundo já lê a user_version atualizada.
+    Retorna a lista de versões aplicadas.
+    """
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Aplicando migração {version}: {description}")
+        migrate(conn)
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        applied.append(version)
+    return applied
+
+# Atualizado por init_db(): False quando o SQLite não tem o módulo FTS5
+CATALOG_FTS = True
 
-            # Máquinas por item (múltiplas)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS itens_maquinas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    item_id INTEGER NOT NULL,
-                    maquina TEXT NOT NULL,
-                    FOREIGN KEY (item_id) REFERENCES itens_cadastro (id)
-                )
-            ''')
+def init_db():
+    # Migrações rodam como um job do escritor (uma transação só)
+    def _migrate(conn):
+        applied = run_migrations(conn)
+        # Também pega itens alterados fora do app (scripts de carga, gerar_dados.py)
+        refresh_item_docs(conn)
+        has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'itens_cadastro_fts'").fetchone()
+        return applied, has_fts is not None
+
+    global CATALOG_FTS
+    with app.app_context():  # Ensure application context
+        applied, CATALOG_FTS = db_writer.submit(_migrate)
+    if applied:
+        logger.info(f"Banco migrado para a versão {applied[-1]}")
+
+# Eventos de estado: só o servidor publica, depois do commit. Cada evento é
+# tipado ('<entidade>.<ação>'), leva a versão do formato e só os campos que a
+# tela precisa; vai apenas para as salas das telas que exibem aquela entidade.
+EVENTS_SCHEMA = 1
+EVENT_ROOMS = {
+    'insumo': ('gestao', 'atendidos'),
+    'ocorrencia': ('gestao', 'ocorrencias'),
+    'item': ('catalogo',),
+}
+EVENT_VIEWS = frozenset(room for rooms in EVENT_ROOMS.values() for room in rooms)
+
+def publish_event(event, entity_id, data=None):
+    """Emite `event` (ex.: 'insumo.updated') para as salas da entidade no namespace /gestao."""
+    payload = {'v': EVENTS_SCHEMA, 'type': event, 'id': entity_id}
+    if data:
+        payload['data'] = data
+    rooms = EVENT_ROOMS[event.split('.', 1)[0]]
+    metrics.inc('socketio_emits_total', event=event)
+    try:
+        socketio.emit(event, payload, namespace='/gestao', to=list(rooms))
+    except Exception as e:
+        # O commit já aconteceu; quem perdeu o evento se acerta pelo /api/changes
+        logger.error(f"Erro ao publicar evento {event} ({entity_id}): {str(e)}")
 
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [t[0] for t in cursor.fetchall()]
-            
-            if 'insumos' not in tables:
-                cursor.execute('''
-                    CREATE TABLE insumos (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        item_id INTEGER,
-                        nome TEXT NOT NULL,
-                        operador TEXT,
-                        maquina TEXT,
-                        quantidade INTEGER,
-                        urgencia TEXT,
-                        justificativa TEXT,
-                        data TEXT,
-                        status TEXT,
-                        codigo_interno TEXT,
-                        fotos TEXT,
-                        sem_fotos INTEGER DEFAULT 0,
-                        data_atendimento TEXT,
-                        atendida_por TEXT,
-                        FOREIGN KEY (item_id) REFERENCES itens_cadastro (id)
-                    )
-                ''')
-            else:
-                cursor.execute("PRAGMA table_info(insumos)")
-                columns = [col['name'] for col in cursor.fetchall()]
-                
-                # Verificar e adicionar colunas necessárias
-                if 'item_id' not in columns:
-                    cursor.execute('ALTER TABLE insumos ADD COLUMN item_id INTEGER')
-                if 'codigo_interno' not in columns:
-                    cursor.execute('ALTER TABLE insumos ADD COLUMN codigo_interno TEXT')
-                if 'fotos' not in columns:
-                    cursor.execute('ALTER TABLE insumos ADD COLUMN fotos TEXT')
-                if 'sem_fotos' not in columns:
-                    cursor.execute('ALTER TABLE insumos ADD COLUMN sem_fotos INTEGER DEFAULT 0')
-                if 'data_atendimento' not in columns:
-                    cursor.execute('ALTER TABLE insumos ADD COLUMN data_atendimento TEXT')
-                if 'atendida_por' not in columns:
-                    cursor.execute('ALTER TABLE insumos ADD COLUMN atendida_por TEXT')
-                    
-            conn.commit()
-            # Admin auth table (for gestão)
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS admin (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL,
-                    password TEXT NOT NULL
-                )
-            ''')
-            cursor.execute('SELECT COUNT(*) FROM admin')
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('INSERT INTO admin (username, password) VALUES (?, ?)', (
-                    'ADMINISTRADOR', 'tooltag12345'
-                ))
-            conn.commit()
-            # Migrate itens_cadastro and itens_cadastro_deleted for new columns if needed
-            cursor = conn.cursor()
-            cursor.execute("PRAGMA table_info(itens_cadastro)")
-            ic_cols = [col['name'] for col in cursor.fetchall()]
-            if 'maquina' not in ic_cols:
-                cursor.execute('ALTER TABLE itens_cadastro ADD COLUMN maquina TEXT')
-
-            cursor.execute("PRAGMA table_info(itens_cadastro_deleted)")
-            icd_cols = [col['name'] for col in cursor.fetchall()]
-            if 'maquina' not in icd_cols:
-                cursor.execute('ALTER TABLE itens_cadastro_deleted ADD COLUMN maquina TEXT')
-            conn.commit()
-            conn.close()
+def response_ok(resp):
+    """True se o retorno de uma rota (Response ou tupla (Response, status)) é 2xx."""
+    status = resp[1] if isinstance(resp, tuple) else getattr(resp, 'status_code', 200)
+    return 200 <= status < 300
 
 # Define the /gestao namespace for SocketIO
 class GestaoNamespace(Namespace):
     def on_connect(self):
         logger.info("Client connected to /gestao namespace")
 
-    def on_disconnect(self):
+    def on_disconnect(self, reason=None):
         logger.info("Client disconnected from /gestao namespace")
 
-    def on_new_solicitation(self, data):
-        logger.info(f"Received new_solicitation: {data}")
-        emit('new_solicitation', data, broadcast=True, namespace='/gestao')
+    def on_subscribe(self, data):
+        """Entra nas salas das telas pedidas: {"views": ["gestao", ...]}. Devolve as aceitas."""
+        views = data.get('views') if isinstance(data, dict) else None
+        joined = [view for view in (views or []) if view in EVENT_VIEWS]
+        for view in joined:
+            join_room(view)
+        return {'views': joined, 'v': EVENTS_SCHEMA}
+
+    def on_unsubscribe(self, data):
+        views = data.get('views') if isinstance(data, dict) else None
+        for view in (views or []):
+            if view in EVENT_VIEWS:
+                leave_room(view)
 
 # Register the namespace
 socketio.on_namespace(GestaoNamespace('/gestao'))
 
+# Compressão: gzip (ou brotli, se instalado) para JSON/HTML acima de COMPRESS_MIN_SIZE
+try:
+    import brotli
+except ImportError:  # opcional: sem ele só gzip
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))  # bytes
+COMPRESS_LEVEL = 6  # gzip dinâmico (velocidade x tamanho)
+COMPRESS_BR_QUALITY = 5  # brotli dinâmico; as variantes prontas usam o máximo
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                          'application/json', 'application/x-ndjson', 'image/svg+xml'}
+
+def negotiate_encoding(available=('br', 'gzip')):
+    """Melhor Content-Encoding aceito pelo cliente entre `available` (None = sem compressão)."""
+    if brotli is None:
+        available = [e for e in available if e != 'br']
+    return request.accept_encodings.best_match(list(available)) if available else None
+
+def _compress(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else COMPRESS_BR_QUALITY)
+    return gzip.compress(data, 9 if best else COMPRESS_LEVEL, mtime=0)
+
+def _compress_stream(chunks, encoding):
+    """Comprime uma resposta em streaming pedaço a pedaço (flush a cada pedaço)."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BR_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # 31 = formato gzip
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+class PrecompressedCache:
+    """Corpos que não mudam por requisição, guardados já comprimidos no nível máximo.
+
+    Chave -> (versão, etag, {encoding: bytes}); a versão (mtimes dos arquivos) invalida
+    a entrada. Usado para páginas sem dados dinâmicos e arquivos de /static.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def response(self, key, version, build, mimetype):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            body = build()
+            variants = {'identity': body, 'gzip': _compress(body, 'gzip', best=True)}
+            if brotli is not None:
+                variants['br'] = _compress(body, 'br', best=True)
+            entry = (version, hashlib.sha1(body).hexdigest()[:20], variants)
+            self._entries[key] = entry
+        _, etag, variants = entry
+        encoding = negotiate_encoding([e for e in ('br', 'gzip') if e in variants]) or 'identity'
+        resp = make_response(variants[encoding])
+        resp.mimetype = mimetype
+        if encoding != 'identity':
+            resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(etag if encoding == 'identity' else f'{etag}-{encoding}')
+        resp.vary.add('Accept-Encoding')
+        return resp.make_conditional(request)
+
+precompressed = PrecompressedCache()
+
+def template_sources(name, found=None):
+    """Arquivos de um template e de todos os que ele estende, inclui ou importa."""
+    found = {} if found is None else found
+    if name in found:
+        return found
+    source, filename, _ = app.jinja_env.loader.get_source(app.jinja_env, name)
+    found[name] = filename
+    for ref in jinja2_meta.find_referenced_templates(app.jinja_env.parse(source)):
+        if ref:  # None: nome calculado em tempo de execução
+            template_sources(ref, found)
+    return found
+
+# Template -> arquivos de que a página depende (ela, base.html, includes...)
+_page_sources = {}
+
+def render_static_page(template):
+    """render_template para páginas sem dados por requisição: renderiza uma vez e
+    responde com a variante já comprimida (ETag + revalidação).
+
+    Com TEMPLATES_AUTO_RELOAD, a versão é o mtime de todos os arquivos envolvidos
+    (editar base.html invalida as páginas que a estendem); sem ele o Jinja também
+    não relê templates, então a página vale pela vida do processo.
+    """
+    if app.debug:
+        return render_template(template)
+    version = None
+    if app.jinja_env.auto_reload:
+        files = _page_sources.get(template)
+        if files is None:
+            files = _page_sources[template] = list(template_sources(template).values())
+        try:
+            version = tuple(os.path.getmtime(f) for f in files)
+        except OSError:
+            version = None
+
+    def _build():
+        if app.jinja_env.auto_reload:
+            # Uma edição pode trocar os includes: refaz a lista junto com a página
+            _page_sources[template] = list(template_sources(template).values())
+        return render_template(template).encode('utf-8')
+
+    resp = precompressed.response(f'page:{template}', version, _build, 'text/html')
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.after_request
+def compress_response(resp):
+    """Comprime respostas JSON/HTML grandes conforme o Accept-Encoding.
+
+    Arquivos de /static compressíveis saem do PrecompressedCache; demais arquivos
+    (fotos, PDF) passam direto. O ETag ganha o sufixo da codificação, e um
+    If-None-Match com esse sufixo vira 304.
+    """
+    if resp.status_code != 200 or 'Content-Encoding' in resp.headers or request.method == 'HEAD':
+        return resp
+    if resp.mimetype not in COMPRESSIBLE_MIMETYPES or 'no-transform' in (resp.headers.get('Cache-Control') or ''):
+        return resp
+    if request.endpoint == 'static' and resp.direct_passthrough:
+        path = safe_join(app.static_folder, (request.view_args or {}).get('filename', ''))
+        if not path or not os.path.isfile(path):
+            return resp
+        resp.close()
+        def _read():
+            with open(path, 'rb') as f:
+                return f.read()
+        static_resp = precompressed.response(f'static:{path}', os.path.getmtime(path), _read, resp.mimetype)
+        static_resp.headers['Cache-Control'] = resp.headers.get('Cache-Control') or 'no-cache'
+        return static_resp
+    if resp.direct_passthrough:
+        return resp
+    if resp.is_streamed:
+        encoding = negotiate_encoding()
+        resp.vary.add('Accept-Encoding')
+        if encoding:
+            resp.response = _compress_stream(resp.iter_encoded(), encoding)
+            resp.headers['Content-Encoding'] = encoding
+            resp.headers.pop('Content-Length', None)
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return resp
+    resp.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if not encoding:
+        return resp
+    etag, weak = resp.get_etag()
+    if etag:
+        etag = f'{etag}-{encoding}'
+        resp.set_etag(etag, weak)
+        if request.if_none_match.contains_weak(etag):
+            resp.status_code = 304
+            resp.set_data(b'')
+            resp.headers.pop('Content-Length', None)
+            return resp
+    resp.set_data(_compress(data, encoding))
+    resp.headers['Content-Encoding'] = encoding
+    return resp
+
 @app.route('/')
 def index():
     logger.info("Rendering index.html")
-    return render_template('index.html')
+    return render_static_page('index.html')
 
 @app.route('/busca')
 def busca():
     logger.info("Rendering busca.html")
-    return render_template('busca.html')
+    return render_static_page('busca.html')
 
 @app.route('/qrcode')
 def qrcode():
     logger.info("Rendering qrcode.html")
-    return render_template('qrcode.html')
+    return render_static_page('qrcode.html')
 
 @app.route('/solicitar_insumo', methods=['GET', 'POST'])
 def solicitar_insumo():
     if request.method == 'POST':
         logger.info(f"Received POST request to /solicitar_insumo: {request.form}")
-        with db_lock:
-            with app.app_context():  # Ensure application context
-                conn = None
-                try:
-                    conn = get_db_connection()
+        with app.app_context():  # Ensure application context
+            try:
+                item_id = request.form.get('item_id')
+                nome = request.form.get('nome')
+                operador = request.form.get('operador')
+                maquina = request.form.get('maquina')
+                quantidade = request.form.get('quantidade')
+                # Aceitar tanto 'urgencia' quanto variantes com acento oriundas do front
+                urgencia = request.form.get('urgencia')
+                if not urgencia:
+                    for k in request.form.keys():
+                        try:
+                            if 'urg' in k.lower():
+                                urgencia = request.form.get(k)
+                                if urgencia:
+                                    break
+                        except Exception:
+                            continue
+                justificativa = request.form.get('justificativa')
+
+                if not all([item_id, nome, operador, maquina, quantidade, urgencia, justificativa]):
+                    logger.error("Missing required fields in solicitation")
+                    flash('Todos os campos obrigatórios devem ser preenchidos.', 'error')
+                    return redirect(url_for('solicitar_insumo'))
+
+                quantidade = int(quantidade)
+                if quantidade <= 0:
+                    logger.error("Invalid quantity: must be greater than zero")
+                    flash('Quantidade deve ser maior que zero.', 'error')
+                    return redirect(url_for('solicitar_insumo'))
+
+                def _inserir(conn):
                     cursor = conn.cursor()
-                    item_id = request.form.get('item_id')
-                    nome = request.form.get('nome')
-                    operador = request.form.get('operador')
-                    maquina = request.form.get('maquina')
-                    quantidade = request.form.get('quantidade')
-                    # Aceitar tanto 'urgencia' quanto variantes com acento oriundas do front
-                    urgencia = request.form.get('urgencia')
-                    if not urgencia:
-                        for k in request.form.keys():
-                            try:
-                                if 'urg' in k.lower():
-                                    urgencia = request.form.get(k)
-                                    if urgencia:
-                                        break
-                            except Exception:
-                                continue
-                    justificativa = request.form.get('justificativa')
-
-                    if not all([item_id, nome, operador, maquina, quantidade, urgencia, justificativa]):
-                        logger.error("Missing required fields in solicitation")
-                        flash('Todos os campos obrigatórios devem ser preenchidos.', 'error')
-                        return redirect(url_for('solicitar_insumo'))
-
-                    quantidade = int(quantidade)
-                    if quantidade <= 0:
-                        logger.error("Invalid quantity: must be greater than zero")
-                        flash('Quantidade deve ser maior que zero.', 'error')
-                        return redirect(url_for('solicitar_insumo'))
-
                     cursor.execute('SELECT id, tipo_item FROM itens_cadastro WHERE id = ?', (item_id,))
                     item = cursor.fetchone()
                     if not item or item['tipo_item'] not in ['insumo', 'ferramenta']:
-                        logger.error(f"Invalid or non-existent item_id: {item_id}")
-                        flash('Item selecionado inválido ou não cadastrado.', 'error')
-                        return redirect(url_for('solicitar_insumo'))
+                        return None
 
                     data_criacao = datetime.now().strftime('%d/%m/%Y %H:%M')
                     cursor.execute('''
@@ -327,32 +1695,35 @@ def solicitar_insumo():
                         'Pendente'
                     ))
                     insumo_id = cursor.lastrowid
-                    conn.commit()
 
                     # Fetch the inserted insumo for emitting
                     cursor.execute('SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo FROM insumos i LEFT JOIN itens_cadastro ic ON i.item_id = ic.id WHERE i.id = ?', (insumo_id,))
-                    new_insumo = dict(cursor.fetchone())
-                    conn.close()
-
-                    # Emit WebSocket event to all connected clients
-                    logger.info(f"Emitting new_solicitation with id: {insumo_id}, data: {new_insumo}")
-                    socketio.emit('new_solicitation', new_insumo, namespace='/gestao')
-
-                    flash('Solicitação enviada com sucesso!', 'success')
-                    return jsonify({'id': insumo_id})  # Return JSON for client-side handling
-                except sqlite3.Error as e:
-                    if conn is not None:
-                        conn.rollback()
-                        conn.close()
-                    logger.error(f"Database error in /solicitar_insumo: {str(e)}")
-                    flash(f'Erro ao enviar solicitação: {str(e)}', 'error')
-                    return jsonify({'error': str(e)}), 500
-                except ValueError as e:
-                    if conn is not None:
-                        conn.close()
-                    logger.error(f"Validation error in /solicitar_insumo: {str(e)}")
-                    flash(f'Erro de validação: {str(e)}', 'error')
-                    return jsonify({'error': str(e)}), 400
+                    return dict(cursor.fetchone())
+
+                new_insumo = db_writer.submit(_inserir)
+                if new_insumo is None:
+                    logger.error(f"Invalid or non-existent item_id: {item_id}")
+                    flash('Item selecionado inválido ou não cadastrado.', 'error')
+                    return redirect(url_for('solicitar_insumo'))
+                insumo_id = new_insumo['id']
+
+                publish_event('insumo.created', insumo_id, {
+                    'nome_item': new_insumo.get('nome_item') or new_insumo.get('nome'),
+                    'tipo': new_insumo.get('tipo'),
+                    'urgencia': new_insumo.get('urgencia'),
+                    'status': new_insumo.get('status'),
+                })
+
+                flash('Solicitação enviada com sucesso!', 'success')
+                return jsonify({'id': insumo_id})  # Return JSON for client-side handling
+            except sqlite3.Error as e:
+                logger.error(f"Database error in /solicitar_insumo: {str(e)}")
+                flash(f'Erro ao enviar solicitação: {str(e)}', 'error')
+                return jsonify({'error': str(e)}), 500
+            except ValueError as e:
+                logger.error(f"Validation error in /solicitar_insumo: {str(e)}")
+                flash(f'Erro de validação: {str(e)}', 'error')
+                return jsonify({'error': str(e)}), 400
     logger.info("Rendering solicitar_insumo.html")
     return render_template('solicitar_insumo.html')
 
@@ -362,568 +1733,503 @@ def ocorrencias_page():
     if not session.get('gestao_logged'):
         return redirect(url_for('login', next=request.path))
     if request.method == 'POST':
-        with db_lock:
-            with app.app_context():  # Ensure application context
-                conn = None
-                try:
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('''
+        with app.app_context():  # Ensure application context
+            try:
+                valores = (
+                    request.form.get('titulo'),
+                    request.form.get('descricao'),
+                    request.form.get('tipo'),
+                    request.form.get('prioridade'),
+                    datetime.now().strftime('%d/%m/%Y %H:%M'),
+                    'Aberta'
+                )
+
+                def _inserir(conn):
+                    cursor = conn.execute('''
                         INSERT INTO ocorrencias (titulo, descricao, tipo, prioridade, data, status)
                         VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        request.form.get('titulo'),
-                        request.form.get('descricao'),
-                        request.form.get('tipo'),
-                        request.form.get('prioridade'),
-                        datetime.now().strftime('%d/%m/%Y %H:%M'),
-                        'Aberta'
-                    ))
-                    conn.commit()
-                    conn.close()
-                    logger.info("Ocorrência registrada com sucesso")
-                    flash('Ocorrência registrada com sucesso!', 'success')
-                    return redirect(url_for('ocorrencias_page'))
-                except sqlite3.Error as e:
-                    if conn is not None:
-                        conn.rollback()
-                        conn.close()
-                    logger.error(f"Erro ao registrar ocorrência: {str(e)}")
-                    flash(f'Erro ao registrar ocorrência: {str(e)}', 'error')
-                    return redirect(url_for('ocorrencias_page'))
+                    ''', valores)
+                    return cursor.lastrowid
+
+                ocorrencia_id = db_writer.submit(_inserir)
+                publish_event('ocorrencia.created', ocorrencia_id, {
+                    'titulo': valores[0], 'prioridade': valores[3], 'status': 'Aberta'})
+                logger.info("Ocorrência registrada com sucesso")
+                flash('Ocorrência registrada com sucesso!', 'success')
+                return redirect(url_for('ocorrencias_page'))
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao registrar ocorrência: {str(e)}")
+                flash(f'Erro ao registrar ocorrência: {str(e)}', 'error')
+                return redirect(url_for('ocorrencias_page'))
     with app.app_context():  # Ensure application context
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM ocorrencias ORDER BY id DESC')
-        ocorrencias = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM ocorrencias ORDER BY id DESC')
+            ocorrencias = [dict(row) for row in cursor.fetchall()]
         logger.info(f"Rendering ocorrencias.html com {len(ocorrencias)} ocorrências")
         return render_template('ocorrencias.html', ocorrencias=ocorrencias)
 
-def build_relatorio_pdf(filtered, q_titulo, q_prioridade, q_atendida):
-    """Gera PDF com Platypus (layout moderno):
-    - Cabeçalho com barra e filtros, sem poluição
-    - Tabela com textos formatados e espaçamentos coerentes
-    - Fotos em linha abaixo de cada solicitação
-    - Página de gráfico sem cabeçalho de colunas
+# Relatórios em PDF: processos worker (relatorio_pdf.py) alimentados por uma fila
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "2"))  # relatórios gerados em paralelo
+REPORT_JOB_TTL = float(os.environ.get("REPORT_JOB_TTL", "3600"))  # segundos até apagar um resultado
+REPORT_WAIT_TIMEOUT = float(os.environ.get("REPORT_WAIT_TIMEOUT", "120"))  # espera máxima da rota síncrona
+
+class ReportQueue:
+    """Fila de relatórios atendida por processos `python relatorio_pdf.py` persistentes.
+
+    Cada worker é um greenlet dono de um subprocesso; o job vai como uma linha JSON
+    no stdin e a resposta volta no stdout (pipes verdes, o hub segue livre). O PDF é
+    gravado direto em `folder/<id>.pdf` e apagado REPORT_JOB_TTL segundos depois.
+    O estado do job também vai para `folder/<id>.json`: com vários workers, o
+    status e o download podem ser pedidos a um processo que não gerou o relatório.
     """
-    from reportlab.lib.pagesizes import A4
-    from reportlab.platypus import (BaseDocTemplate, PageTemplate, Frame,
-                                    Table, TableStyle, Paragraph, Spacer, Image,
-                                    PageBreak, NextPageTemplate)
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    import io, os
-
-    width, height = A4
-    buf = io.BytesIO()
-
-    # Document with two page templates: Table and Chart
-    doc = BaseDocTemplate(
-        buf, pagesize=A4,
-        leftMargin=36, rightMargin=36, topMargin=130, bottomMargin=36
-    )
-    frame = Frame(doc.leftMargin, doc.bottomMargin,
-                  doc.width, doc.height, id='normal')
-
-    info = f"Filtros: titulo: '{q_titulo or 'Todos'}' | Prioridade: '{q_prioridade or 'Todas'}' | Atendida por: '{q_atendida or 'Todos'}'"
-    occ_count = sum(1 for it in filtered if (it.get('source') or '').lower() == 'ocorrencia')
-
-    def header_common(c):
-        c.setFillColorRGB(0.16, 0.22, 0.31)
-        c.rect(0, height-60, width, 60, fill=1, stroke=0)
-        c.setFillColor(colors.white)
-        c.setFont('Helvetica-Bold', 16)
-        c.drawString(40, height - 40, 'Relatorio de Ocorrencias e Atendidos')
-        # Filtros resumidos
-        c.setFillColor(colors.black)
-        c.setFont('Helvetica', 10)
-        c.drawString(40, height - 75, info)
-        c.drawString(40, height - 90, f"Total atendidos: {len(filtered)}")
-
-    def header_table(c, _doc):
-        header_common(c)
-        # Cabeçalho das colunas com cantos levemente arredondados
-        y = height - 110
-        c.setFillColorRGB(0.91, 0.95, 0.99)
-        try:
-            c.roundRect(36, y-4, width-72, 20, 6, fill=1, stroke=0)
-        except Exception:
-            c.rect(36, y-4, width-72, 20, fill=1, stroke=0)
-        c.setFillColor(colors.black)
-        c.setFont('Helvetica-Bold', 9)
-        avail = _doc.width
-        col1, col3, col4, col5 = 60, 80, 80, 80
-        col2 = max(120, avail - (col1 + col3 + col4 + col5))
-        xs = [40, 40 + col1, 40 + col1 + col2, 40 + col1 + col2 + col3, 40 + col1 + col2 + col3 + col4]
-        headers = ['Tipo', 'Solicitante/Titulo', 'Prioridade', 'Data', 'Atendida por']
-        for i, h in enumerate(headers):
-            c.drawString(xs[i], y, h)
-
-    def header_chart(c, _doc):
-        # Apenas barra e filtros; sem cabeçalho de colunas
-        header_common(c)
-
-    doc.addPageTemplates([
-        PageTemplate(id='Table', frames=[frame], onPage=header_table),
-        PageTemplate(id='Chart', frames=[frame], onPage=header_chart),
-    ])
 
-    styles = getSampleStyleSheet()
-    small = ParagraphStyle('small', parent=styles['Normal'], fontName='Helvetica', fontSize=9, leading=12)
-    meta = ParagraphStyle('meta', parent=styles['Normal'], fontName='Helvetica', fontSize=9, leading=12, textColor=colors.gray)
-    meta_bold = ParagraphStyle('meta_bold', parent=meta, fontName='Helvetica-Bold')
-
-    story = []
-    # Tabela (linhas) – usa PageTemplate 'Table'
-    story.append(NextPageTemplate('Table'))
-
-    avail = doc.width
-    col1, col3, col4, col5 = 60, 80, 80, 80
-    col2 = max(120, avail - (col1 + col3 + col4 + col5))
-
-    for idx, it in enumerate(filtered):
-        fonte = (it.get('source') or '').title()
-        raw_title = it.get('titulo') or ''
-        primary = (raw_title.split(' - ')[0] or raw_title)
-        prioridade = (it.get('prioridade') or '').title()
-        data_str = it.get('data_atendimento') or it.get('data_original') or ''
-        atendida = it.get('atendida_por') or '-'
-
-        row = [[Paragraph(fonte, small), Paragraph(primary, small), Paragraph(prioridade, small), Paragraph(data_str, small), Paragraph(atendida, small)]]
-        t = Table(row, colWidths=[col1, col2, col3, col4, col5])
-        bg = colors.whitesmoke if (idx % 2 == 0) else colors.white
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), bg),
-            ('VALIGN', (0, 0), (-1, 0), 'TOP'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('LEFTPADDING', (0, 0), (-1, 0), 6),
-            ('RIGHTPADDING', (0, 0), (-1, 0), 6),
-            ('TOPPADDING', (0, 0), (-1, 0), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
-            ('BOX', (0, 0), (-1, -1), 0.3, colors.HexColor('#e6e9ef')),
-            ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#eef1f6')),
-        ]))
-        story.append(t)
-
-        # Sub-informações (Maquina e Item)
-        sub_parts = []
-        if (it.get('maquina') or '').strip():
-            sub_parts.append(f"Maquina: {it.get('maquina')}")
-        if (it.get('codigo_interno') or '').strip():
-            sub_parts.append(f"Item: {it.get('codigo_interno')}")
-        if sub_parts:
-            story.append(Spacer(1, 2))
-            story.append(Paragraph(' | '.join(sub_parts), meta))
-
-        # Descricao / Justificativa
-        if (it.get('descricao') or '').strip():
-            story.append(Spacer(1, 2))
-            story.append(Paragraph(f"<b>Descricao:</b> {(it.get('descricao') or '')}", meta))
-
-        # Fotos em linha (apenas insumo)
-        fotos = it.get('fotos') or []
-        if ((it.get('source') or '').lower() == 'insumo') and fotos:
-            thumb = 70
-            gap = 6
-            per_row = max(1, int((avail + gap) // (thumb + gap)))
-            rows, row_imgs = [], []
-            for name in fotos:
-                try:
-                    path = os.path.join(app.root_path, app.config['FOTOS_INSUMOS_FOLDER'], name)
-                    if not os.path.exists(path):
-                        continue
-                    row_imgs.append(Image(path, width=thumb, height=thumb))
-                    if len(row_imgs) >= per_row:
-                        rows.append(row_imgs)
-                        row_imgs = []
-                except Exception:
-                    continue
-            if row_imgs:
-                rows.append(row_imgs)
-            if rows:
-                story.append(Spacer(1, 4))
-                pt = Table(rows, colWidths=[thumb] * max(1, max(len(r) for r in rows)), hAlign='LEFT')
-                pt.setStyle(TableStyle([
-                    ('LEFTPADDING', (0, 0), (-1, -1), 0),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-                    ('TOPPADDING', (0, 0), (-1, -1), 0),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
-                ]))
-                story.append(pt)
-
-        story.append(Spacer(1, 10))
-
-    # Página de gráfico – muda o template para não desenhar os cabeçalhos de colunas
-    story.append(NextPageTemplate('Chart'))
-    story.append(PageBreak())
+    def __init__(self, folder, workers, ttl):
+        self.folder = folder
+        self.workers = max(1, workers)
+        self.ttl = ttl
+        self._queue = Queue()
+        self._jobs = {}
+        self._lock = Lock()
+        self._started = False
+        self._stats = {'submitted': 0, 'done': 0, 'failed': 0, 'restarts': 0, 'render_ms_total': 0.0, 'render_ms_max': 0.0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._started:
+                os.makedirs(self.folder, exist_ok=True)
+                for _ in range(self.workers):
+                    eventlet.spawn(self._run)
+                self._started = True
+
+    def _start_process(self):
+        env = dict(os.environ, MPLBACKEND='Agg')
+        return subprocess.Popen(
+            [sys.executable, os.path.join(app.root_path, 'relatorio_pdf.py')],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=app.root_path, env=env,
+            text=True, encoding='utf-8'
+        )
+
+    def _run(self):
+        proc = None
+        while True:
+            job = self._queue.get()
+            job['status'] = 'processando'
+            self._save(job)
+            started = time.monotonic()
+            try:
+                if proc is None or proc.poll() is not None:
+                    if proc is not None:
+                        self._stats['restarts'] += 1
+                    proc = self._start_process()
+                proc.stdin.write(json.dumps(job.pop('payload'), ensure_ascii=False) + '\n')
+                proc.stdin.flush()
+                line = proc.stdout.readline()
+                if not line:
+                    raise RuntimeError('processo de relatório terminou inesperadamente')
+                result = json.loads(line)
+                if not result.get('ok'):
+                    raise RuntimeError(result.get('error') or 'erro desconhecido')
+                job['status'] = 'pronto'
+                self._stats['done'] += 1
+            except Exception as e:
+                logger.error(f"Relatório {job['id']} falhou: {str(e)}")
+                job['status'] = 'erro'
+                job['error'] = str(e)
+                self._stats['failed'] += 1
+                if proc is not None and proc.poll() is None and not isinstance(e, RuntimeError):
+                    proc.kill()  # pipe em estado desconhecido: recomeça com processo novo
+                    proc = None
+            finally:
+                elapsed = (time.monotonic() - started) * 1000
+                self._stats['render_ms_total'] += elapsed
+                self._stats['render_ms_max'] = max(self._stats['render_ms_max'], elapsed)
+                job['finished_at'] = time.time()
+                self._save(job)
+                job['event'].send()
+
+    def path(self, job_id):
+        return os.path.join(self.folder, f'{job_id}.pdf')
+
+    def _state_path(self, job_id):
+        return os.path.join(self.folder, f'{job_id}.json')
+
+    def _public(self, job):
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'criado_em': datetime.fromtimestamp(job['created_at']).isoformat(timespec='seconds'),
+            'concluido_em': datetime.fromtimestamp(job['finished_at']).isoformat(timespec='seconds') if job['finished_at'] else None,
+            'erro': job['error'],
+            'filtros': job['filtros'],
+        }
+
+    def _save(self, job):
+        """Grava o estado público do job em disco (arquivo temporário + rename)."""
+        path = self._state_path(job['id'])
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self._public(job), f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.error(f"Falha ao gravar estado do relatório {job['id']}: {str(e)}")
+
+    def submit(self, itens, filtros, miniaturas=True):
+        """Enfileira o relatório dos `itens` já filtrados; retorna o id do job.
+
+        Com `miniaturas` as fotos entram no PDF pelo cache de miniaturas em vez
+        das originais (PDF bem menor e mais rápido de gerar).
+        """
+        self.purge()
+        self._ensure_started()
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'pendente',
+            'created_at': time.time(),
+            'finished_at': None,
+            'error': None,
+            'filtros': filtros,
+            'event': eventlet.event.Event(),
+            'payload': {
+                'path': self.path(job_id),
+                'itens': itens,
+                'titulo': filtros.get('titulo'),
+                'prioridade': filtros.get('prioridade'),
+                'atendida_por': filtros.get('atendida_por'),
+                'fotos_folder': app.config['FOTOS_INSUMOS_FOLDER'],
+                'thumbs_folder': app.config['RELATORIO_THUMBS_FOLDER'] if miniaturas else None,
+            },
+        }
+        self._jobs[job_id] = job
+        self._save(job)
+        self._stats['submitted'] += 1
+        self._queue.put(job)
+        return job_id
+
+    def get(self, job_id):
+        """Estado público do job; None se não existe ou já expirou.
+
+        Job de outro processo é lido do `<id>.json`; arquivo pronto sem estado
+        (reinício) conta como pronto.
+        """
+        self.purge()
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return self._public(job)
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            return None
+        try:
+            with open(self._state_path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        if os.path.exists(self.path(job_id)):
+            return {'id': job_id, 'status': 'pronto'}
+        return None
+
+    def wait(self, job_id, timeout):
+        """Espera (sem bloquear o hub) o job terminar; retorna o estado ou None se estourar o tempo."""
+        job = self._jobs.get(job_id)
+        with eventlet.Timeout(timeout, False):
+            if job is not None:
+                job['event'].wait()
+                return self.get(job_id)
+            # Job de outro processo: acompanha pelo estado em disco
+            while True:
+                state = self.get(job_id)
+                if state is None or state['status'] in ('pronto', 'erro'):
+                    return state
+                eventlet.sleep(0.2)
+        return None
+
+    def purge(self):
+        """Remove jobs terminados há mais de `ttl` e PDFs órfãos antigos."""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job['finished_at'] and now - job['finished_at'] > self.ttl:
+                self._jobs.pop(job_id, None)
+                for path in (self.path(job_id), self._state_path(job_id)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        try:
+            for name in os.listdir(self.folder):
+                path = os.path.join(self.folder, name)
+                if name[:32] not in self._jobs and now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        stats['jobs'] = len(self._jobs)
+        stats['workers'] = self.workers
+        return stats
+
+report_queue = ReportQueue(app.config['RELATORIOS_FOLDER'], REPORT_WORKERS, REPORT_JOB_TTL)
+
+def _relatorio_from_insumo(r):
+    # Formato do relatório: título com a máquina, nome do item sem o código
+    fotos_list = []
     try:
-        from collections import Counter
-        import matplotlib.pyplot as plt
-        counts = Counter([(it.get('prioridade') or 'baixa').lower() for it in filtered])
-        if counts:
-            labels = list(counts.keys())
-            values = [counts[l] for l in labels]
-            fig, ax = plt.subplots(figsize=(6.2, 3.8), dpi=150)
-            bars = ax.bar(labels, values, color=['#27ae60', '#f1c40f', '#e67e22', '#e74c3c', '#8e44ad', '#3498db'])
-            ax.set_title('Itens por Prioridade')
-            ax.set_xlabel('Prioridade')
-            ax.set_ylabel('Quantidade')
-            for bar in bars:
-                h = bar.get_height()
-                ax.annotate(f'{int(h)}', xy=(bar.get_x()+bar.get_width()/2, h), xytext=(0, 5),
-                            textcoords='offset points', ha='center', va='bottom', fontsize=9)
-            fig.tight_layout()
-            import io as _io
-            img_buf = _io.BytesIO()
-            fig.savefig(img_buf, format='png', dpi=160)
-            plt.close(fig)
-            img_buf.seek(0)
-            story.append(Image(img_buf, width=doc.width, height=doc.width * 0.6))
+        if r.get('fotos'):
+            fotos_list = json.loads(r.get('fotos'))
+            if not isinstance(fotos_list, list):
+                fotos_list = []
     except Exception:
-        pass
+        fotos_list = []
+    return {
+        'id': r.get('id'),
+        'source': 'insumo',
+        'titulo': ((r.get('operador') or r.get('nome') or 'Insumo') + ((" - " + r.get('maquina')) if (r.get('operador') and r.get('maquina')) else '')),
+        'descricao': r.get('justificativa') or '',
+        'tipo': (r.get('tipo') or 'insumo'),
+        'prioridade': r.get('urgencia') or 'baixa',
+        'status_original': r.get('status') or 'Atendido',
+        'data_atendimento': r.get('data_atendimento') or r.get('data'),
+        'data_original': r.get('data'),
+        'atendida_por': r.get('atendida_por') or '',
+        'maquina': r.get('maquina') or '',
+        'observacoes_atendimento': '',
+        'nome_item': r.get('nome_item') or '',
+        'codigo_interno': r.get('codigo_interno') or r.get('codigo_interno_item'),
+        'fotos': fotos_list,
+        'fotos_urls': [f"/fotos_insumos/{name}" for name in fotos_list]
+    }
+
+def _relatorio_from_ocorrencia(r):
+    return {
+        'id': r.get('id'),
+        'source': 'ocorrencia',
+        'titulo': r.get('titulo') or 'Ocorrência',
+        'descricao': r.get('descricao') or '',
+        'tipo': r.get('tipo') or 'ocorrencia',
+        'prioridade': r.get('prioridade') or 'baixa',
+        'status_original': r.get('status') or 'Fechada',
+        'data_atendimento': r.get('data'),
+        'data_original': r.get('data'),
+        'atendida_por': '',
+        'observacoes_atendimento': ''
+    }
 
-    doc.build(story)
-    buf.seek(0)
-    return buf
+RELATORIO_BUILDERS = {'insumo': _relatorio_from_insumo, 'ocorrencia': _relatorio_from_ocorrencia}
+
+def collect_relatorio_itens(filtros):
+    """Atendidos do relatório pela mesma consulta do histórico (/api/atendidos).
+
+    `filtros` vem de parse_atendidos_filtros, intervalo de datas incluso; a
+    leitura é em lotes pelo keyset, com uma conexão do pool por lote.
+    """
+    itens, after = [], None
+    while True:
+        with db_connection() as conn:
+            batch, after = atendidos_batch(conn, filtros, after, builders=RELATORIO_BUILDERS)
+        itens += batch
+        if after is None:
+            return itens
+
+def _relatorio_miniaturas(source):
+    """`fotos=originais` embute as fotos em resolução total; padrão são miniaturas."""
+    return (source.get('fotos') or '').strip().lower() != 'originais'
+
+def _relatorio_urls(job_id):
+    return {
+        'status_url': url_for('relatorio_status', job_id=job_id),
+        'download_url': url_for('relatorio_download', job_id=job_id),
+    }
 
 @app.route('/relatorio/ocorrencias')
 def relatorio_ocorrencias():
+    """Gera e baixa o relatório: enfileira o job e espera o worker sem travar outras requisições."""
     # Exige login para gerar relatório
     if not session.get('gestao_logged'):
         return redirect(url_for('login', next=request.path))
-    with app.app_context():
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo, ic.codigo_interno AS codigo_interno_item
-                FROM insumos i
-                LEFT JOIN itens_cadastro ic ON i.item_id = ic.id
-                WHERE lower(ifnull(i.status,'')) = 'atendido'
-                ORDER BY COALESCE(i.data_atendimento, i.data) DESC, i.id DESC
-            ''')
-            insumos_rows = cursor.fetchall()
-            atendidos = []
-            for row in insumos_rows:
-                r = dict(row)
-                # Parse fotos JSON from DB
-                fotos_list = []
-                try:
-                    if r.get('fotos'):
-                        fotos_list = json.loads(r.get('fotos'))
-                        if not isinstance(fotos_list, list):
-                            fotos_list = []
-                except Exception:
-                    fotos_list = []
-                atendidos.append({
-                    'id': r.get('id'),
-                    'source': 'insumo',
-                    'titulo': ((r.get('operador') or r.get('nome') or 'Insumo') + ((" - " + r.get('maquina')) if (r.get('operador') and r.get('maquina')) else '')),
-                    'descricao': r.get('justificativa') or '',
-                    'tipo': (r.get('tipo') or 'insumo'),
-                    'prioridade': r.get('urgencia') or 'baixa',
-                    'status_original': r.get('status') or 'Atendido',
-                    'data_atendimento': r.get('data_atendimento') or r.get('data'),
-                    'data_original': r.get('data'),
-                    'atendida_por': r.get('atendida_por') or '',
-                    'maquina': r.get('maquina') or '',
-                    'observacoes_atendimento': '',
-                    'nome_item': r.get('nome_item') or '',
-                    'codigo_interno': r.get('codigo_interno') or r.get('codigo_interno_item'),
-                    'fotos': fotos_list,
-                    'fotos_urls': [f"/fotos_insumos/{name}" for name in fotos_list]
-                })
-            cursor.execute('''
-                SELECT * FROM ocorrencias
-                WHERE lower(ifnull(status,'')) IN ('fechada','atendida')
-                ORDER BY data DESC, id DESC
-            ''')
-            ocorr_rows = cursor.fetchall()
-            for row in ocorr_rows:
-                r = dict(row)
-                atendidos.append({
-                    'id': r.get('id'),
-                    'source': 'ocorrencia',
-                    'titulo': r.get('titulo') or 'Ocorrência',
-                    'descricao': r.get('descricao') or '',
-                    'tipo': r.get('tipo') or 'ocorrencia',
-                    'prioridade': r.get('prioridade') or 'baixa',
-                    'status_original': r.get('status') or 'Fechada',
-                    'data_atendimento': r.get('data'),
-                    'data_original': r.get('data'),
-                    'atendida_por': '',
-                    'observacoes_atendimento': ''
-                })
-            conn.close()
-
-            q_titulo = (request.args.get('titulo') or '').strip().lower()
-            q_prioridade = (request.args.get('prioridade') or '').strip().lower()
-            q_atendida = (request.args.get('atendida_por') or '').strip().lower()
-            filtered = []
-            for it in atendidos:
-                if q_titulo:
-                    titulo_l = (it.get('titulo') or '').lower()
-                    nome_item_l = (it.get('nome_item') or '').lower()
-                    cod_int_l = str(it.get('codigo_interno') or '').lower()
-                    if q_titulo not in titulo_l and q_titulo not in nome_item_l and q_titulo not in cod_int_l:
-                        continue
-                if q_prioridade and (it.get('prioridade') or '').lower() != q_prioridade:
-                    continue
-                if q_atendida and q_atendida not in (it.get('atendida_por') or '').lower():
-                    continue
-                filtered.append(it)
-
-            # Gerar via Platypus (layout moderno)
-            try:
-                buf = build_relatorio_pdf(filtered, q_titulo, q_prioridade, q_atendida)
-                return send_file(buf, as_attachment=True, download_name='relatorio_ocorrencias.pdf', mimetype='application/pdf')
-            except Exception as _e:
-                logger.error(f"Falha no Platypus: {str(_e)}; usando layout legado.")
-            try:
-                from reportlab.lib.pagesizes import A4
-                from reportlab.pdfgen import canvas
-                from reportlab.lib import colors
-                from reportlab.lib.utils import ImageReader
-                import io
-                width, height = A4
-                buf = io.BytesIO()
-                c = canvas.Canvas(buf, pagesize=A4)
-
-                # Header bar
-                c.setFillColorRGB(0.16, 0.22, 0.31)  # #2c3e50
-                c.rect(0, height-60, width, 60, fill=1, stroke=0)
-                c.setFillColor(colors.white)
-                c.setFont('Helvetica-Bold', 16)
-                c.drawString(40, height - 40, 'Relatório de Ocorrências / Atendidos')
-
-                # Sub header with filters
-                c.setFillColor(colors.black)
-                c.setFont('Helvetica', 10)
-                info = f"Filtros: tÃ­tulo='{q_titulo or 'Todos'}' â€¢ prioridade='{q_prioridade or 'Todas'}' â€¢ atendida_por='{q_atendida or 'Todos'}'"
-                c.drawString(40, height - 75, info)
-                if not (q_titulo or q_prioridade or q_atendida):
-                    c.setFillColorRGB(0.10, 0.60, 0.40)
-                    c.drawString(40, height - 90, 'Sem filtros aplicados â€” listando todos os registros.')
-                    c.setFillColor(colors.black)
-
-                # Resumo
-                occ_count = sum(1 for it in filtered if (it.get('source') or '').lower() == 'ocorrencia')
-                c.setFont('Helvetica', 10)
-                c.drawString(40, height - 100, f"Total atendidos: {len(filtered)}  |  Ocorrências atendidas: {occ_count}")
-
-                # Table header
-                y = height - 110
-                col_x = [40, 100, 340, 420, 500]  # Fonte, TÃ­tulo, Prioridade, Data, Atendida
-                col_w = [60, 240, 80, 80, 80]
-                headers = ['Fonte', 'TÃ­tulo', 'Prioridade', 'Data', 'Atendida por']
-                c.setFillColorRGB(0.91, 0.95, 0.99)
-                c.rect(36, y-4, width-72, 20, fill=1, stroke=0)
-                c.setFillColor(colors.black)
-                c.setFont('Helvetica-Bold', 9)
-                for i, h in enumerate(headers):
-                    c.drawString(col_x[i], y, h)
-                y -= 16
-
-                # Rows with zebra striping
-                c.setFont('Helvetica', 9)
-                row_bg = (0.98, 0.98, 0.98)
-                for idx, it in enumerate(filtered):
-                    # Space calculation for row height (with optional secondary line)
-                    has_secondary = ((it.get('source') or '').lower() == 'insumo') and (((it.get('maquina') or '').strip()) or (it.get('codigo_interno') or '').strip())
-                    space_needed = 30 if has_secondary else 18
-                    if y - space_needed < 80:
-                        c.showPage()
-                        # repeat header on new page
-                        c.setFillColorRGB(0.16, 0.22, 0.31)
-                        c.rect(0, height-60, width, 60, fill=1, stroke=0)
-                        c.setFillColor(colors.white)
-                        c.setFont('Helvetica-Bold', 16)
-                        c.drawString(40, height - 40, 'Relatório de Ocorrências / Atendidos')
-                        c.setFillColor(colors.black)
-                        c.setFont('Helvetica', 10)
-                        c.drawString(40, height - 75, info)
-                        c.setFont('Helvetica', 10)
-                        occ_count = sum(1 for it2 in filtered if (it2.get('source') or '').lower() == 'ocorrencia')
-                        c.drawString(40, height - 100, f"Total atendidos: {len(filtered)}  |  Ocorrências atendidas: {occ_count}")
-                        y = height - 110
-                        c.setFillColorRGB(0.91, 0.95, 0.99)
-                        c.rect(36, y-4, width-72, 20, fill=1, stroke=0)
-                        c.setFillColor(colors.black)
-                        c.setFont('Helvetica-Bold', 9)
-                        for i, h in enumerate(headers):
-                            c.drawString(col_x[i], y, h)
-                        y -= 16
-                        c.setFont('Helvetica', 9)
-
-                    if idx % 2 == 0:
-                        c.setFillColorRGB(*row_bg)
-                        c.rect(36, y-2, width-72, 18, fill=1, stroke=0)
-                        c.setFillColor(colors.black)
-
-                    fonte = (it.get('source') or '').title()
-                    # Exibir titulo com destaque e incluir maquina em linha secundaria quando aplicavel
-                    titulo = (it.get('titulo') or '')
-                    if (it.get('source') or '').lower() == 'insumo' and (it.get('maquina') or ''):
-                        titulo = f"{(titulo.split(' - ')[0] or titulo)[:60]}"
-                    prioridade = (it.get('prioridade') or '').title()
-                    data_str = it.get('data_atendimento') or it.get('data_original') or ''
-                    atendida = it.get('atendida_por') or '-'
-
-                    c.drawString(col_x[0], y, fonte)
-                    # Titulo na primeira linha
-                    c.drawString(col_x[1], y, (titulo or '')[:60])
-                    # Linha secundaria com maquina e/ou item
-                    y_secondary = y - 12
-                    subparts = []
-                    if (it.get('maquina') or ''):
-                        subparts.append(f"Maquina: {it.get('maquina')}")
-                    if (it.get('codigo_interno') or ''):
-                        subparts.append(f"Item: {it.get('codigo_interno')}")
-                    if subparts:
-                        c.setFillColorRGB(0.30, 0.30, 0.30)
-                        c.drawString(col_x[1], y_secondary, '  |  '.join(subparts)[:90])
-                        c.setFillColor(colors.black)
-                    c.drawString(col_x[2], y, prioridade)
-                    c.drawString(col_x[3], y, data_str)
-                    c.drawString(col_x[4], y, atendida)
-                    # Ajusta altura da linha de acordo com conteudo secundario
-                    y -= (30 if subparts else 18)
-
-                    # Sem grade de fotos para manter layout limpo
-
-                # Charts page
-                try:
-                    import matplotlib.pyplot as plt
-                    from collections import Counter
-                    # Estilo moderno
-                    try:
-                        plt.style.use('ggplot')
-                    except Exception:
-                        pass
-                    counts = Counter([(it.get('prioridade') or 'baixa').lower() for it in filtered])
-                    if counts:
-                        labels = list(counts.keys())
-                        values = [counts[l] for l in labels]
-                        fig, ax = plt.subplots(figsize=(6.2, 3.8), dpi=150)
-                        fig.patch.set_facecolor('white')
-                        ax.set_facecolor('white')
-                        palette = ['#27ae60', '#f1c40f', '#e67e22', '#e74c3c', '#8e44ad', '#3498db']
-                        colors = [palette[i % len(palette)] for i in range(len(labels))]
-                        bars = ax.bar(labels, values, color=colors, edgecolor='none')
-                        # Valores no topo de cada barra
-                        for bar in bars:
-                            height = bar.get_height()
-                            ax.annotate(f'{int(height)}',
-                                        xy=(bar.get_x() + bar.get_width() / 2, height),
-                                        xytext=(0, 6),
-                                        textcoords='offset points',
-                                        ha='center', va='bottom', fontsize=9, color='#2c3e50')
-                        # Eixos e grade sutis
-                        for spine in ['top', 'right']:
-                            ax.spines[spine].set_visible(False)
-                        ax.grid(True, axis='y', linestyle='--', alpha=0.25)
-                        ax.set_axisbelow(True)
-                        ax.set_title('Itens por Prioridade', fontsize=12, color='#2c3e50', pad=10)
-                        ax.set_xlabel('Prioridade', fontsize=10)
-                        ax.set_ylabel('Quantidade', fontsize=10)
-                        fig.tight_layout()
-                        import io as _io
-                        img_buf = _io.BytesIO()
-                        plt.savefig(img_buf, format='png', dpi=160)
-                        plt.close(fig)
-                        img_buf.seek(0)
-                        img = ImageReader(img_buf)
-                        c.showPage()
-                        c.drawImage(img, 40, 160, width=520, height=380, preserveAspectRatio=True)
-                except Exception:
-                    pass
+    try:
+        filtros = parse_atendidos_filtros(request.args)
+    except ValueError as e:
+        return make_response(str(e), 400)
+    try:
+        itens = collect_relatorio_itens(filtros)
+        job_id = report_queue.submit(itens, filtros, _relatorio_miniaturas(request.args))
+    except Exception as e:
+        logger.error(f"Erro no relatório: {str(e)}")
+        return make_response(f"Erro ao gerar relatório: {str(e)}", 500)
+
+    job = report_queue.wait(job_id, REPORT_WAIT_TIMEOUT)
+    if job is None:
+        # Demorou demais: o job continua; a página de espera baixa o PDF quando ficar pronto
+        return redirect(url_for('relatorio_aguardar', job_id=job_id))
+    return _relatorio_pdf_response(job_id, job)
+
+@app.route('/relatorio/ocorrencias/<job_id>')
+def relatorio_aguardar(job_id):
+    """Espera um relatório já enfileirado; enquanto não fica pronto, a página se recarrega sozinha."""
+    if not session.get('gestao_logged'):
+        return redirect(url_for('login', next=request.path))
+    if report_queue.get(job_id) is None:
+        return render_template('error.html', code=404, message="Relatório não encontrado ou expirado"), 404
+    job = report_queue.wait(job_id, REPORT_WAIT_TIMEOUT)
+    if job is None:
+        return render_template('relatorio_aguardando.html'), 202
+    return _relatorio_pdf_response(job_id, job)
+
+def _relatorio_pdf_response(job_id, job):
+    """PDF pronto para download, ou a página de erro com a causa registrada no job."""
+    if job['status'] != 'pronto':
+        logger.error(f"Falha ao gerar PDF: {job.get('erro')}")
+        return make_response(f"Erro ao gerar relatório: {job.get('erro')}", 500)
+    return send_file(report_queue.path(job_id), as_attachment=True,
+                     download_name='relatorio_ocorrencias.pdf', mimetype='application/pdf')
+
+@app.route('/api/relatorios/ocorrencias', methods=['POST'])
+def relatorio_submit():
+    """Enfileira um relatório e responde na hora (202) com as URLs de status e download."""
+    if not session.get('gestao_logged'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    source = request.get_json(silent=True) or request.form or request.args
+    try:
+        filtros = parse_atendidos_filtros(source)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        itens = collect_relatorio_itens(filtros)
+    except sqlite3.Error as e:
+        logger.error(f"Erro no relatório: {str(e)}")
+        return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
+    job_id = report_queue.submit(itens, filtros, _relatorio_miniaturas(source))
+    return jsonify({'id': job_id, 'status': 'pendente', **_relatorio_urls(job_id)}), 202
 
-                c.save(); buf.seek(0)
-                return send_file(buf, as_attachment=True, download_name='relatorio_ocorrencias.pdf', mimetype='application/pdf')
-            except Exception as e:
-                logger.error(f"Falha ao gerar PDF: {str(e)}")
-                return make_response("Instale dependências: pip install reportlab matplotlib", 500)
-        except Exception as e:
-            logger.error(f"Erro no relatório: {str(e)}")
-            return make_response(f"Erro ao gerar relatório: {str(e)}", 500)
+@app.route('/api/relatorios/<job_id>', methods=['GET'])
+def relatorio_status(job_id):
+    if not session.get('gestao_logged'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    job = report_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Relatório não encontrado ou expirado'}), 404
+    return jsonify({**job, **_relatorio_urls(job_id)})
+
+@app.route('/api/relatorios/<job_id>/download', methods=['GET'])
+def relatorio_download(job_id):
+    if not session.get('gestao_logged'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    job = report_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Relatório não encontrado ou expirado'}), 404
+    if job['status'] != 'pronto':
+        return jsonify({'error': 'Relatório ainda não está pronto', 'status': job['status']}), 409
+    return send_file(report_queue.path(job_id), as_attachment=True,
+                     download_name='relatorio_ocorrencias.pdf', mimetype='application/pdf')
 
 @app.route('/cadastro')
 def cadastro():
     logger.info("Rendering cadastro.html")
-    return render_template('cadastro.html')
+    return render_static_page('cadastro.html')
 
 @app.route('/cadastro', methods=['POST'])
 def cadastro_post():
-    with db_lock:
-        with app.app_context():
-            conn = None
-            try:
-                conn = get_db_connection()
+    with app.app_context():
+        novas_fotos = []
+        try:
+            tipo_item = request.form.get('tipo_item')
+            codigo_interno = request.form.get('codigo_interno', '').strip()
+            nome_descricao = request.form.get('nome_descricao', '').strip()
+            codigo_fabricacao = request.form.get('codigo_fabricacao', '')
+
+            if not tipo_item or not codigo_interno or not nome_descricao:
+                logger.error("Missing required fields in cadastro")
+                return jsonify({'message': 'Por favor, preencha todos os campos obrigatórios.'}), 400
+
+            if len(codigo_interno) < 2 or len(nome_descricao) < 3:
+                logger.error("Invalid input length for codigo_interno or nome_descricao")
+                return jsonify({'message': 'Código interno deve ter pelo menos 2 caracteres e nome/descrição pelo menos 3 caracteres.'}), 400
+
+            # Checagem rápida pelo leitor; a corrida é coberta pelo UNIQUE (IntegrityError)
+            with db_connection() as conn:
                 cursor = conn.cursor()
-                tipo_item = request.form.get('tipo_item')
-                codigo_interno = request.form.get('codigo_interno', '').strip()
-                nome_descricao = request.form.get('nome_descricao', '').strip()
-                
-                if not tipo_item or not codigo_interno or not nome_descricao:
-                    conn.close()
-                    logger.error("Missing required fields in cadastro")
-                    return jsonify({'message': 'Por favor, preencha todos os campos obrigatórios.'}), 400
-                
-                if len(codigo_interno) < 2 or len(nome_descricao) < 3:
-                    conn.close()
-                    logger.error("Invalid input length for codigo_interno or nome_descricao")
-                    return jsonify({'message': 'Código interno deve ter pelo menos 2 caracteres e nome/descrição pelo menos 3 caracteres.'}), 400
-                
                 cursor.execute('SELECT id FROM itens_cadastro WHERE lower(codigo_interno) = lower(?)', (codigo_interno,))
                 if cursor.fetchone():
-                    conn.close()
                     logger.error(f"Código interno {codigo_interno} já existe")
                     return jsonify({'message': 'Código interno já existe! Use um código diferente.'}), 400
-                
-                altura_min = request.form.get('altura_min')
-                altura_min = float(altura_min) if altura_min and altura_min.strip() else None
-                altura_max = request.form.get('altura_max')
-                altura_max = float(altura_max) if altura_max and altura_max.strip() else None
-                if altura_max is not None and altura_min is not None and altura_min > altura_max:
-                    conn.close()
-                    logger.error("Altura mÃ­nima maior que altura máxima")
-                    return jsonify({'message': 'Altura mÃ­nima não pode ser maior que altura máxima.'}), 400
-                
-                rpm = request.form.get('rpm')
-                rpm = int(rpm) if rpm and rpm.strip() else None
-                avanco = request.form.get('avanco')
-                avanco = float(avanco) if avanco and avanco.strip() else None
-                
-                categoria = request.form.get('categoria')
-                categoria = categoria if categoria and categoria.strip() else None
-                material = request.form.get('material')
-                material = material if material and material.strip() else None
-                
-                foto_filename = None
-                if 'foto' in request.files:
-                    file = request.files['foto']
-                    if file and file.filename != '' and allowed_file(file.filename):
-                        if not os.path.exists(app.config['UPLOAD_FOLDER']):
-                            os.makedirs(app.config['UPLOAD_FOLDER'])
-                        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                        filename = f"{codigo_interno}_{timestamp}_{secure_filename(file.filename)}"
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        file.save(filepath)
-                        foto_filename = filename
-                    elif file and file.filename != '':
-                        conn.close()
-                        logger.error("Invalid file format for foto")
-                        return jsonify({'message': 'Formato de arquivo inválido. Use: PNG, JPG, JPEG, GIF, WEBP.'}), 400
-                
-                # Tipo de máquina (apenas para ferramenta)
-                maquina = None
-                if tipo_item == 'ferramenta':
-                    maquina = request.form.get('ferramenta_tipo') or request.form.get('maquina') or None
-                    if maquina:
-                        maquina = maquina.strip() or None
 
+            altura_min = request.form.get('altura_min')
+            altura_min = float(altura_min) if altura_min and altura_min.strip() else None
+            altura_max = request.form.get('altura_max')
+            altura_max = float(altura_max) if altura_max and altura_max.strip() else None
+            if altura_max is not None and altura_min is not None and altura_min > altura_max:
+                logger.error("Altura mÃ­nima maior que altura máxima")
+                return jsonify({'message': 'Altura mÃ­nima não pode ser maior que altura máxima.'}), 400
+
+            rpm = request.form.get('rpm')
+            rpm = int(rpm) if rpm and rpm.strip() else None
+            avanco = request.form.get('avanco')
+            avanco = float(avanco) if avanco and avanco.strip() else None
+
+            categoria = request.form.get('categoria')
+            categoria = categoria if categoria and categoria.strip() else None
+            material = request.form.get('material')
+            material = material if material and material.strip() else None
+
+            # Tipo de máquina (apenas para ferramenta)
+            maquina = None
+            composicao = []
+            if tipo_item == 'ferramenta':
+                maquina = request.form.get('ferramenta_tipo') or request.form.get('maquina') or None
+                if maquina:
+                    maquina = maquina.strip() or None
+
+                insumos_ids = request.form.getlist('composicao_insumos')
+                quantidades = request.form.getlist('composicao_quantidades')
+
+                if not insumos_ids:
+                    logger.error("Ferramentas devem ter pelo menos um insumo na composição")
+                    return jsonify({'message': 'Ferramentas devem ter pelo menos um insumo na composição.'}), 400
+
+                for i, insumo_id in enumerate(insumos_ids):
+                    if insumo_id and insumo_id.isdigit():
+                        quantidade = int(quantidades[i]) if i < len(quantidades) and quantidades[i].isdigit() else 1
+                        if quantidade <= 0:
+                            logger.error("Invalid insumo quantity")
+                            return jsonify({'message': 'Quantidade de insumo deve ser maior que zero.'}), 400
+                        composicao.append((int(insumo_id), quantidade))
+
+            # Células (opcionais)
+            try:
+                celulas_vals = request.form.getlist('celulas')
+                if len(celulas_vals) == 1 and celulas_vals[0] and celulas_vals[0].strip().startswith('['):
+                    # Caso venha como JSON string
+                    parsed = json.loads(celulas_vals[0])
+                    celulas = [str(c).strip() for c in parsed if isinstance(c, (str, bytes)) and str(c).strip()]
+                else:
+                    celulas = [c.strip() for c in celulas_vals if c and c.strip()]
+            except Exception:
+                celulas = []
+
+            # Máquinas cadastradas (opcionais)
+            try:
+                maquinas_vals = request.form.getlist('maquinas')
+                if len(maquinas_vals) == 1 and maquinas_vals[0] and maquinas_vals[0].strip().startswith('['):
+                    parsed_m = json.loads(maquinas_vals[0])
+                    maquinas = [str(m).strip() for m in parsed_m if isinstance(m, (str, bytes)) and str(m).strip()]
+                else:
+                    maquinas = [m.strip() for m in maquinas_vals if m and m.strip()]
+            except Exception:
+                maquinas = []
+
+            # Foto gravada antes e fora da fila de escrita
+            foto_filename = None
+            if 'foto' in request.files:
+                file = request.files['foto']
+                if file and file.filename != '' and allowed_file(file.filename):
+                    foto_filename = ingest_photo(file, app.config['UPLOAD_FOLDER'], novas_fotos)
+                elif file and file.filename != '':
+                    logger.error("Invalid file format for foto")
+                    return jsonify({'message': 'Formato de arquivo inválido. Use: PNG, JPG, JPEG, GIF, WEBP.'}), 400
+
+            def _inserir(conn):
+                cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO itens_cadastro (
                         tipo_item, codigo_fabricacao, codigo_interno, nome_descricao,
@@ -931,7 +2237,7 @@ def cadastro_post():
                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     tipo_item,
-                    request.form.get('codigo_fabricacao', ''),
+                    codigo_fabricacao,
                     codigo_interno,
                     nome_descricao,
                     foto_filename,
@@ -944,85 +2250,38 @@ def cadastro_post():
                     avanco,
                     datetime.now().strftime('%d/%m/%Y %H:%M')
                 ))
-                
                 ferramenta_id = cursor.lastrowid
-                
-                if tipo_item == 'ferramenta':
-                    insumos_ids = request.form.getlist('composicao_insumos')
-                    quantidades = request.form.getlist('composicao_quantidades')
-                    
-                    if not insumos_ids:
-                        conn.close()
-                        logger.error("Ferramentas devem ter pelo menos um insumo na composição")
-                        return jsonify({'message': 'Ferramentas devem ter pelo menos um insumo na composição.'}), 400
-                    
-                    for i, insumo_id in enumerate(insumos_ids):
-                        if insumo_id and insumo_id.isdigit():
-                            quantidade = int(quantidades[i]) if i < len(quantidades) and quantidades[i].isdigit() else 1
-                            if quantidade <= 0:
-                                conn.close()
-                                logger.error("Invalid insumo quantity")
-                                return jsonify({'message': 'Quantidade de insumo deve ser maior que zero.'}), 400
-                            cursor.execute('''
-                                INSERT INTO composicao_ferramentas (ferramenta_id, insumo_id, quantidade)
-                                VALUES (?, ?, ?)
-                            ''', (ferramenta_id, int(insumo_id), quantidade))
-                
-                conn.commit()
-                
-                # Salvar células (opcionais)
-                try:
-                    celulas_vals = request.form.getlist('celulas')
-                    if len(celulas_vals) == 1 and celulas_vals[0] and celulas_vals[0].strip().startswith('['):
-                        # Caso venha como JSON string
-                        parsed = json.loads(celulas_vals[0])
-                        celulas = [str(c).strip() for c in parsed if isinstance(c, (str, bytes)) and str(c).strip()]
-                    else:
-                        celulas = [c.strip() for c in celulas_vals if c and c.strip()]
-                except Exception:
-                    celulas = []
-
+                if composicao:
+                    cursor.executemany('''
+                        INSERT INTO composicao_ferramentas (ferramenta_id, insumo_id, quantidade)
+                        VALUES (?, ?, ?)
+                    ''', [(ferramenta_id, insumo_id, quantidade) for insumo_id, quantidade in composicao])
                 if celulas:
-                    for cel in celulas:
-                        cursor.execute('INSERT INTO itens_celulas (item_id, celula) VALUES (?, ?)', (ferramenta_id, cel))
-                    conn.commit()
-
-                # Salvar máquinas cadastradas (opcionais)
-                try:
-                    maquinas_vals = request.form.getlist('maquinas')
-                    if len(maquinas_vals) == 1 and maquinas_vals[0] and maquinas_vals[0].strip().startswith('['):
-                        parsed_m = json.loads(maquinas_vals[0])
-                        maquinas = [str(m).strip() for m in parsed_m if isinstance(m, (str, bytes)) and str(m).strip()]
-                    else:
-                        maquinas = [m.strip() for m in maquinas_vals if m and m.strip()]
-                except Exception:
-                    maquinas = []
-
+                    cursor.executemany('INSERT INTO itens_celulas (item_id, celula) VALUES (?, ?)', [(ferramenta_id, cel) for cel in celulas])
                 if maquinas:
-                    for maq in maquinas:
-                        cursor.execute('INSERT INTO itens_maquinas (item_id, maquina) VALUES (?, ?)', (ferramenta_id, maq))
-                    conn.commit()
-
-                conn.close()
-                logger.info(f"Item {ferramenta_id} cadastrado com sucesso: {tipo_item}")
-                return jsonify({'message': f'{tipo_item.title()} cadastrado(a) com sucesso!'})
-                
-            except sqlite3.IntegrityError as e:
-                if conn is not None:
-                    conn.close()
-                logger.error(f"Erro de integridade ao cadastrar item: {str(e)}")
-                return jsonify({'message': 'Código interno já existe! Use um código diferente.'}), 400
-            except ValueError as e:
-                if conn is not None:
-                    conn.close()
-                logger.error(f"Erro de validação ao cadastrar item: {str(e)}")
-                return jsonify({'message': f'Erro de validação: {str(e)}'}), 400
-            except Exception as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro inesperado ao cadastrar item: {str(e)}")
-                return jsonify({'message': f'Erro ao cadastrar: {str(e)}'}), 500
+                    cursor.executemany('INSERT INTO itens_maquinas (item_id, maquina) VALUES (?, ?)', [(ferramenta_id, maq) for maq in maquinas])
+                bump_catalog_version(conn)
+                return ferramenta_id
+
+            ferramenta_id = db_writer.submit(_inserir)
+            novas_fotos = []
+            publish_event('item.changed', ferramenta_id, {'codigo_interno': codigo_interno, 'op': 'created'})
+            logger.info(f"Item {ferramenta_id} cadastrado com sucesso: {tipo_item}")
+            return jsonify({'message': f'{tipo_item.title()} cadastrado(a) com sucesso!'})
+
+        except sqlite3.IntegrityError as e:
+            logger.error(f"Erro de integridade ao cadastrar item: {str(e)}")
+            return jsonify({'message': 'Código interno já existe! Use um código diferente.'}), 400
+        except ValueError as e:
+            logger.error(f"Erro de validação ao cadastrar item: {str(e)}")
+            return jsonify({'message': f'Erro de validação: {str(e)}'}), 400
+        except Exception as e:
+            logger.error(f"Erro inesperado ao cadastrar item: {str(e)}")
+            return jsonify({'message': f'Erro ao cadastrar: {str(e)}'}), 500
+        finally:
+            # Foto gravada por esta requisição e que não chegou ao banco
+            for name, mtime in novas_fotos:
+                discard_new_photo(app.config['UPLOAD_FOLDER'], name, mtime)
 
 @app.route('/api/verificar_codigo_interno', methods=['GET'])
 def verificar_codigo_interno():
@@ -1033,13 +2292,12 @@ def verificar_codigo_interno():
     
     with app.app_context():  # Ensure application context
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT 1 FROM itens_cadastro WHERE lower(codigo_interno) = lower(?)', (codigo,))
-            exists = cursor.fetchone() is not None
-            conn.close()
-            logger.info(f"Verificação de código interno {codigo}: {'existe' if exists else 'não existe'}")
-            return jsonify({"exists": exists})
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1 FROM itens_cadastro WHERE lower(codigo_interno) = lower(?)', (codigo,))
+                exists = cursor.fetchone() is not None
+                logger.info(f"Verificação de código interno {codigo}: {'existe' if exists else 'não existe'}")
+                return jsonify({"exists": exists})
         except sqlite3.Error as e:
             logger.error(f"Erro ao verificar código interno: {str(e)}")
             return jsonify({"error": f"Erro no banco de dados: {str(e)}"}), 500
@@ -1051,26 +2309,25 @@ def gestao():
         return redirect(url_for('login'))
     with app.app_context():  # Ensure application context
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT i.*, ic.nome_descricao AS nome_item FROM insumos i LEFT JOIN itens_cadastro ic ON i.item_id = ic.id ORDER BY i.id DESC LIMIT 5')
-            insumos_recentes = [dict(row) for row in cursor.fetchall()]
-            cursor.execute('SELECT * FROM ocorrencias ORDER BY id DESC LIMIT 5')
-            ocorrencias_recentes = [dict(row) for row in cursor.fetchall()]
-            cursor.execute('SELECT COUNT(*) FROM insumos')
-            total_insumos = cursor.fetchone()[0]
-            cursor.execute('SELECT COUNT(*) FROM ocorrencias')
-            total_ocorrencias = cursor.fetchone()[0]
-            cursor.execute('SELECT COUNT(*) FROM itens_cadastro')
-            total_itens_cadastro = cursor.fetchone()[0]
-            conn.close()
-            logger.info(f"Rendering gestao.html com {total_insumos} insumos, {total_ocorrencias} ocorrências, {total_itens_cadastro} itens")
-            return render_template('gestao.html', 
-                                total_insumos=total_insumos,
-                                total_ocorrencias=total_ocorrencias,
-                                total_itens_cadastro=total_itens_cadastro,
-                                insumos_recentes=insumos_recentes,
-                                ocorrencias_recentes=ocorrencias_recentes)
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT i.*, ic.nome_descricao AS nome_item FROM insumos i LEFT JOIN itens_cadastro ic ON i.item_id = ic.id ORDER BY i.id DESC LIMIT 5')
+                insumos_recentes = [dict(row) for row in cursor.fetchall()]
+                cursor.execute('SELECT * FROM ocorrencias ORDER BY id DESC LIMIT 5')
+                ocorrencias_recentes = [dict(row) for row in cursor.fetchall()]
+                cursor.execute('SELECT COUNT(*) FROM insumos')
+                total_insumos = cursor.fetchone()[0]
+                cursor.execute('SELECT COUNT(*) FROM ocorrencias')
+                total_ocorrencias = cursor.fetchone()[0]
+                cursor.execute('SELECT COUNT(*) FROM itens_cadastro')
+                total_itens_cadastro = cursor.fetchone()[0]
+                logger.info(f"Rendering gestao.html com {total_insumos} insumos, {total_ocorrencias} ocorrências, {total_itens_cadastro} itens")
+                return render_template('gestao.html', 
+                                    total_insumos=total_insumos,
+                                    total_ocorrencias=total_ocorrencias,
+                                    total_itens_cadastro=total_itens_cadastro,
+                                    insumos_recentes=insumos_recentes,
+                                    ocorrencias_recentes=ocorrencias_recentes)
         except sqlite3.Error as e:
             logger.error(f"Erro ao carregar página de gestão: {str(e)}")
             return render_template('error.html', code=500, message=f"Erro no banco de dados: {str(e)}"), 500
@@ -1082,20 +2339,19 @@ def login():
         password = (request.form.get('gestao_password') or request.form.get('password') or '').strip()
         next_url = (request.form.get('next') or request.args.get('next') or '').strip()
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT username, password FROM admin LIMIT 1')
-            row = cursor.fetchone()
-            conn.close()
-            if row and username == row['username'] and password == row['password']:
-                session['gestao_logged'] = True
-                session['gestao_user'] = username
-                # Redireciona para o destino requisitado (ocorrencias/gestao/etc.)
-                if next_url and next_url.startswith('/'):
-                    return redirect(next_url)
-                return redirect(url_for('gestao'))
-            else:
-                return render_template('login.html', error='Usuário ou senha inválidos')
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT username, password FROM admin LIMIT 1')
+                row = cursor.fetchone()
+                if row and username == row['username'] and password == row['password']:
+                    session['gestao_logged'] = True
+                    session['gestao_user'] = username
+                    # Redireciona para o destino requisitado (ocorrencias/gestao/etc.)
+                    if next_url and next_url.startswith('/'):
+                        return redirect(next_url)
+                    return redirect(url_for('gestao'))
+                else:
+                    return render_template('login.html', error='Usuário ou senha inválidos')
         except Exception as e:
             logger.error(f"Erro no login: {str(e)}")
             return render_template('login.html', error='Erro ao processar login')
@@ -1128,16 +2384,16 @@ def gestao_reset():
             return render_template('reset_gestao.html', error='Informe novo usuário e nova senha')
 
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM admin LIMIT 1')
-            row = cursor.fetchone()
-            if row:
-                cursor.execute('UPDATE admin SET username = ?, password = ? WHERE id = ?', (new_user, new_pass, row['id']))
-            else:
-                cursor.execute('INSERT INTO admin (username, password) VALUES (?, ?)', (new_user, new_pass))
-            conn.commit()
-            conn.close()
+            def _redefinir(conn):
+                cursor = conn.cursor()
+                cursor.execute('SELECT id FROM admin LIMIT 1')
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute('UPDATE admin SET username = ?, password = ? WHERE id = ?', (new_user, new_pass, row['id']))
+                else:
+                    cursor.execute('INSERT INTO admin (username, password) VALUES (?, ?)', (new_user, new_pass))
+
+            db_writer.submit(_redefinir)
             return render_template('reset_gestao.html', success='Usuário e senha atualizados com sucesso')
         except Exception as e:
             logger.error(f"Erro ao redefinir credenciais: {str(e)}")
@@ -1157,19 +2413,18 @@ def visual_insumo():
     
     with app.app_context():  # Ensure application context
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT i.*, ic.nome_descricao AS nome_item FROM insumos i LEFT JOIN itens_cadastro ic ON i.item_id = ic.id WHERE i.id = ?', (id,))
-            insumo = cursor.fetchone()
-            conn.close()
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT i.*, ic.nome_descricao AS nome_item FROM insumos i LEFT JOIN itens_cadastro ic ON i.item_id = ic.id WHERE i.id = ?', (id,))
+                insumo = cursor.fetchone()
             
-            if not insumo:
-                logger.error(f"Insumo com id={id} não encontrado")
-                return jsonify({'error': 'Insumo não encontrado'}), 404
+                if not insumo:
+                    logger.error(f"Insumo com id={id} não encontrado")
+                    return jsonify({'error': 'Insumo não encontrado'}), 404
             
-            logger.info(f"Insumo encontrado: {dict(insumo)}")
-            # Agora usar o HTML modificado para atender insumo
-            return render_template('atender_insumo.html', insumo=dict(insumo))
+                logger.info(f"Insumo encontrado: {dict(insumo)}")
+                # Agora usar o HTML modificado para atender insumo
+                return render_template('atender_insumo.html', insumo=dict(insumo))
         except Exception as e:
             logger.error(f"Erro na rota /visualinsumo: {str(e)}")
             return jsonify({'error': f'Erro interno: {str(e)}'}), 500
@@ -1179,88 +2434,571 @@ def visual_insumo():
 def get_insumo(id):
     with app.app_context():
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT i.*, ic.nome_descricao AS nome_item FROM insumos i LEFT JOIN itens_cadastro ic ON i.item_id = ic.id WHERE i.id = ?', (id,))
-            insumo = cursor.fetchone()
-            conn.close()
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT i.*, ic.nome_descricao AS nome_item FROM insumos i LEFT JOIN itens_cadastro ic ON i.item_id = ic.id WHERE i.id = ?', (id,))
+                insumo = cursor.fetchone()
             
-            if not insumo:
-                logger.error(f"Insumo com id={id} não encontrado")
-                return jsonify({"error": "Insumo não encontrado"}), 404
+                if not insumo:
+                    logger.error(f"Insumo com id={id} não encontrado")
+                    return jsonify({"error": "Insumo não encontrado"}), 404
             
-            insumo_dict = dict(insumo)
-            # Converter fotos de JSON string para lista se existir
-            if insumo_dict.get('fotos'):
-                try:
-                    insumo_dict['fotos'] = json.loads(insumo_dict['fotos'])
-                except:
+                insumo_dict = dict(insumo)
+                # Converter fotos de JSON string para lista se existir
+                if insumo_dict.get('fotos'):
+                    try:
+                        insumo_dict['fotos'] = json.loads(insumo_dict['fotos'])
+                    except:
+                        insumo_dict['fotos'] = []
+                else:
                     insumo_dict['fotos'] = []
-            else:
-                insumo_dict['fotos'] = []
                 
-            logger.info(f"Insumo retornado para id={id}: {insumo_dict}")
-            return jsonify(insumo_dict)
+                logger.debug("Insumo retornado para id=%s: %s", id, insumo_dict)
+                return jsonify(insumo_dict)
         except sqlite3.Error as e:
             logger.error(f"Erro ao obter insumo id={id}: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+# Uploads em etapas: a foto sobe assim que é escolhida, é processada por um pool
+# de workers e o atendimento só referencia o id (a transação não toca em arquivo).
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "2"))  # fotos processadas em paralelo
+UPLOAD_STAGING_TTL = float(os.environ.get("UPLOAD_STAGING_TTL", "86400"))  # segundos até descartar upload não usado
+UPLOAD_CLAIM_TIMEOUT = 60  # espera máxima pelo processamento ao anexar
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def _write_upload_chunk(f, digest, chunk):
+    digest.update(chunk)
+    f.write(chunk)
+
+def _sync_file(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+class StagedUploads:
+    """Área temporária de uploads.
+
+    `stage()` grava o corpo em `<id>.part` em blocos, faz fsync e renomeia para
+    `<id>.upload`; um worker do pool gera as variantes em `<id>/` (mesmo formato
+    e nome por conteúdo de ingest_photo) e apaga o bruto. `claim()` move as
+    variantes prontas para a pasta definitiva; o que não for usado expira em `ttl`.
+    O estado sai só do disco (`<id>.upload` = processando, `<id>.erro` = falhou),
+    então status e claim funcionam em qualquer worker, não só no que recebeu.
+    """
+
+    def __init__(self, folder, workers, ttl):
+        self.folder = folder
+        self.ttl = ttl
+        self._pool = eventlet.GreenPool(max(1, workers))
+        self._events = {}
+
+    def _valid(self, upload_id):
+        return bool(re.fullmatch(r'[0-9a-f]{32}', upload_id or ''))
+
+    def _dir(self, upload_id):
+        return os.path.join(self.folder, upload_id)
+
+    def _raw_path(self, upload_id):
+        return os.path.join(self.folder, f'{upload_id}.upload')
+
+    def _error_path(self, upload_id):
+        return os.path.join(self.folder, f'{upload_id}.erro')
+
+    def _error(self, upload_id):
+        try:
+            with open(self._error_path(upload_id), encoding='utf-8') as f:
+                return f.read() or 'Imagem inválida'
+        except OSError:
+            return None
+
+    def _claimed_path(self, upload_id):
+        return os.path.join(self.folder, f'{upload_id}.claimed')
+
+    def _claimed_name(self, upload_id):
+        try:
+            with open(self._claimed_path(upload_id), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _remove_error(self, upload_id):
+        try:
+            os.remove(self._error_path(upload_id))
+        except OSError:
+            pass
+
+    def stage(self, stream):
+        """Grava o upload (calculando o sha256 no caminho) e agenda o processamento; retorna o id.
+
+        Só a leitura do corpo fica no greenlet da requisição; hash, escrita e
+        fsync de cada bloco rodam no pool de threads (tpool) sem travar o hub.
+        """
+        self.purge()
+        upload_id = uuid.uuid4().hex
+        part_path = os.path.join(self.folder, f'{upload_id}.part')
+        raw_path = self._raw_path(upload_id)
+        digest = hashlib.sha256()
+        try:
+            with open(part_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    tpool.execute(_write_upload_chunk, f, digest, chunk)
+                tpool.execute(_sync_file, f)
+            os.replace(part_path, raw_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        event = eventlet.event.Event()
+        self._events[upload_id] = event
+        self._pool.spawn_n(self._process, upload_id, raw_path, photo_content_name(digest), event)
+        return upload_id
+
+    def _process(self, upload_id, raw_path, filename, event):
+        try:
+            tpool.execute(_write_photo_variants, raw_path, self._dir(upload_id), filename, list(PHOTO_SIZES))
+        except Exception as e:
+            logger.error(f"Falha ao processar upload {upload_id}: {str(e)}")
+            shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+            # Antes de apagar o bruto: quem consultar nunca vê o upload "sumido"
+            try:
+                with open(self._error_path(upload_id), 'w', encoding='utf-8') as f:
+                    f.write('Imagem inválida')
+            except OSError:
+                pass
+        finally:
+            try:
+                os.remove(raw_path)
+            except OSError:
+                pass
+            self._events.pop(upload_id, None)
+            event.send()
+
+    def _ready_name(self, upload_id):
+        try:
+            names = [n for n in os.listdir(self._dir(upload_id)) if os.path.isfile(os.path.join(self._dir(upload_id), n))]
+        except OSError:
+            return None
+        return names[0] if names else None
+
+    def status(self, upload_id):
+        """'processando', 'pronto', 'erro' ou None se o id não existe."""
+        if not self._valid(upload_id):
+            return None
+        if upload_id in self._events or os.path.exists(self._raw_path(upload_id)):
+            return 'processando'
+        if os.path.exists(self._error_path(upload_id)):
+            return 'erro'
+        return 'pronto' if self._ready_name(upload_id) else None
+
+    def claim(self, upload_id, dest_folder, timeout=UPLOAD_CLAIM_TIMEOUT):
+        """Move o upload processado para `dest_folder`; retorna o nome (hash do conteúdo).
+
+        Se a mesma foto já existe lá, só descarta o upload. Espera o processamento
+        se ainda estiver na fila. Levanta ValueError se o id não existe, expirou ou
+        a imagem é inválida.
+
+        Idempotente: o nome fica em `<id>.claimed` até expirar, então repetir o
+        claim (a transação que usaria a foto falhou e o cliente tentou de novo)
+        devolve a mesma foto enquanto ela estiver em `dest_folder`.
+        """
+        if not self._valid(upload_id):
+            raise ValueError(f"Upload inválido: {upload_id}")
+        claimed = self._claimed_name(upload_id)
+        if claimed and reuse_photo(dest_folder, claimed):
+            return claimed
+        event = self._events.get(upload_id)
+        with eventlet.Timeout(timeout, False):
+            if event is not None:
+                event.wait()
+            # Recebido por outro worker: espera o bruto sair do disco
+            while os.path.exists(self._raw_path(upload_id)):
+                eventlet.sleep(0.1)
+        if self.status(upload_id) == 'processando':
+            raise ValueError(f"Upload {upload_id} ainda em processamento")
+        error = self._error(upload_id)
+        if error is not None:
+            self._remove_error(upload_id)
+            raise ValueError(error)
+        name = self._ready_name(upload_id)
+        if not name:
+            raise ValueError(f"Upload {upload_id} não encontrado ou expirado")
+        src = self._dir(upload_id)
+        if reuse_photo(dest_folder, name):
+            self._mark_claimed(upload_id, name)
+            shutil.rmtree(src, ignore_errors=True)
+            return name
+        for size in PHOTO_SIZES:
+            if size == 'original':
+                continue
+            variant_src = os.path.join(src, size, photo_variant_name(name))
+            if os.path.exists(variant_src):
+                os.makedirs(os.path.join(dest_folder, size), exist_ok=True)
+                os.replace(variant_src, os.path.join(dest_folder, size, photo_variant_name(name)))
+        os.replace(os.path.join(src, name), os.path.join(dest_folder, name))
+        self._mark_claimed(upload_id, name)
+        shutil.rmtree(src, ignore_errors=True)
+        return name
+
+    def _mark_claimed(self, upload_id, name):
+        # Gravado antes de apagar a pasta: um retry nunca encontra o id "sumido"
+        try:
+            with open(self._claimed_path(upload_id), 'w', encoding='utf-8') as f:
+                f.write(name)
+        except OSError as e:
+            logger.error(f"Falha ao registrar claim do upload {upload_id}: {str(e)}")
+
+    def discard(self, upload_id):
+        """Descarta um upload ainda não usado. Retorna False se o id não existe."""
+        if self.status(upload_id) in (None, 'processando'):
+            return False
+        self._remove_error(upload_id)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+        return True
+
+    def purge(self):
+        """Remove uploads (brutos e processados) mais velhos que `ttl`."""
+        now = time.time()
+        try:
+            for name in os.listdir(self.folder):
+                path = os.path.join(self.folder, name)
+                if name[:32] in self._events or now - os.path.getmtime(path) <= self.ttl:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+        except OSError:
+            pass
+
+staged_uploads = StagedUploads(app.config['UPLOADS_STAGING_FOLDER'], UPLOAD_WORKERS, UPLOAD_STAGING_TTL)
+
+@app.route('/api/uploads', methods=['POST'])
+def stage_upload():
+    """Recebe uma foto antes do atendimento.
+
+    Aceita multipart (campo `foto`) ou o corpo cru com o nome em `?nome=`; o corpo
+    cru vai direto do socket para o disco. Retorna 202 com o id a enviar em `uploads`.
+    """
+    with app.app_context():
+        try:
+            file = request.files.get('foto')
+            if file is not None:
+                if not file.filename or not allowed_file(file.filename):
+                    return jsonify({'error': 'Formato de arquivo inválido. Use: PNG, JPG, JPEG, GIF, WEBP.'}), 400
+                upload_id = staged_uploads.stage(file.stream)
+            else:
+                nome = request.args.get('nome') or 'foto.jpg'
+                if not allowed_file(nome):
+                    return jsonify({'error': 'Formato de arquivo inválido. Use: PNG, JPG, JPEG, GIF, WEBP.'}), 400
+                upload_id = staged_uploads.stage(request.stream)
+            return jsonify({
+                'id': upload_id,
+                'status': 'processando',
+                'status_url': url_for('upload_status', upload_id=upload_id),
+            }), 202
+        except OSError as e:
+            logger.error(f"Erro ao receber upload: {str(e)}")
+            return jsonify({'error': f'Erro ao gravar upload: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    status = staged_uploads.status(upload_id)
+    if status is None:
+        return jsonify({'error': 'Upload não encontrado ou expirado'}), 404
+    return jsonify({'id': upload_id, 'status': status})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def discard_upload(upload_id):
+    if not staged_uploads.discard(upload_id):
+        return jsonify({'error': 'Upload não encontrado ou em processamento'}), 404
+    return jsonify({'message': 'Upload descartado'})
+
+# Fotos compartilhadas (mesmo conteúdo = mesmo arquivo): só saem do disco sem referências
+PHOTO_GC_GRACE = float(os.environ.get("PHOTO_GC_GRACE", "3600"))  # segundos em que um arquivo novo/reaproveitado é intocável
+PHOTO_GC_BATCH = int(os.environ.get("PHOTO_GC_BATCH", "200"))  # arquivos conferidos por consulta
+PHOTO_GC_INTERVAL = float(os.environ.get("PHOTO_GC_INTERVAL", "21600"))  # segundos entre coletas automáticas (0 desliga)
+
+def photo_refcounts(conn, folder, names):
+    """{nome: nº de registros que usam a foto} para os `names` de `folder` (ausente = 0).
+
+    Lê foto_refs (mantida por triggers): fotos_insumos conta insumos.fotos;
+    fotos_cadastro conta itens_cadastro.foto e a lixeira itens_cadastro_deleted.
+    """
+    names = list(names)
+    if not names:
+        return {}
+    pasta = 'insumos' if folder == app.config['FOTOS_INSUMOS_FOLDER'] else 'cadastro'
+    marks = ','.join('?' * len(names))
+    rows = conn.execute(f'SELECT name, count FROM foto_refs WHERE pasta = ? AND name IN ({marks})',
+                        [pasta] + names).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+def release_photo(folder, name):
+    """Apaga a foto se nenhum registro a usa mais; retorna True se apagou.
+
+    Arquivos tocados há menos de PHOTO_GC_GRACE ficam (podem estar sendo
+    referenciados agora por um upload repetido) e saem depois pelo GC.
+    """
+    path = os.path.join(folder, name)
+    try:
+        if time.time() - os.path.getmtime(path) < PHOTO_GC_GRACE:
+            return False
+        with db_connection() as conn:
+            if photo_refcounts(conn, folder, [name]):
+                return False
+    except (OSError, sqlite3.Error):
+        return False
+    remove_photo(folder, name)
+    return True
+
+def discard_new_photo(folder, name, mtime):
+    """Apaga a foto que esta requisição gravou quando a transação não a registrou.
+
+    Só apaga se o arquivo não foi tocado desde que foi gravado (`mtime`): outra
+    requisição que reaproveitou o mesmo conteúdo atualiza o mtime e a foto fica.
+    Com referência no banco também fica. Retorna True se apagou.
+    """
+    path = os.path.join(folder, name)
+    try:
+        if os.path.getmtime(path) != mtime:
+            return False
+        with db_connection() as conn:
+            if photo_refcounts(conn, folder, [name]):
+                return False
+    except (OSError, sqlite3.Error):
+        return False
+    remove_photo(folder, name)
+    return True
+
+class PhotoGC:
+    """Coleta de fotos sem referência no banco, em lotes.
+
+    Cada lote de PHOTO_GC_BATCH arquivos faz uma consulta de leitura (nenhum lock
+    de escrita) e cede o hub antes do próximo. Arquivos tocados há menos de
+    PHOTO_GC_GRACE nunca são apagados, e o mtime é conferido de novo logo antes
+    de remover, sem ceder o hub no meio.
+    """
+
+    def __init__(self, folders, thumbs_folder, batch):
+        self.folders = folders
+        self.thumbs_folder = thumbs_folder
+        self.batch = max(1, batch)
+        self.last_report = None
+        self._lock = Lock()
+
+    def run(self, dry_run=False, limite=None):
+        """Executa uma coleta e retorna o relatório; None se já há uma em andamento.
+
+        `limite` é o máximo de fotos removidas nesta execução (o resto fica para a próxima).
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            report = {'dry_run': dry_run, 'inicio': datetime.now().isoformat(timespec='seconds'), 'pastas': {}}
+            restante = [limite if limite is not None else float('inf')]
+            for folder in self.folders:
+                report['pastas'][os.path.basename(folder)] = self._sweep(folder, dry_run, restante)
+            report['miniaturas_relatorio'] = self._sweep_thumbs(dry_run)
+            report['fim'] = datetime.now().isoformat(timespec='seconds')
+            self.last_report = report
+            logger.info(f"GC de fotos: {json.dumps(report, ensure_ascii=False)}")
+            return report
+        finally:
+            self._lock.release()
+
+    def _sweep(self, folder, dry_run, restante):
+        stats = {'arquivos': 0, 'referenciados': 0, 'referencias': 0, 'recentes': 0,
+                 'sem_referencia': 0, 'removidos': 0, 'bytes_liberados': 0, 'variantes_orfas': 0}
+        try:
+            names = sorted(n for n in os.listdir(folder)
+                           if not n.endswith('.tmp') and os.path.isfile(os.path.join(folder, n)))
+        except OSError:
+            return stats
+        for start in range(0, len(names), self.batch):
+            chunk = names[start:start + self.batch]
+            with db_connection() as conn:
+                refs = photo_refcounts(conn, folder, chunk)
+            for name in chunk:
+                stats['arquivos'] += 1
+                if name in refs:
+                    stats['referenciados'] += 1
+                    stats['referencias'] += refs[name]
+                    continue
+                paths = [os.path.join(folder, name)]
+                paths += [os.path.join(folder, size, photo_variant_name(name)) for size in PHOTO_SIZES if size != 'original']
+                try:
+                    if time.time() - os.path.getmtime(paths[0]) < PHOTO_GC_GRACE:
+                        stats['recentes'] += 1
+                        continue
+                except OSError:
+                    continue
+                stats['sem_referencia'] += 1
+                if restante[0] <= 0:
+                    continue
+                stats['bytes_liberados'] += sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+                restante[0] -= 1
+                if not dry_run:
+                    remove_photo(folder, name)
+                    stats['removidos'] += 1
+            eventlet.sleep(0)
+        # Variantes cujo original já não existe (processamento interrompido)
+        stems = {os.path.splitext(n)[0] for n in names}
+        for size in PHOTO_SIZES:
+            size_folder = os.path.join(folder, size)
+            if size == 'original' or not os.path.isdir(size_folder):
+                continue
+            for name in os.listdir(size_folder):
+                path = os.path.join(size_folder, name)
+                if os.path.splitext(name)[0] in stems or os.path.exists(os.path.join(folder, name)):
+                    continue
+                try:
+                    if time.time() - os.path.getmtime(path) < PHOTO_GC_GRACE:
+                        continue
+                    stats['variantes_orfas'] += 1
+                    stats['bytes_liberados'] += os.path.getsize(path)
+                    if not dry_run:
+                        os.remove(path)
+                except OSError:
+                    pass
+        return stats
+
+    def _sweep_thumbs(self, dry_run):
+        """Miniaturas do relatório (`<foto>.<mtime>.<px>.jpg`) cuja foto não existe mais.
+
+        Os `.tmp` de miniaturas ainda sendo geradas (relatorio_pdf.py) ficam de fora,
+        e, como nas fotos, nada tocado há menos de PHOTO_GC_GRACE é apagado.
+        """
+        stats = {'arquivos': 0, 'removidos': 0, 'bytes_liberados': 0}
+        try:
+            names = [n for n in os.listdir(self.thumbs_folder) if not n.endswith('.tmp')]
+        except OSError:
+            return stats
+        for name in names:
+            stats['arquivos'] += 1
+            original = name.rsplit('.', 3)[0]
+            if os.path.exists(os.path.join(app.config['FOTOS_INSUMOS_FOLDER'], original)):
+                continue
+            path = os.path.join(self.thumbs_folder, name)
+            try:
+                if time.time() - os.path.getmtime(path) < PHOTO_GC_GRACE:
+                    continue
+                stats['bytes_liberados'] += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+                    stats['removidos'] += 1
+            except OSError:
+                pass
+        return stats
+
+    def start(self, interval):
+        """Coleta automática a cada `interval` segundos (greenlet em segundo plano)."""
+        if interval <= 0:
+            return
+        def _loop():
+            while True:
+                eventlet.sleep(interval)
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.error(f"Erro no GC de fotos: {str(e)}")
+        eventlet.spawn(_loop)
+
+photo_gc = PhotoGC([app.config['FOTOS_INSUMOS_FOLDER'], app.config['UPLOAD_FOLDER']],
+                   app.config['RELATORIO_THUMBS_FOLDER'], PHOTO_GC_BATCH)
+
+@app.route('/api/admin/fotos/gc', methods=['GET', 'POST'])
+def fotos_gc():
+    """GET: simulação (o que seria apagado). POST: coleta de fato; `limite` opcional no JSON."""
+    if not session.get('gestao_logged'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    body = request.get_json(silent=True) or {}
+    dry_run = request.method == 'GET' or bool(body.get('dry_run'))
+    try:
+        limite = int(body['limite']) if body.get('limite') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limite inválido'}), 400
+    try:
+        report = photo_gc.run(dry_run=dry_run, limite=limite)
+    except sqlite3.Error as e:
+        logger.error(f"Erro no GC de fotos: {str(e)}")
+        return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
+    if report is None:
+        return jsonify({'error': 'Coleta já em andamento', 'ultimo': photo_gc.last_report}), 409
+    return jsonify(report)
+
+@app.cli.command('gc-fotos')
+@click.option('--dry-run', is_flag=True, help='Só relata, não apaga nada.')
+@click.option('--limite', type=int, default=None, help='Máximo de fotos removidas nesta execução.')
+def gc_fotos_command(dry_run, limite):
+    """Remove fotos sem referência no banco (flask --app menu gc-fotos)."""
+    click.echo(json.dumps(photo_gc.run(dry_run=dry_run, limite=limite), ensure_ascii=False, indent=2))
+
 # Nova rota para atender insumo (salvar fotos e atualizar status)
 @app.route('/api/insumo/<int:id>/atender', methods=['PUT'])
 def atender_insumo(id):
-    with db_lock:
-        with app.app_context():
-            conn = None
-            try:
-                conn = get_db_connection()
+    with app.app_context():
+        fotos_salvas = []
+        novas_fotos = []
+        try:
+            with db_connection() as conn:
                 cursor = conn.cursor()
-                
                 # Verificar se o insumo existe
+                cursor.execute('SELECT id FROM insumos WHERE id = ?', (id,))
+                if not cursor.fetchone():
+                    logger.error(f"Insumo com id={id} não encontrado")
+                    return jsonify({'error': 'Insumo não encontrado'}), 404
+
+            # Obter dados do formulário
+            status = request.form.get('status', 'Pendente')
+            sem_fotos = request.form.get('sem_fotos') == 'true'
+            codigo_interno = request.form.get('codigo_interno', '')
+            # Nome de quem atendeu (opcional)
+            atendida_por = request.form.get('atendida_por', '').strip()
+
+            # Criar pasta para fotos de insumos se não existir
+            if not os.path.exists(app.config['FOTOS_INSUMOS_FOLDER']):
+                os.makedirs(app.config['FOTOS_INSUMOS_FOLDER'])
+
+            # Processar fotos se status for Atendido e não marcou "sem fotos".
+            # Gravadas antes de entrar na fila de escrita: o job só registra os nomes.
+            if status == 'Atendido' and not sem_fotos:
+                # Uploads feitos antes via /api/uploads: só move os arquivos prontos
+                upload_ids = request.form.getlist('uploads')
+                if len(upload_ids) == 1 and upload_ids[0].strip().startswith('['):
+                    upload_ids = [str(u) for u in json.loads(upload_ids[0])]
+                for upload_id in upload_ids:
+                    fotos_salvas.append(staged_uploads.claim(upload_id.strip(), app.config['FOTOS_INSUMOS_FOLDER']))
+                for key in request.files:
+                    if key.startswith('foto_'):
+                        file = request.files[key]
+                        if file and file.filename != '' and allowed_file(file.filename):
+                            filename = ingest_photo(file, app.config['FOTOS_INSUMOS_FOLDER'], novas_fotos)
+                            fotos_salvas.append(filename)
+                            logger.info(f"Foto salva: {filename}")
+
+            def _atender(conn):
+                cursor = conn.cursor()
                 cursor.execute('SELECT * FROM insumos WHERE id = ?', (id,))
                 insumo = cursor.fetchone()
                 if not insumo:
-                    conn.close()
-                    logger.error(f"Insumo com id={id} não encontrado")
-                    return jsonify({'error': 'Insumo não encontrado'}), 404
-                
-                # Obter dados do formulário
-                status = request.form.get('status', 'Pendente')
-                sem_fotos = request.form.get('sem_fotos') == 'true'
-                codigo_interno = request.form.get('codigo_interno', '')
+                    return None
+                insumo = dict(insumo)
 
                 # Fotos existentes no banco (para preservar ao anexar novas)
                 existing_fotos = []
                 try:
-                    raw = dict(insumo).get('fotos')
+                    raw = insumo.get('fotos')
                     if raw:
                         existing_fotos = json.loads(raw)
                         if not isinstance(existing_fotos, list):
                             existing_fotos = []
                 except Exception:
                     existing_fotos = []
-                
-                # Criar pasta para fotos de insumos se não existir
-                if not os.path.exists(app.config['FOTOS_INSUMOS_FOLDER']):
-                    os.makedirs(app.config['FOTOS_INSUMOS_FOLDER'])
-                
-                fotos_salvas = []
-                
-                # Processar fotos se status for Atendido e não marcou "sem fotos"
-                if status == 'Atendido' and not sem_fotos:
-                    for key in request.files:
-                        if key.startswith('foto_'):
-                            file = request.files[key]
-                            if file and file.filename != '' and allowed_file(file.filename):
-                                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                                filename = f"insumo_{id}_{timestamp}_{secure_filename(file.filename)}"
-                                filepath = os.path.join(app.config['FOTOS_INSUMOS_FOLDER'], filename)
-                                file.save(filepath)
-                                fotos_salvas.append(filename)
-                                logger.info(f"Foto salva: {filename}")
-                
+
                 # Atualizar no banco de dados (preservando fotos antigas)
-                prev_status = (dict(insumo).get('status') or '').strip().lower()
-                prev_data_at = dict(insumo).get('data_atendimento')
+                prev_status = (insumo.get('status') or '').strip().lower()
+                prev_data_at = insumo.get('data_atendimento')
                 if status == 'Atendido':
                     if prev_status != 'atendido' or not prev_data_at:
                         data_atendimento = datetime.now().strftime('%d/%m/%Y %H:%M')
@@ -1278,11 +3016,9 @@ def atender_insumo(id):
                 fotos_json = json.dumps(combined_unique)
 
                 # Preservar codigo_interno atual se não foi enviado
-                current_codigo_interno = (dict(insumo).get('codigo_interno') or '')
+                current_codigo_interno = (insumo.get('codigo_interno') or '')
                 final_codigo_interno = codigo_interno if (codigo_interno is not None and len(codigo_interno.strip()) > 0) else current_codigo_interno
-                # Nome de quem atendeu (opcional)
-                atendida_por = request.form.get('atendida_por', '').strip()
-                
+
                 cursor.execute('''
                     UPDATE insumos SET 
                         status = ?, 
@@ -1293,53 +3029,60 @@ def atender_insumo(id):
                         atendida_por = COALESCE(NULLIF(?, ''), atendida_por)
                     WHERE id = ?
                 ''', (status, final_codigo_interno, fotos_json, 1 if sem_fotos else 0, data_atendimento, atendida_por, id))
-                
-                conn.commit()
-                conn.close()
-                
-                logger.info(f"Insumo {id} atualizado com sucesso - Status: {status}, Fotos: {len(fotos_salvas)}")
-                return jsonify({
-                    'message': 'Insumo atualizado com sucesso!',
-                    'status': status,
-                    'fotos_count': len(fotos_salvas),
-                    'codigo_interno': final_codigo_interno,
-                    'fotos': combined_unique,
-                    'fotos_urls': [f"/fotos_insumos/{name}" for name in combined_unique]
-                })
-                
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro no banco de dados ao atender insumo {id}: {str(e)}")
-                return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
-            except Exception as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro inesperado ao atender insumo {id}: {str(e)}")
-                return jsonify({'error': f'Erro inesperado: {str(e)}'}), 500
+                return final_codigo_interno, combined_unique
+
+            result = db_writer.submit(_atender)
+            if result is None:
+                logger.error(f"Insumo com id={id} não encontrado")
+                return jsonify({'error': 'Insumo não encontrado'}), 404
+            final_codigo_interno, combined_unique = result
+            fotos_registradas = len(fotos_salvas)
+            novas_fotos = []
+            publish_event('insumo.updated', id, {'status': status, 'fotos': len(combined_unique)})
+
+            logger.info(f"Insumo {id} atualizado com sucesso - Status: {status}, Fotos: {fotos_registradas}")
+            return jsonify({
+                'message': 'Insumo atualizado com sucesso!',
+                'status': status,
+                'fotos_count': fotos_registradas,
+                'codigo_interno': final_codigo_interno,
+                'fotos': combined_unique,
+                'fotos_urls': [f"/fotos_insumos/{name}" for name in combined_unique]
+            })
+
+        except sqlite3.Error as e:
+            logger.error(f"Erro no banco de dados ao atender insumo {id}: {str(e)}")
+            return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
+        except ValueError as e:
+            logger.error(f"Foto inválida ao atender insumo {id}: {str(e)}")
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Erro inesperado ao atender insumo {id}: {str(e)}")
+            return jsonify({'error': f'Erro inesperado: {str(e)}'}), 500
+        finally:
+            # Fotos enviadas nesta requisição que não chegaram ao banco. As vindas de
+            # /api/uploads ficam: o retry reusa o mesmo upload id (claim idempotente)
+            # e, se ninguém as registrar, o PhotoGC as remove depois de PHOTO_GC_GRACE.
+            for name, mtime in novas_fotos:
+                discard_new_photo(app.config['FOTOS_INSUMOS_FOLDER'], name, mtime)
 
 @app.route('/api/insumo/<int:id>/foto', methods=['DELETE'])
 def delete_insumo_foto(id):
     """Remove uma foto persistida de um insumo e atualiza o array de fotos.
     ParÃ¢metro: name (querystring) com o nome do arquivo.
     """
-    with db_lock:
-        with app.app_context():
-            conn = None
-            try:
-                name = request.args.get('name')
-                if not name:
-                    return jsonify({'error': 'Nome da foto não informado'}), 400
-                conn = get_db_connection()
+    with app.app_context():
+        try:
+            name = request.args.get('name')
+            if not name:
+                return jsonify({'error': 'Nome da foto não informado'}), 400
+
+            def _remover(conn):
                 cursor = conn.cursor()
                 cursor.execute('SELECT fotos FROM insumos WHERE id = ?', (id,))
                 row = cursor.fetchone()
                 if not row:
-                    if conn:
-                        conn.close()
-                    return jsonify({'error': 'Insumo não encontrado'}), 404
+                    return None
                 fotos = []
                 try:
                     if row['fotos']:
@@ -1351,90 +3094,329 @@ def delete_insumo_foto(id):
                 # Remove a foto solicitada
                 fotos = [f for f in fotos if f != name]
                 cursor.execute('UPDATE insumos SET fotos = ? WHERE id = ?', (json.dumps(fotos), id))
-                conn.commit()
-                conn.close()
-                # Tentar remover o arquivo do disco (opcional)
-                try:
-                    path = os.path.join(app.config['FOTOS_INSUMOS_FOLDER'], name)
-                    if os.path.exists(path):
-                        os.remove(path)
-                except Exception:
-                    pass
-                return jsonify({'message': 'Foto removida', 'fotos': fotos, 'fotos_urls': [f"/fotos_insumos/{n}" for n in fotos]})
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
+                return fotos
+
+            fotos = db_writer.submit(_remover)
+            if fotos is None:
+                return jsonify({'error': 'Insumo não encontrado'}), 404
+            publish_event('insumo.updated', id, {'fotos': len(fotos)})
+            # Tentar remover o arquivo do disco (opcional)
+            release_photo(app.config['FOTOS_INSUMOS_FOLDER'], secure_filename(name))
+            return jsonify({'message': 'Foto removida', 'fotos': fotos, 'fotos_urls': [f"/fotos_insumos/{n}" for n in fotos]})
+        except sqlite3.Error as e:
+            return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
+
+def load_catalog(conn, where='', params=(), order_by='ic.nome_descricao', limit=None, columns='ic.*'):
+    """Carrega itens do cadastro já montados com composição, máquinas e células.
+
+    Sempre 4 consultas, independente do número de itens: os itens filtrados por
+    `where` (cláusula sobre itens_cadastro com alias `ic`) e, para as tabelas
+    filhas, um IN com a mesma subconsulta. Montagem em uma passada por dicionário.
+    Com `limit`, a subconsulta leva o mesmo ORDER BY/LIMIT (página de uma busca);
+    `where` pode começar com um JOIN, cujas colunas entram via `columns`.
+    """
+    cursor = conn.cursor()
+    if limit is not None:
+        where = f"{where} ORDER BY {order_by} LIMIT {int(limit)}"
+        cursor.execute(f"SELECT {columns} FROM itens_cadastro ic {where}", params)
+    else:
+        cursor.execute(f"SELECT {columns} FROM itens_cadastro ic {where} ORDER BY {order_by}", params)
+    itens = [dict(row) for row in cursor.fetchall()]
+    if not itens:
+        return []
+
+    by_id = {}
+    for item in itens:
+        item['composicao'] = []
+        item['maquinas'] = []
+        item['celulas'] = []
+        by_id[item['id']] = item
+
+    # Sem filtro, varrer as tabelas filhas inteiras é mais barato que o IN
+    if where.strip():
+        scope_cf = f"AND cf.ferramenta_id IN (SELECT ic.id FROM itens_cadastro ic {where})"
+        scope = f"AND item_id IN (SELECT ic.id FROM itens_cadastro ic {where})"
+    else:
+        scope_cf = scope = ''
+
+    cursor.execute(f'''
+        SELECT cf.ferramenta_id, i.id, i.nome_descricao AS nome, cf.quantidade
+        FROM composicao_ferramentas cf
+        JOIN itens_cadastro i ON cf.insumo_id = i.id
+        WHERE 1 = 1 {scope_cf}
+        ORDER BY cf.id
+    ''', params)
+    for row in cursor.fetchall():
+        item = by_id.get(row['ferramenta_id'])
+        if item is not None:
+            item['composicao'].append({'id': row['id'], 'nome': row['nome'], 'quantidade': row['quantidade']})
+
+    cursor.execute(f'''
+        SELECT DISTINCT item_id, maquina
+        FROM itens_maquinas
+        WHERE maquina IS NOT NULL AND TRIM(maquina) != '' {scope}
+        ORDER BY item_id, maquina
+    ''', params)
+    for row in cursor.fetchall():
+        item = by_id.get(row['item_id'])
+        if item is not None:
+            item['maquinas'].append(row['maquina'])
+
+    cursor.execute(f"SELECT item_id, celula FROM itens_celulas WHERE 1 = 1 {scope} ORDER BY id", params)
+    for row in cursor.fetchall():
+        item = by_id.get(row['item_id'])
+        if item is not None:
+            item['celulas'].append(row['celula'])
+
+    return itens
+
+def bump_catalog_version(conn):
+    """Invalida o cache do catálogo e regrava as fichas alteradas; chamar dentro do job de escrita que altera o cadastro."""
+    conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'catalog_version'")
+    refresh_item_docs(conn)
+
+def refresh_item_docs(conn):
+    """Regrava em item_docs as fichas dos itens marcados pelos triggers; roda dentro de um job do escritor.
+
+    Item excluído só perde a ficha; código alterado troca a chave. Retorna quantas fichas foram gravadas.
+    """
+    if conn.execute('SELECT 1 FROM item_docs_dirty LIMIT 1').fetchone() is None:
+        return 0
+    itens = load_catalog(conn, 'WHERE ic.id IN (SELECT item_id FROM item_docs_dirty)', order_by='ic.id')
+    conn.execute('DELETE FROM item_docs WHERE item_id IN (SELECT item_id FROM item_docs_dirty)')
+    conn.executemany('INSERT INTO item_docs (codigo_interno, item_id, doc) VALUES (?, ?, ?)', [
+        (item['codigo_interno'], item['id'], app.json.dumps(item).encode('utf-8')) for item in itens
+    ])
+    conn.execute('DELETE FROM item_docs_dirty')
+    return len(itens)
+
+def item_doc_response(doc):
+    """Resposta JSON com a ficha pré-serializada, sem decodificar nem serializar de novo."""
+    resp = make_response(doc)
+    resp.mimetype = 'application/json'
+    return resp
+
+def json_for_script(doc):
+    """Ficha serializada pronta para um <script type="application/json"> da página.
+
+    Mesmo escape do filtro tojson do Jinja: <, >, & e ' só aparecem dentro de
+    strings JSON, onde a forma \\uXXXX é equivalente.
+    """
+    text = doc.decode('utf-8')
+    for char, escaped in (('<', '\\u003c'), ('>', '\\u003e'), ('&', '\\u0026'), ("'", '\\u0027')):
+        text = text.replace(char, escaped)
+    return Markup(text)
+
+def read_catalog_version(conn):
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'catalog_version'").fetchone()
+    return row[0] if row else 0
+
+class CatalogCache:
+    """Catálogo completo já serializado, válido enquanto a versão no banco não muda.
+
+    A versão fica em app_meta e é incrementada na mesma transação da escrita,
+    então vale entre processos e reinícios; aqui só guardamos o último JSON.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._body = None
+        self._count = 0
+
+    def get(self, conn):
+        """Retorna (versão, corpo JSON em bytes, quantidade de itens)."""
+        version = read_catalog_version(conn)
+        if version == self._version:
+            return self._version, self._body, self._count
+        with self._lock:
+            if version == self._version:
+                return self._version, self._body, self._count
+            # Versão e itens lidos no mesmo snapshot
+            conn.execute('BEGIN')
+            try:
+                version = read_catalog_version(conn)
+                itens = load_catalog(conn)
+            finally:
+                conn.rollback()
+            self._body = app.json.dumps(itens).encode('utf-8')
+            self._count = len(itens)
+            self._version = version
+            return self._version, self._body, self._count
+
+catalog_cache = CatalogCache()
 
 @app.route('/api/itens_cadastro', methods=['GET'])
 def api_itens_cadastro():
     with app.app_context():  # Ensure application context
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM itens_cadastro ORDER BY nome_descricao")
-            itens = [dict(row) for row in cursor.fetchall()]
-            for item in itens:
-                cursor.execute('''
-                    SELECT i.id, i.nome_descricao AS nome
-                    FROM composicao_ferramentas cf
-                    JOIN itens_cadastro i ON cf.insumo_id = i.id
-                    WHERE cf.ferramenta_id = ?
-                ''', (item['id'],))
-                item['composicao'] = [dict(row) for row in cursor.fetchall()]
-                cursor.execute('''
-                    SELECT DISTINCT maquina
-                    FROM itens_maquinas
-                    WHERE item_id = ? AND maquina IS NOT NULL AND TRIM(maquina) != ''
-                    ORDER BY maquina
-                ''', (item['id'],))
-                item['maquinas'] = [row['maquina'] for row in cursor.fetchall()]
-
-            conn.close()
-            logger.info(f"API /api/itens_cadastro retornou {len(itens)} itens")
-            return jsonify(itens)
+            with db_connection() as conn:
+                version, body, count = catalog_cache.get(conn)
+            resp = make_response(body)
+            resp.mimetype = 'application/json'
+            resp.set_etag(f'catalog-{version}')
+            # Cliente sempre revalida; com If-None-Match igual a resposta é 304 sem corpo
+            resp.headers['Cache-Control'] = 'no-cache'
+            logger.info(f"API /api/itens_cadastro retornou {count} itens (versão {version})")
+            return resp.make_conditional(request)
         except sqlite3.Error as e:
             logger.error(f"Erro na API /api/itens_cadastro: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+# Chaves de ordenação da busca: nome -> (coluna, descendente); o id desempata e fecha o cursor
+CATALOG_SEARCH_SORTS = {
+    'nome': ('ic.nome_descricao', False),
+    '-nome': ('ic.nome_descricao', True),
+    'codigo': ('ic.codigo_interno', False),
+    '-codigo': ('ic.codigo_interno', True),
+    'recentes': ('ic.id', True),
+    'antigos': ('ic.id', False),
+    'relevancia': ('f.rank', False),  # bm25: menor é melhor; só com q e FTS5
+}
+# Pesos bm25 por coluna do índice: nome, código interno, código de fabricação, categoria, material
+CATALOG_FTS_WEIGHTS = '10.0, 8.0, 6.0, 2.0, 2.0'
+
+def fts_match_query(termo):
+    """Converte o texto digitado em consulta FTS5: cada palavra vira um prefixo e todas são exigidas.
+
+    Retorna '' quando não sobra nenhuma palavra (só pontuação, por exemplo).
+    """
+    palavras = re.findall(r'\w+', termo)
+    return ' '.join(f'"{p}"*' for p in palavras)
+CATALOG_SEARCH_LIMIT = 50
+CATALOG_SEARCH_MAX_LIMIT = 200
+
+def like_contains(termo):
+    """Padrão LIKE "contém `termo`" com %, _ e \\ escapados (usar com ESCAPE '\\')."""
+    return '%' + termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def encode_cursor(values):
+    """Cursor opaco de paginação (keyset): lista JSON em base64 url-safe."""
+    raw = json.dumps(values, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, size):
+    """Inverso de encode_cursor; ValueError se o cursor não for uma lista de `size` valores."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError('cursor inválido')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('cursor inválido')
+    return values
+
+def encode_search_cursor(sort, item):
+    column = CATALOG_SEARCH_SORTS[sort][0].split('.', 1)[1]
+    return encode_cursor([sort, item[column], item['id']])
+
+def decode_search_cursor(cursor, sort):
+    """Retorna (valor, id) da última linha da página anterior; ValueError se inválido."""
+    cursor_sort, value, last_id = decode_cursor(cursor, 3)
+    if cursor_sort != sort or not isinstance(last_id, int):
+        raise ValueError('cursor não corresponde à ordenação')
+    return value, last_id
+
+@app.route('/api/itens_cadastro/search', methods=['GET'])
+def search_itens_cadastro():
+    """Busca paginada no cadastro (keyset): q, tipo, maquina, celula, sort, limit, cursor.
+
+    Com FTS5, q casa por prefixo sem diferenciar acentos/maiúsculas e a ordenação
+    padrão passa a ser por relevância. Retorna {items, next_cursor, sort};
+    next_cursor é None na última página.
+    """
+    termo = (request.args.get('q') or '').strip()
+    tipo = (request.args.get('tipo') or '').strip().lower()
+    maquina = (request.args.get('maquina') or '').strip()
+    celula = (request.args.get('celula') or '').strip()
+    sort = (request.args.get('sort') or '').strip()
+    cursor = (request.args.get('cursor') or '').strip()
+    match = fts_match_query(termo) if CATALOG_FTS else ''
+    if not sort or sort == 'relevancia':
+        sort = 'relevancia' if match else 'nome'
+
+    if sort not in CATALOG_SEARCH_SORTS:
+        return jsonify({'error': f"Ordenação inválida: use {', '.join(CATALOG_SEARCH_SORTS)}"}), 400
+    if tipo and tipo not in ('ferramenta', 'insumo'):
+        return jsonify({'error': 'Tipo inválido'}), 400
+    try:
+        limit = int(request.args.get('limit', CATALOG_SEARCH_LIMIT))
+    except ValueError:
+        limit = CATALOG_SEARCH_LIMIT
+    limit = max(1, min(limit, CATALOG_SEARCH_MAX_LIMIT))
+
+    column, descending = CATALOG_SEARCH_SORTS[sort]
+    join, clauses, params = '', [], []
+    if match and sort == 'relevancia':
+        join = f'''JOIN (
+            SELECT rowid, bm25(itens_cadastro_fts, {CATALOG_FTS_WEIGHTS}) AS rank
+            FROM itens_cadastro_fts WHERE itens_cadastro_fts MATCH ?
+        ) f ON f.rowid = ic.id'''
+        params.append(match)
+    elif match:
+        clauses.append('ic.id IN (SELECT rowid FROM itens_cadastro_fts WHERE itens_cadastro_fts MATCH ?)')
+        params.append(match)
+    elif termo and not CATALOG_FTS:
+        like = like_contains(termo)
+        clauses.append("(ic.nome_descricao LIKE ? ESCAPE '\\' OR ic.codigo_interno LIKE ? ESCAPE '\\'"
+                       " OR ic.codigo_fabricacao LIKE ? ESCAPE '\\')")
+        params += [like, like, like]
+    if tipo:
+        clauses.append('ic.tipo_item = ?')
+        params.append(tipo)
+    if maquina:
+        clauses.append('ic.id IN (SELECT item_id FROM itens_maquinas WHERE maquina = ?)')
+        params.append(maquina)
+    if celula:
+        clauses.append('ic.id IN (SELECT item_id FROM itens_celulas WHERE celula = ?)')
+        params.append(celula)
+    if cursor:
+        try:
+            value, last_id = decode_search_cursor(cursor, sort)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        op = '<' if descending else '>'
+        if column == 'ic.id':
+            clauses.append(f'ic.id {op} ?')
+            params.append(last_id)
+        else:
+            clauses.append(f'({column}, ic.id) {op} (?, ?)')
+            params += [value, last_id]
+
+    where = join + ((' WHERE ' + ' AND '.join(clauses)) if clauses else '')
+    direction = 'DESC' if descending else 'ASC'
+    order_by = f'{column} {direction}' if column == 'ic.id' else f'{column} {direction}, ic.id {direction}'
+    columns = 'ic.*, f.rank AS rank' if join else 'ic.*'
+
+    with app.app_context():
+        try:
+            with db_connection() as conn:
+                # Um a mais para saber se existe próxima página sem COUNT(*)
+                itens = load_catalog(conn, where, tuple(params), order_by=order_by, limit=limit + 1, columns=columns)
+        except sqlite3.Error as e:
+            logger.error(f"Erro na busca do cadastro: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    next_cursor = None
+    if len(itens) > limit:
+        itens = itens[:limit]
+        next_cursor = encode_search_cursor(sort, itens[-1])
+    if join:
+        for item in itens:
+            item.pop('rank', None)
+    return jsonify({'items': itens, 'next_cursor': next_cursor, 'sort': sort})
+
 @app.route('/api/itens_cadastro/<int:id>', methods=['GET'])
 def get_item(id):
     with app.app_context():  # Ensure application context
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM itens_cadastro WHERE id = ?', (id,))
-            item = cursor.fetchone()
-            if not item:
-                conn.close()
+            with db_connection() as conn:
+                row = conn.execute('SELECT doc FROM item_docs WHERE item_id = ?', (id,)).fetchone()
+            if not row:
                 logger.error(f"Item com id={id} não encontrado")
                 return jsonify({"error": "Item não encontrado"}), 404
-            
-            item_dict = dict(item)
-            cursor.execute('''
-                SELECT i.id, i.nome_descricao AS nome
-                FROM composicao_ferramentas cf
-                JOIN itens_cadastro i ON cf.insumo_id = i.id
-                WHERE cf.ferramenta_id = ?
-            ''', (id,))
-            item_dict['composicao'] = [dict(row) for row in cursor.fetchall()]
-
-            cursor.execute('''
-                SELECT DISTINCT maquina
-                FROM itens_maquinas
-                WHERE item_id = ? AND maquina IS NOT NULL AND TRIM(maquina) != ''
-                ORDER BY maquina
-            ''', (id,))
-            item_dict['maquinas'] = [row['maquina'] for row in cursor.fetchall()]
-
-            # Células
-            cursor.execute('SELECT celula FROM itens_celulas WHERE item_id = ?', (id,))
-            item_dict['celulas'] = [row['celula'] for row in cursor.fetchall()]
 
-            conn.close()
-            logger.info(f"Item retornado para id={id}: {item_dict}")
-            return jsonify(item_dict)
+            return item_doc_response(row['doc'])
         except sqlite3.Error as e:
             logger.error(f"Erro ao obter item id={id}: {str(e)}")
             return jsonify({"error": str(e)}), 500
@@ -1443,64 +3425,35 @@ def get_item(id):
 def get_item_by_codigo(codigo_interno):
     with app.app_context():
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM itens_cadastro WHERE codigo_interno = ?', (codigo_interno,))
-            item = cursor.fetchone()
-            if not item:
-                conn.close()
+            # Leitura de QR: uma busca pela chave primária, bytes devolvidos como estão
+            with db_connection() as conn:
+                row = conn.execute('SELECT doc FROM item_docs WHERE codigo_interno = ?', (codigo_interno,)).fetchone()
+            if not row:
                 logger.error(f"Item com codigo_interno={codigo_interno} não encontrado")
                 return jsonify({"error": "Item não encontrado"}), 404
-            
-            item_dict = dict(item)
-            cursor.execute('''
-                SELECT i.id, i.nome_descricao AS nome
-                FROM composicao_ferramentas cf
-                JOIN itens_cadastro i ON cf.insumo_id = i.id
-                WHERE cf.ferramenta_id = ?
-            ''', (item_dict['id'],))
-            item_dict['composicao'] = [dict(row) for row in cursor.fetchall()]
-
-            cursor.execute('''
-                SELECT DISTINCT maquina
-                FROM itens_maquinas
-                WHERE item_id = ? AND maquina IS NOT NULL AND TRIM(maquina) != ''
-                ORDER BY maquina
-            ''', (item_dict['id'],))
-            item_dict['maquinas'] = [row['maquina'] for row in cursor.fetchall()]
-
-            # Células
-            cursor.execute('SELECT celula FROM itens_celulas WHERE item_id = ?', (item_dict['id'],))
-            item_dict['celulas'] = [row['celula'] for row in cursor.fetchall()]
 
-            conn.close()
-            logger.info(f"Item retornado para codigo_interno={codigo_interno}: {item_dict}")
-            return jsonify(item_dict)
+            return item_doc_response(row['doc'])
         except sqlite3.Error as e:
             logger.error(f"Erro ao obter item codigo_interno={codigo_interno}: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
 @app.route('/api/itens_cadastro/<int:id>', methods=['PUT'])
 def update_item(id):
-    with db_lock:
-        with app.app_context():  # Ensure application context
-            conn = None
-            try:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-
-                # Check if the request is for undoing a deletion
-                if request.is_json and request.get_json().get('undo') == True:
+    with app.app_context():  # Ensure application context
+        novas_fotos = []
+        try:
+            # Check if the request is for undoing a deletion
+            if request.is_json and request.get_json().get('undo') == True:
+                def _desfazer(conn):
+                    cursor = conn.cursor()
                     cursor.execute('SELECT * FROM itens_cadastro_deleted WHERE id = ?', (id,))
                     deleted_item = cursor.fetchone()
                     if not deleted_item:
-                        conn.close()
                         logger.error(f"Item excluÃ­do com id={id} não encontrado")
                         return jsonify({'message': 'Item excluÃ­do não encontrado.'}), 404
 
                     cursor.execute('SELECT id FROM itens_cadastro WHERE lower(codigo_interno) = lower(?)', (deleted_item['codigo_interno'],))
                     if cursor.fetchone():
-                        conn.close()
                         logger.error(f"Não foi possÃ­vel desfazer: código interno {deleted_item['codigo_interno']} já está em uso")
                         return jsonify({'message': 'Não foi possÃ­vel desfazer: o código interno já está em uso.'}), 409
 
@@ -1525,78 +3478,118 @@ def update_item(id):
 
                     cursor.execute('DELETE FROM composicao_ferramentas_deleted WHERE ferramenta_id = ?', (id,))
                     cursor.execute('DELETE FROM itens_cadastro_deleted WHERE id = ?', (id,))
+                    bump_catalog_version(conn)
 
-                    conn.commit()
-                    conn.close()
                     logger.info(f"Item {id} restaurado com sucesso")
                     return jsonify({'message': 'Item restaurado com sucesso!'})
 
-                # Existing update logic
-                form_data = request.form
+                resp = db_writer.submit(_desfazer)
+                if response_ok(resp):
+                    publish_event('item.changed', id, {'op': 'restored'})
+                return resp
+
+            # Existing update logic
+            form_data = request.form
+            codigo_interno = form_data.get('codigo_interno', '').strip()
+            with db_connection() as conn:
+                cursor = conn.cursor()
                 cursor.execute('SELECT * FROM itens_cadastro WHERE id = ?', (id,))
                 existing_item = cursor.fetchone()
                 if not existing_item:
-                    conn.close()
                     logger.error(f"Item com id={id} não encontrado")
                     return jsonify({'message': 'Item não encontrado.'}), 404
 
-                codigo_interno = form_data.get('codigo_interno', '').strip()
                 if not codigo_interno:
-                    conn.close()
                     logger.error("Código interno não fornecido")
                     return jsonify({'message': 'Código interno é obrigatório.'}), 400
 
                 cursor.execute('SELECT id FROM itens_cadastro WHERE lower(codigo_interno) = lower(?) AND id != ?', (codigo_interno, id))
                 if cursor.fetchone():
-                    conn.close()
                     logger.error(f"Código interno {codigo_interno} já existe")
                     return jsonify({'message': 'Código interno já existe! Use um código diferente.'}), 400
 
-                altura_min = form_data.get('altura_min')
-                altura_min = float(altura_min) if altura_min and altura_min.strip() else None
-                altura_max = form_data.get('altura_max')
-                altura_max = float(altura_max) if altura_max and altura_max.strip() else None
-                if altura_max is not None and altura_min is not None and altura_min > altura_max:
-                    conn.close()
-                    logger.error("Altura mÃ­nima maior que altura máxima")
-                    return jsonify({'message': 'Altura mÃ­nima não pode ser maior que altura máxima.'}), 400
-
-                rpm = form_data.get('rpm')
-                rpm = int(rpm) if rpm and rpm.strip() else None
-                avanco = form_data.get('avanco')
-                avanco = float(avanco) if avanco and avanco.strip() else None
-
-                categoria = form_data.get('categoria')
-                categoria = categoria if categoria and categoria.strip() else None
-                material = form_data.get('material')
-                material = material if material and material.strip() else None
-
-                foto_filename = existing_item['foto']
-                if 'foto' in request.files:
-                    file = request.files['foto']
-                    if file and file.filename != '' and allowed_file(file.filename):
-                        if not os.path.exists(app.config['UPLOAD_FOLDER']):
-                            os.makedirs(app.config['UPLOAD_FOLDER'])
-                        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                        filename = f"{codigo_interno}_{timestamp}_{secure_filename(file.filename)}"
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        file.save(filepath)
-                        if existing_item['foto'] and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], existing_item['foto'])):
-                            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], existing_item['foto']))
-                        foto_filename = filename
-                    elif file and file.filename != '':
-                        conn.close()
-                        logger.error("Invalid file format for foto")
-                        return jsonify({'message': 'Formato de arquivo inválido. Use: PNG, JPG, JPEG, GIF, WEBP.'}), 400
-
-                if form_data.get('remove_foto') == 'true' and existing_item['foto']:
-                    if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], existing_item['foto'])):
-                        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], existing_item['foto']))
-                    foto_filename = None
-
-                maquina_upd = form_data.get('maquina') or form_data.get('ferramenta_tipo') or existing_item['maquina']
-                maquina_upd = (maquina_upd or '').strip() or None
+            altura_min = form_data.get('altura_min')
+            altura_min = float(altura_min) if altura_min and altura_min.strip() else None
+            altura_max = form_data.get('altura_max')
+            altura_max = float(altura_max) if altura_max and altura_max.strip() else None
+            if altura_max is not None and altura_min is not None and altura_min > altura_max:
+                logger.error("Altura mÃ­nima maior que altura máxima")
+                return jsonify({'message': 'Altura mÃ­nima não pode ser maior que altura máxima.'}), 400
+
+            rpm = form_data.get('rpm')
+            rpm = int(rpm) if rpm and rpm.strip() else None
+            avanco = form_data.get('avanco')
+            avanco = float(avanco) if avanco and avanco.strip() else None
+
+            categoria = form_data.get('categoria')
+            categoria = categoria if categoria and categoria.strip() else None
+            material = form_data.get('material')
+            material = material if material and material.strip() else None
+
+            composicao_ids = []
+            if form_data.get('tipo_item') == 'ferramenta':
+                insumos_ids = json.loads(form_data.get('composicao', '[]'))
+                composicao_ids = [int(insumo['id']) for insumo in insumos_ids if insumo.get('id')]
+
+            # Atualizar máquinas cadastradas
+            maquinas_list = []
+            try:
+                maquinas_vals = request.form.getlist('maquinas')
+                if len(maquinas_vals) == 1 and maquinas_vals[0] and maquinas_vals[0].strip().startswith('['):
+                    parsed_m = json.loads(maquinas_vals[0])
+                    maquinas_list = [str(m).strip() for m in parsed_m if isinstance(m, (str, bytes)) and str(m).strip()]
+                else:
+                    maquinas_list = [m.strip() for m in maquinas_vals if m and m.strip()]
+            except Exception:
+                maquinas_list = []
+
+            # Atualizar Células
+            celulas_vals = request.form.getlist('celulas')
+            celulas_list = []
+            if len(celulas_vals) == 1 and celulas_vals[0] and celulas_vals[0].strip().startswith('['):
+                try:
+                    parsed = json.loads(celulas_vals[0])
+                    celulas_list = [str(c).strip() for c in parsed if isinstance(c, (str, bytes)) and str(c).strip()]
+                except Exception:
+                    celulas_list = []
+            else:
+                celulas_list = [c.strip() for c in celulas_vals if c and c.strip()]
+
+            maquina_upd = form_data.get('maquina') or form_data.get('ferramenta_tipo') or existing_item['maquina']
+            maquina_upd = (maquina_upd or '').strip() or None
+
+            # Foto nova gravada fora da fila de escrita; a antiga só sai depois do COMMIT
+            foto_filename = existing_item['foto']
+            if 'foto' in request.files:
+                file = request.files['foto']
+                if file and file.filename != '' and allowed_file(file.filename):
+                    foto_filename = ingest_photo(file, app.config['UPLOAD_FOLDER'], novas_fotos)
+                elif file and file.filename != '':
+                    logger.error("Invalid file format for foto")
+                    return jsonify({'message': 'Formato de arquivo inválido. Use: PNG, JPG, JPEG, GIF, WEBP.'}), 400
+
+            if form_data.get('remove_foto') == 'true' and existing_item['foto']:
+                foto_filename = None
+
+            valores = (
+                form_data.get('tipo_item', ''),
+                form_data.get('codigo_fabricacao', ''),
+                codigo_interno,
+                form_data.get('nome_descricao', ''),
+                foto_filename,
+                categoria,
+                material,
+                maquina_upd,
+                altura_min,
+                altura_max,
+                rpm,
+                avanco,
+                datetime.now().strftime('%d/%m/%Y %H:%M'),
+                id
+            )
 
+            def _atualizar(conn):
+                cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE itens_cadastro SET
                         tipo_item = ?,
@@ -1613,104 +3606,65 @@ def update_item(id):
                         avanco = ?,
                         data_cadastro = ?
                     WHERE id = ?
-                ''', (
-                    form_data.get('tipo_item', ''),
-                    form_data.get('codigo_fabricacao', ''),
-                    codigo_interno,
-                    form_data.get('nome_descricao', ''),
-                    foto_filename,
-                    categoria,
-                    material,
-                    maquina_upd,
-                    altura_min,
-                    altura_max,
-                    rpm,
-                    avanco,
-                    datetime.now().strftime('%d/%m/%Y %H:%M'),
-                    id
-                ))
+                ''', valores)
+                if cursor.rowcount == 0:
+                    return False
 
                 cursor.execute('DELETE FROM composicao_ferramentas WHERE ferramenta_id = ?', (id,))
-                if form_data.get('tipo_item') == 'ferramenta':
-                    insumos_ids = json.loads(form_data.get('composicao', '[]'))
-                    for insumo in insumos_ids:
-                        if insumo.get('id'):
-                            cursor.execute('''
-                                INSERT INTO composicao_ferramentas (ferramenta_id, insumo_id, quantidade)
-                                VALUES (?, ?, ?)
-                            ''', (id, int(insumo['id']), 1))
-
-                # Atualizar máquinas cadastradas
-                maquinas_list = []
-                try:
-                    maquinas_vals = request.form.getlist('maquinas')
-                    if len(maquinas_vals) == 1 and maquinas_vals[0] and maquinas_vals[0].strip().startswith('['):
-                        parsed_m = json.loads(maquinas_vals[0])
-                        maquinas_list = [str(m).strip() for m in parsed_m if isinstance(m, (str, bytes)) and str(m).strip()]
-                    else:
-                        maquinas_list = [m.strip() for m in maquinas_vals if m and m.strip()]
-                except Exception:
-                    maquinas_list = []
+                if composicao_ids:
+                    cursor.executemany('''
+                        INSERT INTO composicao_ferramentas (ferramenta_id, insumo_id, quantidade)
+                        VALUES (?, ?, ?)
+                    ''', [(id, insumo_id, 1) for insumo_id in composicao_ids])
 
                 cursor.execute('DELETE FROM itens_maquinas WHERE item_id = ?', (id,))
                 if maquinas_list:
                     cursor.executemany('INSERT INTO itens_maquinas (item_id, maquina) VALUES (?, ?)', [(id, maq) for maq in maquinas_list])
 
-                # Atualizar Células
-                celulas_vals = request.form.getlist('celulas')
-                celulas_list = []
-                if len(celulas_vals) == 1 and celulas_vals[0] and celulas_vals[0].strip().startswith('['):
-                    try:
-                        parsed = json.loads(celulas_vals[0])
-                        celulas_list = [str(c).strip() for c in parsed if isinstance(c, (str, bytes)) and str(c).strip()]
-                    except Exception:
-                        celulas_list = []
-                else:
-                    celulas_list = [c.strip() for c in celulas_vals if c and c.strip()]
-
                 cursor.execute('DELETE FROM itens_celulas WHERE item_id = ?', (id,))
                 if celulas_list:
-                    for cel in celulas_list:
-                        cursor.execute('INSERT INTO itens_celulas (item_id, celula) VALUES (?, ?)', (id, cel))
+                    cursor.executemany('INSERT INTO itens_celulas (item_id, celula) VALUES (?, ?)', [(id, cel) for cel in celulas_list])
+                bump_catalog_version(conn)
+                return True
 
-                conn.commit()
-                conn.close()
-                logger.info(f"Item {id} atualizado com sucesso")
-                return jsonify({'message': 'Item atualizado com sucesso!'})
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro no banco de dados ao atualizar item {id}: {str(e)}")
-                return jsonify({'message': f'Erro no banco de dados: {str(e)}'}), 500
-            except ValueError as e:
-                if conn is not None:
-                    conn.close()
-                logger.error(f"Erro de validação ao atualizar item {id}: {str(e)}")
-                return jsonify({'message': f'Erro de validação: {str(e)}'}), 400
-            except Exception as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro inesperado ao atualizar item {id}: {str(e)}")
-                return jsonify({'message': f'Erro inesperado: {str(e)}'}), 500
+            if not db_writer.submit(_atualizar):
+                logger.error(f"Item com id={id} não encontrado")
+                return jsonify({'message': 'Item não encontrado.'}), 404
+            novas_fotos = []
+            publish_event('item.changed', id, {'codigo_interno': codigo_interno, 'op': 'updated'})
+
+            # Remove a foto anterior se foi substituída ou removida
+            if existing_item['foto'] and foto_filename != existing_item['foto']:
+                release_photo(app.config['UPLOAD_FOLDER'], existing_item['foto'])
+
+            logger.info(f"Item {id} atualizado com sucesso")
+            return jsonify({'message': 'Item atualizado com sucesso!'})
+        except sqlite3.Error as e:
+            logger.error(f"Erro no banco de dados ao atualizar item {id}: {str(e)}")
+            return jsonify({'message': f'Erro no banco de dados: {str(e)}'}), 500
+        except ValueError as e:
+            logger.error(f"Erro de validação ao atualizar item {id}: {str(e)}")
+            return jsonify({'message': f'Erro de validação: {str(e)}'}), 400
+        except Exception as e:
+            logger.error(f"Erro inesperado ao atualizar item {id}: {str(e)}")
+            return jsonify({'message': f'Erro inesperado: {str(e)}'}), 500
+        finally:
+            # Foto nova gravada por esta requisição e que não chegou ao banco
+            for name, mtime in novas_fotos:
+                discard_new_photo(app.config['UPLOAD_FOLDER'], name, mtime)
 
 @app.route('/api/itens_cadastro/<int:id>', methods=['DELETE'])
 def delete_item(id):
-    with db_lock:
-        with app.app_context():  # Ensure application context
-            conn = None
-            try:
-                conn = get_db_connection()
+    with app.app_context():  # Ensure application context
+        try:
+            def _excluir(conn):
                 cursor = conn.cursor()
-                
+
                 cursor.execute('SELECT * FROM itens_cadastro WHERE id = ?', (id,))
                 item = cursor.fetchone()
                 if not item:
-                    conn.close()
-                    logger.error(f"Item com id={id} não encontrado")
-                    return jsonify({"error": "Item não encontrado"}), 404
-                
+                    return False
+
                 cursor.execute('''
                     INSERT INTO itens_cadastro_deleted (
                         id, tipo_item, codigo_fabricacao, codigo_interno, nome_descricao, foto,
@@ -1733,250 +3687,596 @@ def delete_item(id):
                     item['data_cadastro'],
                     datetime.now().strftime('%d/%m/%Y %H:%M')
                 ))
-                
+
                 cursor.execute('''
                     INSERT INTO composicao_ferramentas_deleted (ferramenta_id, insumo_id, quantidade, deleted_at)
                     SELECT ferramenta_id, insumo_id, quantidade, ?
                     FROM composicao_ferramentas WHERE ferramenta_id = ?
                 ''', (datetime.now().strftime('%d/%m/%Y %H:%M'), id))
-                
+
                 cursor.execute('DELETE FROM composicao_ferramentas WHERE ferramenta_id = ?', (id,))
                 cursor.execute('DELETE FROM itens_cadastro WHERE id = ?', (id,))
-                
-                conn.commit()
-                conn.close()
-                logger.info(f"Item {id} excluído com sucesso")
-                return jsonify({"message": "Item excluído com sucesso"})
+                bump_catalog_version(conn)
+                return True
+
+            if not db_writer.submit(_excluir):
+                logger.error(f"Item com id={id} não encontrado")
+                return jsonify({"error": "Item não encontrado"}), 404
+            publish_event('item.deleted', id)
+            logger.info(f"Item {id} excluído com sucesso")
+            return jsonify({"message": "Item excluído com sucesso"})
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao excluir item {id}: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
+# Listas grandes saem em streaming: o cursor é lido em lotes e cada lote vira um
+# pedaço da resposta chunked, então a memória não cresce com o histórico.
+STREAM_BATCH = 200  # linhas por lote (uma consulta, um pedaço enviado)
+
+def desc_keyset_batch(conn, select, where, column, id_column, after, size=STREAM_BATCH):
+    """Um lote de `select` em ordem (column DESC, id DESC) a partir do keyset `after`.
+
+    `after` = [valor, id] da última linha enviada; valor None quer dizer que o lote
+    anterior já estava nos registros sem data (NULL vem por último no DESC).
+    Retorna (dicts, after do próximo lote ou None se acabou); lê tudo com
+    fetchall, então nenhum cursor fica aberto entre lotes.
+    """
+    value_key, id_key = column.split('.')[-1], id_column.split('.')[-1]
+    clauses, params = ([where] if where else []), []
+    if after is not None:
+        if after[0] is None:
+            clauses.append(f'{column} IS NULL AND {id_column} < ?')
+            params.append(after[1])
+        else:
+            clauses.append(f'({column}, {id_column}) < (?, ?)')
+            params += after
+    sql = select + (' WHERE ' + ' AND '.join(clauses) if clauses else '')
+    rows = [dict(row) for row in conn.execute(
+        f'{sql} ORDER BY {column} DESC, {id_column} DESC LIMIT ?', params + [size]).fetchall()]
+    if after is not None and after[0] is not None and len(rows) < size:
+        # Acabaram os registros com data: continua pelos sem data
+        clauses = ([where] if where else []) + [f'{column} IS NULL']
+        rows += [dict(row) for row in conn.execute(
+            f"{select} WHERE {' AND '.join(clauses)} ORDER BY {id_column} DESC LIMIT ?", [size - len(rows)]).fetchall()]
+    if len(rows) < size:
+        return rows, None
+    return rows, [rows[-1][value_key], rows[-1][id_key]]
+
+def stream_format():
+    """'ndjson' com `?stream=ndjson` ou Accept: application/x-ndjson; senão 'json' (array)."""
+    fmt = (request.args.get('stream') or '').strip().lower()
+    if not fmt and 'application/x-ndjson' in (request.headers.get('Accept') or ''):
+        fmt = 'ndjson'
+    return 'ndjson' if fmt == 'ndjson' else 'json'
+
+def stream_json(fetch_batch, label, fmt='json', after=None):
+    """Resposta chunked montada lote a lote por `fetch_batch(conn, after)`.
+
+    `fetch_batch` devolve (dicts, after do próximo lote ou None no último). Cada
+    lote pega uma conexão do pool só pelo tempo da consulta e é codificado fora
+    dela: um cliente lento não segura conexão nem snapshot de leitura (que
+    impediria o checkpoint do WAL). fmt 'json': um array JSON (mesmo corpo de
+    antes para o cliente); 'ndjson': um objeto por linha.
+
+    Erro no meio do envio (o status 200 já foi): o corpo termina com
+    {"error": ...} e, no JSON, o array não é fechado; o cliente recebe um corpo
+    inválido em vez de uma lista truncada com cara de completa.
+    """
+    def generate():
+        nonlocal after
+        count = 0
+        buf = ['['] if fmt == 'json' else []
+        while True:
+            try:
+                with db_connection() as conn:
+                    items, after = fetch_batch(conn, after)
             except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro ao excluir item {id}: {str(e)}")
-                return jsonify({"error": str(e)}), 500
+                logger.error(f"Erro durante streaming de {label} após {count} registros: {str(e)}")
+                error = json.dumps({'error': str(e)}, ensure_ascii=False)
+                buf.append((',' + error if count else error) if fmt == 'json' else error + '\n')
+                yield ''.join(buf)
+                return
+            for item in items:
+                encoded = json.dumps(item, ensure_ascii=False)
+                if fmt == 'json':
+                    buf.append(',' + encoded if count else encoded)
+                else:
+                    buf.append(encoded + '\n')
+                count += 1
+            if after is None:
+                break
+            yield ''.join(buf)
+            buf = []
+        if fmt == 'json':
+            buf.append(']')
+        yield ''.join(buf)
+        logger.info(f"API {label} transmitiu {count} registros")
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    resp = Response(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers['X-Accel-Buffering'] = 'no'  # proxy não acumula a resposta inteira
+    return resp
 
 @app.route('/api/insumos', methods=['GET'])
 def api_insumos():
-    with app.app_context():  # Ensure application context
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            all_flag = (request.args.get('all') or '').lower() in ('1', 'true', 'yes')
-            if all_flag:
-                cursor.execute('''
-                    SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo, ic.codigo_interno AS codigo_interno_item
-                    FROM insumos i
-                    LEFT JOIN itens_cadastro ic ON i.item_id = ic.id
-                    ORDER BY i.data DESC
-                ''')
-            else:
-                cursor.execute('''
-                    SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo, ic.codigo_interno AS codigo_interno_item
-                    FROM insumos i
-                    LEFT JOIN itens_cadastro ic ON i.item_id = ic.id
-                    WHERE lower(ifnull(i.status,'')) <> 'atendido'
-                    ORDER BY i.data DESC
-                ''')
-            insumos = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            logger.info(f"API /api/insumos retornou {len(insumos)} insumos")
-            return jsonify(insumos)
-        except sqlite3.Error as e:
-            logger.error(f"Erro na API /api/insumos: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+    """Solicitações de insumo (pendentes; `all=1` inclui atendidas), em streaming."""
+    all_flag = (request.args.get('all') or '').lower() in ('1', 'true', 'yes')
+    where = '' if all_flag else "lower(ifnull(i.status,'')) <> 'atendido'"
+
+    select = '''
+        SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo, ic.codigo_interno AS codigo_interno_item
+        FROM insumos i
+        LEFT JOIN itens_cadastro ic ON i.item_id = ic.id
+    '''
+
+    def fetch_batch(conn, after):
+        return desc_keyset_batch(conn, select, where, 'i.data_iso', 'i.id', after)
+
+    return stream_json(fetch_batch, '/api/insumos', stream_format())
 
 @app.route('/api/insumos_cadastro', methods=['GET'])
 def api_insumos_cadastro():
     with app.app_context():  # Ensure application context
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, nome_descricao, codigo_interno FROM itens_cadastro WHERE tipo_item = 'insumo' ORDER BY nome_descricao")
-            insumos = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            logger.info(f"API /api/insumos_cadastro retornou {len(insumos)} insumos")
-            return jsonify(insumos)
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, nome_descricao, codigo_interno FROM itens_cadastro WHERE tipo_item = 'insumo' ORDER BY nome_descricao")
+                insumos = [dict(row) for row in cursor.fetchall()]
+                logger.info(f"API /api/insumos_cadastro retornou {len(insumos)} insumos")
+                return jsonify(insumos)
         except sqlite3.Error as e:
             logger.error(f"Erro na API /api/insumos_cadastro: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
 @app.route('/api/ocorrencias', methods=['GET'])
 def api_ocorrencias():
-    with app.app_context():  # Ensure application context
+    """Todas as ocorrências, mais recentes primeiro, em streaming."""
+    def fetch_batch(conn, after):
+        return desc_keyset_batch(conn, 'SELECT * FROM ocorrencias', '', 'data_iso', 'id', after)
+
+    return stream_json(fetch_batch, '/api/ocorrencias', stream_format())
+
+# Feed de alterações: o painel de gestão busca só o que mudou desde a última versão
+CHANGES_MAX = 1000  # acima disso o cliente recarrega tudo (reset)
+CHANGE_LOG_RETENTION_DAYS = int(os.environ.get("CHANGE_LOG_RETENTION_DAYS", "30"))  # exclusões mais velhas são podadas
+_change_log_pruned_at = 0.0
+
+def change_log_version(conn):
+    """Versão atual do log (maior versão já emitida; 0 se nada mudou ainda)."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+def prune_change_log():
+    """Remove exclusões antigas do log (no máximo uma vez por hora).
+
+    Guarda em app_meta a maior versão podada: cliente com `since` anterior a ela
+    pode ter perdido exclusões e recebe reset.
+    """
+    global _change_log_pruned_at
+    if time.time() - _change_log_pruned_at < 3600:
+        return
+    _change_log_pruned_at = time.time()
+
+    def _podar(conn):
+        row = conn.execute('''
+            SELECT MAX(version) FROM change_log
+            WHERE op = 'delete' AND changed_at < strftime('%Y-%m-%dT%H:%M:%S', 'now', ?)
+        ''', (f'-{CHANGE_LOG_RETENTION_DAYS} days',)).fetchone()
+        if row[0] is None:
+            return 0
+        conn.execute("UPDATE app_meta SET value = MAX(value, ?) WHERE key = 'change_log_min_version'", (row[0],))
+        return conn.execute("DELETE FROM change_log WHERE op = 'delete' AND version <= ?", (row[0],)).rowcount
+
+    removed = db_writer.submit(_podar)
+    if removed:
+        logger.info(f"Log de alterações: {removed} exclusões antigas podadas")
+
+@app.route('/api/changes', methods=['GET'])
+def api_changes():
+    """Insumos e ocorrências inseridos/alterados/excluídos depois da versão `since`.
+
+    Sem `since` retorna só a versão atual: o cliente pega a versão, carrega as
+    listas completas e depois pede `since=<versão>` (repetir uma alteração já vista
+    é inofensivo). `reset: true` indica que o cliente deve recarregar tudo (versão
+    podada, banco recriado ou alterações demais).
+    """
+    since = request.args.get('since')
+    try:
+        since = int(since) if since not in (None, '') else None
+        if since is not None and since < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'since deve ser um inteiro >= 0'}), 400
+    prune_change_log()
+
+    with app.app_context():
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM ocorrencias ORDER BY data DESC')
-            ocorrencias = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            logger.info(f"API /api/ocorrencias retornou {len(ocorrencias)} ocorrências")
-            return jsonify(ocorrencias)
+            with db_connection() as conn:
+                conn.execute('BEGIN')  # mesmo snapshot para o log e os registros
+                try:
+                    version = change_log_version(conn)
+                    if since is None:
+                        return jsonify({'version': version})
+                    min_version = conn.execute("SELECT value FROM app_meta WHERE key = 'change_log_min_version'").fetchone()[0]
+                    rows = conn.execute('''
+                        SELECT tabela, row_id, op FROM change_log
+                        WHERE version > ? ORDER BY version LIMIT ?
+                    ''', (since, CHANGES_MAX + 1)).fetchall()
+                    if since < min_version or since > version or len(rows) > CHANGES_MAX:
+                        return jsonify({'version': version, 'reset': True})
+                    changes = {table: {'upserts': [], 'deletes': []} for table in CHANGE_LOG_TABLES}
+                    upsert_ids = {table: [] for table in CHANGE_LOG_TABLES}
+                    for row in rows:
+                        if row['op'] == 'delete':
+                            changes[row['tabela']]['deletes'].append(row['row_id'])
+                        else:
+                            upsert_ids[row['tabela']].append(row['row_id'])
+                    if upsert_ids['insumos']:
+                        marks = ','.join('?' * len(upsert_ids['insumos']))
+                        changes['insumos']['upserts'] = [dict(r) for r in conn.execute(f'''
+                            SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo, ic.codigo_interno AS codigo_interno_item
+                            FROM insumos i
+                            LEFT JOIN itens_cadastro ic ON i.item_id = ic.id
+                            WHERE i.id IN ({marks})
+                        ''', upsert_ids['insumos'])]
+                    if upsert_ids['ocorrencias']:
+                        marks = ','.join('?' * len(upsert_ids['ocorrencias']))
+                        changes['ocorrencias']['upserts'] = [dict(r) for r in conn.execute(
+                            f'SELECT * FROM ocorrencias WHERE id IN ({marks})', upsert_ids['ocorrencias'])]
+                finally:
+                    conn.rollback()
+            logger.info(f"API /api/changes: {len(rows)} alterações desde {since} (versão {version})")
+            return jsonify({'version': version, 'reset': False, **changes})
         except sqlite3.Error as e:
-            logger.error(f"Erro na API /api/ocorrencias: {str(e)}")
+            logger.error(f"Erro na API /api/changes: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+def _atendido_from_insumo(r):
+    # Parse fotos JSON for each insumo (API /api/atendidos)
+    fotos_list = []
+    try:
+        if r.get('fotos'):
+            fotos_list = json.loads(r.get('fotos'))
+            if not isinstance(fotos_list, list):
+                fotos_list = []
+    except Exception:
+        fotos_list = []
+    return {
+        'id': r.get('id'),
+        'source': 'insumo',
+        'titulo': r.get('operador') or r.get('nome') or 'Insumo',
+        'nome_item': (
+            f"{r.get('nome_item')} (" + (r.get('codigo_interno') or r.get('codigo_interno_item') or 'Sem código') + ")"
+            if r.get('nome_item') else (r.get('codigo_interno') or r.get('codigo_interno_item'))
+        ),
+        'descricao': r.get('justificativa') or '',
+        'tipo': (r.get('tipo') or 'insumo'),
+        'prioridade': r.get('urgencia') or 'baixa',
+        'status_original': r.get('status') or 'Atendido',
+        'data_atendimento': r.get('data_atendimento') or r.get('data'),
+        'data_atendimento_iso': r.get('data_atendimento_iso') or r.get('data_iso'),
+        'data_original': r.get('data'),
+        'maquina': r.get('maquina') or '',
+        'atendida_por': r.get('atendida_por') or '',
+        'observacoes_atendimento': '',
+        'codigo_interno': r.get('codigo_interno') or r.get('codigo_interno_item'),
+        'fotos': fotos_list,
+        'fotos_urls': [f"/fotos_insumos/{name}" for name in fotos_list]
+    }
+
+def _atendido_from_ocorrencia(r):
+    return {
+        'id': r.get('id'),
+        'source': 'ocorrencia',
+        'titulo': r.get('titulo') or 'Ocorrência',
+        'descricao': r.get('descricao') or '',
+        'tipo': r.get('tipo') or 'ocorrencia',
+        'prioridade': r.get('prioridade') or 'baixa',
+        'status_original': r.get('status') or 'Fechada',
+        'data_atendimento': r.get('data'),
+        'data_atendimento_iso': r.get('data_iso'),
+        'data_original': r.get('data'),
+        'atendida_por': '',
+        'observacoes_atendimento': '',
+    }
+
+ATENDIDOS_BUILDERS = {'insumo': _atendido_from_insumo, 'ocorrencia': _atendido_from_ocorrencia}
+
+# Cada fonte do histórico: filtro de "atendido" e expressão de data (as mesmas dos índices parciais)
+ATENDIDOS_SOURCES = {
+    'insumo': {
+        'table': 'insumos',
+        'where': "lower(ifnull(status,'')) = 'atendido'",
+        'ordem': 'COALESCE(data_atendimento_iso, data_iso)',
+    },
+    'ocorrencia': {
+        'table': 'ocorrencias',
+        'where': "lower(ifnull(status,'')) IN ('fechada','atendida')",
+        'ordem': 'data_iso',
+    },
+}
+ATENDIDOS_MAX_LIMIT = 500
+
+def _atendidos_keyset(source, ordem, after):
+    """Condição "depois do cursor" na ordem (data DESC, id DESC, fonte DESC).
+
+    A data é comparada por faixa explícita (<=, <) para o índice de expressão
+    ser usado como range; registros sem data vêm por último (after[0] == '').
+    """
+    value, last_id, last_source = after
+    # Mesma data e mesmo id: a fonte desempata ('ocorrencia' > 'insumo' vem antes)
+    op = '<=' if source < last_source else '<'
+    if value == '':
+        if last_id is None:
+            return f'{ordem} IS NULL', []
+        return f'{ordem} IS NULL AND id {op} ?', [last_id]
+    return f'{ordem} <= ? AND ({ordem} < ? OR id {op} ?)', [value, value, last_id]
+
+def query_atendidos(conn, filtros, after=None, limit=None):
+    """Retorna [(fonte, id, data ISO ou '')] do histórico, já intercalado e ordenado pelo SQL.
+
+    `filtros`: desde/ate (ISO, ate exclusivo), prioridade, atendida_por, titulo.
+    Cada fonte é um ramo de UNION ALL percorrendo o próprio índice parcial; o
+    SQLite faz o merge dos dois ramos e para no LIMIT.
+    """
+    arms, params = [], []
+    for source, spec in ATENDIDOS_SOURCES.items():
+        ordem = spec['ordem']
+        where = [spec['where']]
+        arm_params = []
+        if filtros.get('desde'):
+            where.append(f'{ordem} >= ?')
+            arm_params.append(filtros['desde'])
+        if filtros.get('ate'):
+            where.append(f'{ordem} < ?')
+            arm_params.append(filtros['ate'])
+        if filtros.get('prioridade'):
+            column = 'urgencia' if source == 'insumo' else 'prioridade'
+            # Vazio conta como 'baixa', como na exibição
+            where.append(f"lower(coalesce(nullif({column}, ''), 'baixa')) = ?")
+            arm_params.append(filtros['prioridade'])
+        if filtros.get('atendida_por'):
+            if source != 'insumo':
+                continue  # ocorrências não registram quem atendeu
+            where.append("lower(ifnull(atendida_por, '')) LIKE ? ESCAPE '\\'")
+            arm_params.append(like_contains(filtros['atendida_por']))
+        if filtros.get('titulo'):
+            like = like_contains(filtros['titulo'])
+            if source == 'insumo':
+                where.append('''(lower(ifnull(operador, '')) LIKE ? ESCAPE '\\' OR lower(nome) LIKE ? ESCAPE '\\'
+                    OR lower(ifnull(codigo_interno, '')) LIKE ? ESCAPE '\\'
+                    OR item_id IN (SELECT id FROM itens_cadastro
+                                   WHERE lower(nome_descricao) LIKE ? ESCAPE '\\' OR lower(codigo_interno) LIKE ? ESCAPE '\\'))''')
+                arm_params += [like] * 5
+            else:
+                where.append("lower(ifnull(titulo, '')) LIKE ? ESCAPE '\\'")
+                arm_params.append(like)
+        if after is not None:
+            clause, clause_params = _atendidos_keyset(source, ordem, after)
+            where.append(clause)
+            arm_params += clause_params
+        arms.append(f"SELECT '{source}' AS source, id, {ordem} AS ordem FROM {spec['table']} WHERE " + ' AND '.join(where))
+        params += arm_params
+
+    sql = ' UNION ALL '.join(arms) + ' ORDER BY ordem DESC, id DESC, source DESC'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return [(row['source'], row['id'], row['ordem'] or '') for row in conn.execute(sql, params).fetchall()]
+
+def fetch_atendidos_keys(conn, filtros, after, fetch):
+    """query_atendidos que, acabados os registros com data, continua pelos sem data."""
+    keys = query_atendidos(conn, filtros, after, fetch)
+    if after is not None and after[0] != '' and (fetch is None or len(keys) < fetch):
+        keys += query_atendidos(conn, filtros, ['', None, ''], None if fetch is None else fetch - len(keys))
+    return keys
+
+def atendidos_batch(conn, filtros, after, size=STREAM_BATCH, builders=None):
+    """Um lote do histórico pelo mesmo keyset da paginação: (dicts, after do próximo ou None)."""
+    keys = fetch_atendidos_keys(conn, filtros, after, size)
+    itens = load_atendidos(conn, keys, builders)
+    if len(keys) < size:
+        return itens, None
+    source, id, ordem = keys[-1]
+    return itens, [ordem, id, source]
+
+def load_atendidos(conn, keys, builders=None):
+    """Monta os dicts do histórico para as chaves (fonte, id) na ordem recebida.
+
+    `builders` troca o formato por fonte (o relatório usa RELATORIO_BUILDERS).
+    """
+    builders = builders or ATENDIDOS_BUILDERS
+    ids = {'insumo': [], 'ocorrencia': []}
+    for source, id, _ in keys:
+        ids[source].append(id)
+    rows = {}
+    if ids['insumo']:
+        marks = ','.join('?' * len(ids['insumo']))
+        for row in conn.execute(f'''
+            SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo, ic.codigo_interno AS codigo_interno_item
+            FROM insumos i
+            LEFT JOIN itens_cadastro ic ON i.item_id = ic.id
+            WHERE i.id IN ({marks})
+        ''', ids['insumo']):
+            rows[('insumo', row['id'])] = builders['insumo'](dict(row))
+    if ids['ocorrencia']:
+        marks = ','.join('?' * len(ids['ocorrencia']))
+        for row in conn.execute(f'SELECT * FROM ocorrencias WHERE id IN ({marks})', ids['ocorrencia']):
+            rows[('ocorrencia', row['id'])] = builders['ocorrencia'](dict(row))
+    return [rows[(source, id)] for source, id, _ in keys if (source, id) in rows]
+
+def parse_atendidos_filtros(args):
+    """Lê os filtros do histórico da query string; ValueError com mensagem para o cliente."""
+    filtros = {
+        'prioridade': (args.get('prioridade') or '').strip().lower(),
+        'atendida_por': (args.get('atendida_por') or '').strip().lower(),
+        'titulo': (args.get('titulo') or '').strip().lower(),
+    }
+    try:
+        desde = (args.get('desde') or '').strip()
+        if desde:
+            filtros['desde'] = datetime.strptime(desde, '%Y-%m-%d').strftime('%Y-%m-%d')
+        ate = (args.get('ate') or '').strip()
+        if ate:
+            # Inclusivo para o usuário: vira limite exclusivo no dia seguinte
+            filtros['ate'] = (datetime.strptime(ate, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError('Datas devem estar no formato AAAA-MM-DD')
+    return filtros
+
 @app.route('/api/atendidos', methods=['GET'])
 def api_atendidos():
     """Retorna itens marcados como atendidos/resolvidos para a página de histórico.
 
     - Insumos com status 'Atendido' (usa data_atendimento)
     - Ocorrências com status 'Fechada' ou 'Atendida' (se existirem)
+
+    Filtros: desde/ate (AAAA-MM-DD), prioridade, atendida_por, titulo. Com `limit`
+    a resposta é uma página; o cursor da próxima vem no header X-Next-Cursor.
+    Sem `limit` (ou com `stream=ndjson`) o histórico sai em streaming.
     """
+    try:
+        filtros = parse_atendidos_filtros(request.args)
+        limit = request.args.get('limit')
+        limit = max(1, min(int(limit), ATENDIDOS_MAX_LIMIT)) if limit else None
+        after = None
+        cursor = (request.args.get('cursor') or '').strip()
+        if cursor:
+            after = decode_cursor(cursor, 3)
+            if after[2] not in ATENDIDOS_SOURCES or not isinstance(after[1], int) or not isinstance(after[0], str):
+                raise ValueError('cursor inválido')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    fmt = stream_format()
+    if limit is None or fmt == 'ndjson':
+        remaining = limit
+
+        def fetch_batch(conn, after):
+            nonlocal remaining
+            size = STREAM_BATCH if remaining is None else min(STREAM_BATCH, remaining)
+            itens, after = atendidos_batch(conn, filtros, after, size)
+            if remaining is not None:
+                remaining -= len(itens)
+                if remaining <= 0:
+                    after = None
+            return itens, after
+
+        return stream_json(fetch_batch, '/api/atendidos', fmt, after)
+
     with app.app_context():
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            # Insumos atendidos
-            cursor.execute('''
-                SELECT i.*, ic.nome_descricao AS nome_item, ic.tipo_item AS tipo, ic.codigo_interno AS codigo_interno_item
-                FROM insumos i
-                LEFT JOIN itens_cadastro ic ON i.item_id = ic.id
-                WHERE lower(ifnull(i.status,'')) = 'atendido'
-                ORDER BY COALESCE(i.data_atendimento, i.data) DESC, i.id DESC
-            ''')
-            insumos_rows = cursor.fetchall()
-
-            atendidos = []
-            for row in insumos_rows:
-                r = dict(row)
-                # Parse fotos JSON for each insumo (API /api/atendidos)
-                fotos_list = []
-                try:
-                    if r.get('fotos'):
-                        fotos_list = json.loads(r.get('fotos'))
-                        if not isinstance(fotos_list, list):
-                            fotos_list = []
-                except Exception:
-                    fotos_list = []
-                atendidos.append({
-                    'id': r.get('id'),
-                    'source': 'insumo',
-                    'titulo': r.get('operador') or r.get('nome') or 'Insumo',
-                    'nome_item': (
-                        f"{r.get('nome_item')} (" + (r.get('codigo_interno') or r.get('codigo_interno_item') or 'Sem código') + ")"
-                        if r.get('nome_item') else (r.get('codigo_interno') or r.get('codigo_interno_item'))
-                    ),
-                    'descricao': r.get('justificativa') or '',
-                    'tipo': (r.get('tipo') or 'insumo'),
-                    'prioridade': r.get('urgencia') or 'baixa',
-                    'status_original': r.get('status') or 'Atendido',
-                    'data_atendimento': r.get('data_atendimento') or r.get('data'),
-                    'data_original': r.get('data'),
-                    'maquina': r.get('maquina') or '',
-                    'atendida_por': r.get('atendida_por') or '',
-                    'observacoes_atendimento': '',
-                    'codigo_interno': r.get('codigo_interno') or r.get('codigo_interno_item'),
-                    'fotos': fotos_list,
-                    'fotos_urls': [f"/fotos_insumos/{name}" for name in fotos_list]
-                })
-
-            # Ocorrências resolvidas (opcional, se houver)
-            cursor.execute('''
-                SELECT * FROM ocorrencias
-                WHERE lower(ifnull(status,'')) IN ('fechada','atendida')
-                ORDER BY data DESC, id DESC
-            ''')
-            ocorr_rows = cursor.fetchall()
-            for row in ocorr_rows:
-                r = dict(row)
-                atendidos.append({
-                    'id': r.get('id'),
-                    'source': 'ocorrencia',
-                    'titulo': r.get('titulo') or 'Ocorrência',
-                    'descricao': r.get('descricao') or '',
-                    'tipo': r.get('tipo') or 'ocorrencia',
-                    'prioridade': r.get('prioridade') or 'baixa',
-                    'status_original': r.get('status') or 'Fechada',
-                    'data_atendimento': r.get('data'),
-                    'data_original': r.get('data'),
-                    'atendida_por': '',
-                    'observacoes_atendimento': '',
-                })
-
-            conn.close()
-
-            # Ordena por data de atendimento, decrescente
-            def parse_dt(dt):
-                try:
-                    if not dt or dt == 'Data não informada':
-                        return datetime.min
-                    d, t = dt.split(' ')
-                    dd, mm, yy = d.split('/')
-                    return datetime(int(yy), int(mm), int(dd))
-                except Exception:
-                    return datetime.min
-
-            atendidos.sort(
-                key=lambda x: (parse_dt(x.get('data_atendimento') or ''), x.get('id') or 0),
-                reverse=True
-            )
+            with db_connection() as conn:
+                fetch = limit + 1
+                keys = fetch_atendidos_keys(conn, filtros, after, fetch)
+                next_cursor = None
+                if len(keys) > limit:
+                    keys = keys[:limit]
+                    source, id, ordem = keys[-1]
+                    next_cursor = encode_cursor([ordem, id, source])
+                atendidos = load_atendidos(conn, keys)
 
             logger.info(f"API /api/atendidos retornou {len(atendidos)} registros")
-            return jsonify(atendidos)
+            resp = jsonify(atendidos)
+            if next_cursor:
+                resp.headers['X-Next-Cursor'] = next_cursor
+            return resp
         except sqlite3.Error as e:
             logger.error(f"Erro na API /api/atendidos: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+@app.route('/api/atendidos/resumo', methods=['GET'])
+def api_atendidos_resumo():
+    """Contadores dos cards do histórico (total, hoje, últimos 7 e 30 dias), sem carregar a lista."""
+    agora = datetime.now()
+    hoje = agora.strftime('%Y-%m-%d')
+    amanha = (agora + timedelta(days=1)).strftime('%Y-%m-%d')
+    semana = (agora - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M')
+    mes = (agora - timedelta(days=30)).strftime('%Y-%m-%dT%H:%M')
+    resumo = {'total': 0, 'hoje': 0, 'semana': 0, 'mes': 0}
+    with app.app_context():
+        try:
+            with db_connection() as conn:
+                for spec in ATENDIDOS_SOURCES.values():
+                    ordem = spec['ordem']
+                    row = conn.execute(f'''
+                        SELECT COUNT(*) AS total,
+                               COUNT(CASE WHEN {ordem} >= ? AND {ordem} < ? THEN 1 END) AS hoje,
+                               COUNT(CASE WHEN {ordem} >= ? THEN 1 END) AS semana,
+                               COUNT(CASE WHEN {ordem} >= ? THEN 1 END) AS mes
+                        FROM {spec['table']} WHERE {spec['where']}
+                    ''', (hoje, amanha, semana, mes)).fetchone()
+                    for key in resumo:
+                        resumo[key] += row[key]
+            return jsonify(resumo)
+        except sqlite3.Error as e:
+            logger.error(f"Erro na API /api/atendidos/resumo: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
 @app.route('/api/insumo/<int:id>', methods=['DELETE'])
 def delete_insumo(id):
-    with db_lock:
-        with app.app_context():  # Ensure application context
-            logger.info(f"Tentando excluir insumo com id={id}")
-            try:
-                conn = get_db_connection()
+    with app.app_context():  # Ensure application context
+        logger.info(f"Tentando excluir insumo com id={id}")
+        try:
+            fotos = []
+
+            def _excluir(conn):
                 cursor = conn.cursor()
-                cursor.execute('SELECT id, nome FROM insumos WHERE id = ?', (id,))
+                cursor.execute('SELECT id, nome, fotos FROM insumos WHERE id = ?', (id,))
                 insumo = cursor.fetchone()
                 if not insumo:
-                    conn.close()
                     logger.warning(f"Insumo com id={id} não encontrado")
                     return jsonify({'error': 'Insumo não encontrado'}), 404
                 
                 logger.info(f"Insumo encontrado: id={insumo['id']}, nome={insumo['nome']}")
                 cursor.execute('DELETE FROM insumos WHERE id = ?', (id,))
-                conn.commit()
-                conn.close()
+                try:
+                    fotos.extend(json.loads(insumo['fotos'] or '[]'))
+                except (ValueError, TypeError):
+                    pass
                 logger.info(f"Insumo id={id} excluído com sucesso")
                 return jsonify({'message': 'Insumo excluído com sucesso!'})
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro na API /api/insumo/{id} (DELETE): {str(e)}")
-    return jsonify({"error": str(e)}), 500
+
+            resp = db_writer.submit(_excluir)
+            if response_ok(resp):
+                publish_event('insumo.deleted', id)
+            # Fotos que ficaram sem nenhum registro saem do disco (as demais ficam para o GC)
+            for name in fotos:
+                if isinstance(name, str):
+                    release_photo(app.config['FOTOS_INSUMOS_FOLDER'], name)
+            return resp
+        except sqlite3.Error as e:
+            logger.error(f"Erro na API /api/insumo/{id} (DELETE): {str(e)}")
+            return jsonify({"error": str(e)}), 500
 
 
 @app.route('/api/maquinas/item/<int:item_id>', methods=['GET'])
 def api_maquinas_item(item_id):
     """Retorna as máquinas cadastradas para um item específico"""
     with app.app_context():
-        conn = None
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection() as conn:
+                cursor = conn.cursor()
 
-            cursor.execute(
-                """
-                SELECT maquina
-                FROM itens_maquinas
-                WHERE item_id = ? AND maquina IS NOT NULL AND TRIM(maquina) != ''
-                ORDER BY maquina
-                """,
-                (item_id,)
-            )
-            maquinas = [row['maquina'] for row in cursor.fetchall()]
+                cursor.execute(
+                    """
+                    SELECT maquina
+                    FROM itens_maquinas
+                    WHERE item_id = ? AND maquina IS NOT NULL AND TRIM(maquina) != ''
+                    ORDER BY maquina
+                    """,
+                    (item_id,)
+                )
+                maquinas = [row['maquina'] for row in cursor.fetchall()]
 
-            if not maquinas:
-                cursor.execute('SELECT maquina FROM itens_cadastro WHERE id = ?', (item_id,))
-                row = cursor.fetchone()
-                if row and row['maquina']:
-                    maquinas = [row['maquina']]
+                if not maquinas:
+                    cursor.execute('SELECT maquina FROM itens_cadastro WHERE id = ?', (item_id,))
+                    row = cursor.fetchone()
+                    if row and row['maquina']:
+                        maquinas = [row['maquina']]
 
-            conn.close()
-            return jsonify(maquinas)
+                return jsonify(maquinas)
         except sqlite3.Error as e:
-            if conn is not None:
-                conn.close()
             logger.error(f"Erro ao buscar máquinas do item {item_id}: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
@@ -1986,33 +4286,32 @@ def api_maquinas():
     """Retorna lista de todas as máquinas cadastradas no sistema"""
     with app.app_context():
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            # Busca máquinas únicas da tabela itens_maquinas
-            cursor.execute('''
-                SELECT DISTINCT maquina 
-                FROM itens_maquinas 
-                WHERE maquina IS NOT NULL AND maquina != ''
-                ORDER BY maquina
-            ''')
-            maquinas_cadastro = [row['maquina'] for row in cursor.fetchall()]
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                # Busca máquinas únicas da tabela itens_maquinas
+                cursor.execute('''
+                    SELECT DISTINCT maquina 
+                    FROM itens_maquinas 
+                    WHERE maquina IS NOT NULL AND maquina != ''
+                    ORDER BY maquina
+                ''')
+                maquinas_cadastro = [row['maquina'] for row in cursor.fetchall()]
             
-            # Busca máquinas dos insumos solicitados também
-            cursor.execute('''
-                SELECT DISTINCT maquina 
-                FROM insumos 
-                WHERE maquina IS NOT NULL AND maquina != ''
-                ORDER BY maquina
-            ''')
-            maquinas_insumos = [row['maquina'] for row in cursor.fetchall()]
+                # Busca máquinas dos insumos solicitados também
+                cursor.execute('''
+                    SELECT DISTINCT maquina 
+                    FROM insumos 
+                    WHERE maquina IS NOT NULL AND maquina != ''
+                    ORDER BY maquina
+                ''')
+                maquinas_insumos = [row['maquina'] for row in cursor.fetchall()]
             
-            # Combina e remove duplicatas mantendo ordem
-            todas_maquinas = list(set(maquinas_cadastro + maquinas_insumos))
-            todas_maquinas.sort()
+                # Combina e remove duplicatas mantendo ordem
+                todas_maquinas = list(set(maquinas_cadastro + maquinas_insumos))
+                todas_maquinas.sort()
             
-            conn.close()
-            logger.info(f"API /api/maquinas retornou {len(todas_maquinas)} máquinas")
-            return jsonify(todas_maquinas)
+                logger.info(f"API /api/maquinas retornou {len(todas_maquinas)} máquinas")
+                return jsonify(todas_maquinas)
         except sqlite3.Error as e:
             logger.error(f"Erro na API /api/maquinas: {str(e)}")
             return jsonify({"error": str(e)}), 500
@@ -2032,46 +4331,45 @@ def search_maquinas():
     
     with app.app_context():
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with db_connection() as conn:
+                cursor = conn.cursor()
             
-            if termo:
-                # Busca em itens_maquinas
-                cursor.execute('''
-                    SELECT DISTINCT maquina 
-                    FROM itens_maquinas 
-                    WHERE lower(maquina) LIKE ? AND maquina IS NOT NULL AND maquina != ''
-                    ORDER BY maquina
-                    LIMIT ?
-                ''', (f'%{termo}%', limit))
-                maquinas_cadastro = [row['maquina'] for row in cursor.fetchall()]
+                if termo:
+                    # Busca em itens_maquinas
+                    cursor.execute('''
+                        SELECT DISTINCT maquina 
+                        FROM itens_maquinas 
+                        WHERE lower(maquina) LIKE ? AND maquina IS NOT NULL AND maquina != ''
+                        ORDER BY maquina
+                        LIMIT ?
+                    ''', (f'%{termo}%', limit))
+                    maquinas_cadastro = [row['maquina'] for row in cursor.fetchall()]
                 
-                # Busca em insumos
-                cursor.execute('''
-                    SELECT DISTINCT maquina 
-                    FROM insumos 
-                    WHERE lower(maquina) LIKE ? AND maquina IS NOT NULL AND maquina != ''
-                    ORDER BY maquina
-                    LIMIT ?
-                ''', (f'%{termo}%', limit))
-                maquinas_insumos = [row['maquina'] for row in cursor.fetchall()]
+                    # Busca em insumos
+                    cursor.execute('''
+                        SELECT DISTINCT maquina 
+                        FROM insumos 
+                        WHERE lower(maquina) LIKE ? AND maquina IS NOT NULL AND maquina != ''
+                        ORDER BY maquina
+                        LIMIT ?
+                    ''', (f'%{termo}%', limit))
+                    maquinas_insumos = [row['maquina'] for row in cursor.fetchall()]
                 
-                # Combina resultados
-                maquinas = list(set(maquinas_cadastro + maquinas_insumos))
-                maquinas.sort()
-                maquinas = maquinas[:limit]  # Aplica limite final
-            else:
-                cursor.execute('''
-                    SELECT DISTINCT maquina 
-                    FROM itens_maquinas 
-                    WHERE maquina IS NOT NULL AND maquina != ''
-                    ORDER BY maquina
-                    LIMIT ?
-                ''', (limit,))
-                maquinas = [row['maquina'] for row in cursor.fetchall()]
+                    # Combina resultados
+                    maquinas = list(set(maquinas_cadastro + maquinas_insumos))
+                    maquinas.sort()
+                    maquinas = maquinas[:limit]  # Aplica limite final
+                else:
+                    cursor.execute('''
+                        SELECT DISTINCT maquina 
+                        FROM itens_maquinas 
+                        WHERE maquina IS NOT NULL AND maquina != ''
+                        ORDER BY maquina
+                        LIMIT ?
+                    ''', (limit,))
+                    maquinas = [row['maquina'] for row in cursor.fetchall()]
                 
-            conn.close()
-            return jsonify(maquinas)
+                return jsonify(maquinas)
         except sqlite3.Error as e:
             logger.error(f"Erro na busca de máquinas: {str(e)}")
             return jsonify({"error": str(e)}), 500
@@ -2081,35 +4379,16 @@ def get_itens_por_maquina(maquina_nome):
     """Retorna todos os itens compatíveis com uma máquina específica"""
     with app.app_context():
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT ic.*, im.maquina
-                FROM itens_cadastro ic
-                JOIN itens_maquinas im ON ic.id = im.item_id
-                WHERE im.maquina = ?
-                ORDER BY ic.nome_descricao
-            ''', (maquina_nome,))
-            itens = [dict(row) for row in cursor.fetchall()]
-            
-            # Adiciona informações de composição para ferramentas
+            with db_connection() as conn:
+                itens = load_catalog(
+                    conn,
+                    'WHERE ic.id IN (SELECT item_id FROM itens_maquinas WHERE maquina = ?)',
+                    (maquina_nome,)
+                )
             for item in itens:
-                if item['tipo_item'] == 'ferramenta':
-                    cursor.execute('''
-                        SELECT i.id, i.nome_descricao AS nome, cf.quantidade
-                        FROM composicao_ferramentas cf
-                        JOIN itens_cadastro i ON cf.insumo_id = i.id
-                        WHERE cf.ferramenta_id = ?
-                    ''', (item['id'],))
-                    item['composicao'] = [dict(row) for row in cursor.fetchall()]
-                else:
-                    item['composicao'] = []
-                
-                # Adiciona todas as máquinas do item
-                cursor.execute('SELECT maquina FROM itens_maquinas WHERE item_id = ?', (item['id'],))
-                item['maquinas'] = [row['maquina'] for row in cursor.fetchall()]
-            
-            conn.close()
+                # Mantém o formato antigo: `maquina` é a máquina consultada
+                item['maquina'] = maquina_nome
+
             logger.info(f"Encontrados {len(itens)} itens para a máquina '{maquina_nome}'")
             return jsonify(itens)
         except sqlite3.Error as e:
@@ -2118,17 +4397,13 @@ def get_itens_por_maquina(maquina_nome):
 # Reabrir (marcar como não atendida) um insumo já atendido
 @app.route('/api/insumo/<int:id>/reabrir', methods=['PUT'])
 def reabrir_insumo(id):
-    with db_lock:
-        with app.app_context():
-            conn = None
-            try:
-                conn = get_db_connection()
+    with app.app_context():
+        try:
+            def _reabrir(conn):
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM insumos WHERE id = ?', (id,))
                 insumo = cursor.fetchone()
                 if not insumo:
-                    if conn:
-                        conn.close()
                     return jsonify({'error': 'Insumo não encontrado'}), 404
 
                 # Reabre: volta status para Pendente e limpa data_atendimento
@@ -2138,29 +4413,25 @@ def reabrir_insumo(id):
                         data_atendimento = NULL
                     WHERE id = ?
                 ''', ('Pendente', id))
-                conn.commit()
-                conn.close()
                 return jsonify({'message': 'Insumo reaberto (marcado como não atendido)'}), 200
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
+
+            resp = db_writer.submit(_reabrir)
+            if response_ok(resp):
+                publish_event('insumo.updated', id, {'status': 'Pendente'})
+            return resp
+        except sqlite3.Error as e:
+            return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
 
 # Reabrir (marcar como não atendida) uma ocorrência fechada
 @app.route('/api/ocorrencia/<int:id>/reabrir', methods=['PUT'])
 def reabrir_ocorrencia(id):
-    with db_lock:
-        with app.app_context():
-            conn = None
-            try:
-                conn = get_db_connection()
+    with app.app_context():
+        try:
+            def _reabrir(conn):
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM ocorrencias WHERE id = ?', (id,))
                 ocorr = cursor.fetchone()
                 if not ocorr:
-                    if conn:
-                        conn.close()
                     return jsonify({'error': 'Ocorrência não encontrada'}), 404
 
                 cursor.execute('''
@@ -2168,62 +4439,60 @@ def reabrir_ocorrencia(id):
                         status = 'Aberta'
                     WHERE id = ?
                 ''', (id,))
-                conn.commit()
-                conn.close()
                 return jsonify({'message': 'Ocorrência reaberta (marcada como não atendida)'}), 200
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
+
+            resp = db_writer.submit(_reabrir)
+            if response_ok(resp):
+                publish_event('ocorrencia.updated', id, {'status': 'Aberta'})
+            return resp
+        except sqlite3.Error as e:
+            return jsonify({'error': f'Erro no banco de dados: {str(e)}'}), 500
 
 @app.route('/api/ocorrencia/<int:id>', methods=['DELETE'])
 def delete_ocorrencia(id):
-    with db_lock:
-        with app.app_context():  # Ensure application context
-            logger.info(f"Tentando excluir ocorrência com id={id}")
-            try:
-                conn = get_db_connection()
+    with app.app_context():  # Ensure application context
+        logger.info(f"Tentando excluir ocorrência com id={id}")
+        try:
+            def _excluir(conn):
                 cursor = conn.cursor()
                 cursor.execute('SELECT id, titulo FROM ocorrencias WHERE id = ?', (id,))
                 ocorrencia = cursor.fetchone()
                 if not ocorrencia:
-                    conn.close()
                     logger.warning(f"Ocorrência com id={id} não encontrada")
                     return jsonify({'error': 'Ocorrência não encontrada'}), 404
                 
                 logger.info(f"Ocorrência encontrada: id={ocorrencia['id']}, titulo={ocorrencia['titulo']}")
                 cursor.execute('DELETE FROM ocorrencias WHERE id = ?', (id,))
-                conn.commit()
-                conn.close()
                 logger.info(f"Ocorrência id={id} excluída com sucesso")
                 return jsonify({'message': 'Ocorrência excluída com sucesso!'})
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro na API /api/ocorrencia/{id} (DELETE): {str(e)}")
-                return jsonify({"error": str(e)}), 500
+
+            resp = db_writer.submit(_excluir)
+            if response_ok(resp):
+                publish_event('ocorrencia.deleted', id)
+            return resp
+        except sqlite3.Error as e:
+            logger.error(f"Erro na API /api/ocorrencia/{id} (DELETE): {str(e)}")
+            return jsonify({"error": str(e)}), 500
+
+def _serve_photo(folder, filename):
+    size = request.args.get('size')
+    if size and size not in PHOTO_SIZES:
+        return jsonify({"error": f"size inválido: use {', '.join(PHOTO_SIZES)}"}), 400
+    try:
+        return send_photo(folder, filename, size)
+    except NotFound:
+        return jsonify({"error": "Arquivo não encontrado"}), 404
+    except Exception as e:
+        logger.error(f"Erro ao servir foto {filename}: {str(e)}")
+        return jsonify({"error": "Arquivo não encontrado"}), 404
 
 @app.route('/fotos_cadastro/<filename>')
 def uploaded_file(filename):
-    with app.app_context():  # Ensure application context
-        try:
-            logger.info(f"Servindo arquivo {filename}")
-            return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-        except Exception as e:
-            logger.error(f"Erro ao servir arquivo {filename}: {str(e)}")
-            return jsonify({"error": "Arquivo não encontrado"}), 404
+    return _serve_photo(app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/fotos_insumos/<filename>')
 def uploaded_insumo_file(filename):
-    with app.app_context():
-        try:
-            logger.info(f"Servindo foto de insumo {filename}")
-            return send_from_directory(app.config['FOTOS_INSUMOS_FOLDER'], filename)
-        except Exception as e:
-            logger.error(f"Erro ao servir foto de insumo {filename}: {str(e)}")
-            return jsonify({"error": "Arquivo não encontrado"}), 404
+    return _serve_photo(app.config['FOTOS_INSUMOS_FOLDER'], filename)
 
 @app.route('/editor')
 def editor_page():
@@ -2241,18 +4510,15 @@ def ficha():
     
     with app.app_context():  # Ensure application context
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM itens_cadastro WHERE codigo_interno = ?', (codigo_interno,))
-            item = cursor.fetchone()
-            conn.close()
-            
-            if not item:
+            with db_connection() as conn:
+                row = conn.execute('SELECT doc FROM item_docs WHERE codigo_interno = ?', (codigo_interno,)).fetchone()
+
+            if not row:
                 logger.error(f"Item com codigo_interno={codigo_interno} não encontrado")
                 return render_template('error.html', code=404, message="Item não encontrado no banco de dados"), 404
-            
-            logger.info(f"Item encontrado para codigo_interno={codigo_interno}: {dict(item)}")
-            return render_template('ficha.html', item=dict(item))
+
+            # A ficha vai embutida na página: o navegador não busca o mesmo item de novo na API
+            return render_template('ficha.html', item_doc=json_for_script(row['doc']))
         except sqlite3.Error as e:
             logger.error(f"Erro ao buscar item com codigo_interno={codigo_interno}: {str(e)}")
             return render_template('error.html', code=500, message=f"Erro no banco de dados: {str(e)}"), 500    
@@ -2275,11 +4541,9 @@ def status_color_filter(status):
 
 @app.route('/test/populate/<int:id>', methods=['POST'])
 def test_populate_item(id):
-    with db_lock:
-        with app.app_context():  # Ensure application context
-            conn = None
-            try:
-                conn = get_db_connection()
+    with app.app_context():  # Ensure application context
+        try:
+            def _popular(conn):
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE itens_cadastro SET
@@ -2299,16 +4563,62 @@ def test_populate_item(id):
                     0.5,
                     id
                 ))
-                conn.commit()
-                conn.close()
+                if cursor.rowcount == 0:
+                    return jsonify({'error': 'Item não encontrado'}), 404
+                bump_catalog_version(conn)
                 logger.info(f"Item {id} populado com dados de teste")
                 return jsonify({'message': f'Item {id} populated with test data'})
-            except sqlite3.Error as e:
-                if conn is not None:
-                    conn.rollback()
-                    conn.close()
-                logger.error(f"Erro ao popular item {id}: {str(e)}")
-                return jsonify({'error': str(e)}), 500
+
+            resp = db_writer.submit(_popular)
+            if response_ok(resp):
+                publish_event('item.changed', id, {'op': 'updated'})
+            return resp
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao popular item {id}: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+@app.route('/api/db/pool', methods=['GET'])
+def api_db_pool():
+    """Contadores do pool de conexões (hits, esperas, tempo de checkout) e da fila de escrita"""
+    if not session.get('gestao_logged'):
+        return jsonify({'error': 'Não autorizado'}), 401
+    stats = db_pool.stats()
+    stats['writer'] = db_writer.stats()
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas deste processo no formato texto do Prometheus."""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Não autorizado'}), 401
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Métricas desativadas (METRICS=0)'}), 404
+    pool = db_pool.stats()
+    writer = db_writer.stats()
+    worker = str(WORKER_INDEX or 0)
+    gauges = [
+        ('db_pool_connections', 'Conexões do pool de leitura por estado.',
+         [({'state': 'in_use', 'worker': worker}, pool['in_use']), ({'state': 'idle', 'worker': worker}, pool['idle'])]),
+        ('db_pool_timeouts', 'Checkouts que esgotaram DB_POOL_TIMEOUT desde o início.',
+         [({'worker': worker}, pool['timeouts'])]),
+        ('db_writer_queued_jobs', 'Jobs aguardando o escritor.', [({'worker': worker}, writer['queued'])]),
+        ('db_writer_failed_jobs', 'Jobs de escrita que falharam desde o início.', [({'worker': worker}, writer['failed_jobs'])]),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/consultas-lentas', methods=['GET'])
+def admin_consultas_lentas():
+    """Consultas acima de SLOW_QUERY_MS com plano de execução (página e JSON)."""
+    if not session.get('gestao_logged'):
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'error': 'Não autorizado'}), 401
+        return redirect(url_for('login', next=request.path))
+    summary = slow_queries.summary() if slow_queries is not None else None
+    if request.args.get('formato') == 'json' or request.accept_mimetypes.best == 'application/json':
+        if summary is None:
+            return jsonify({'error': 'Log de consultas lentas desativado (defina SLOW_QUERY_MS)'}), 404
+        return jsonify(summary)
+    return render_template('consultas_lentas.html', summary=summary)
 
 # Error handler for Socket.IO bad requests
 @app.errorhandler(400)
@@ -2316,21 +4626,15 @@ def handle_bad_request(e):
     logger.error(f"Bad request error: {str(e)}")
     return jsonify({"error": str(e)}), 400
 
-# Ensure database schema exists when running under WSGI and recreate if file is missing
-_db_bootstrapped = False
-
+# Recreate the structure if the database file is removed at runtime
 @app.before_request
 def _ensure_db_ready():
-    global _db_bootstrapped
     try:
-        # Run init once per process (covers WSGI where __main__ block doesn't run)
-        if not _db_bootstrapped:
-            logger.info("Bootstrapping database structure (first request)...")
-            init_db()
-            _db_bootstrapped = True
-        # If file was deleted at runtime, recreate structure
-        elif not os.path.exists(DATABASE):
+        if not os.path.exists(DATABASE):
             logger.warning("Database file not found. Recreating structure...")
+            # Conexões ociosas ainda apontam para o arquivo removido
+            db_pool.clear()
+            db_writer.reset()
             init_db()
     except Exception as e:
         logger.error(f"Failed to ensure database readiness: {e}")
@@ -2356,14 +4660,148 @@ def guess_local_ip():
     except Exception:
         return None
     
+# Migrações rodam uma vez na importação (python menu.py ou servidor WSGI), antes do primeiro request
+init_db()
+
+class MessageBroker:
+    """Fila de mensagens local do modo multi-processo: um socket unix com fan-out.
+
+    Publicadores mandam quadros; cada quadro vai para a fila de cada assinante,
+    que tem seu próprio greenlet de envio (um processo lento não trava os outros).
+    Assinante com a fila cheia perde mensagens em vez de segurar a memória.
+    """
+
+    def __init__(self, path, max_pending=10000):
+        self.path = path
+        self.max_pending = max_pending
+        self._subscribers = set()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = eventlet.listen(self.path, family=socket.AF_UNIX)
+        os.chmod(self.path, 0o600)
+        eventlet.spawn_n(self._accept, listener)
+        logger.info(f"Fila de mensagens do Socket.IO em {self.path}")
+
+    def _accept(self, listener):
+        while True:
+            conn, _ = listener.accept()
+            eventlet.spawn_n(self._handle, conn)
+
+    def _handle(self, conn):
+        try:
+            role = conn.recv(1)
+            if role == b'S':
+                self._serve_subscriber(conn)
+            elif role == b'P':
+                reader = conn.makefile('rb')
+                while True:
+                    payload = read_frame(reader)
+                    if payload is None:
+                        break
+                    frame = struct.pack('!I', len(payload)) + payload
+                    for pending in list(self._subscribers):
+                        try:
+                            pending.put_nowait(frame)
+                        except eventlet.queue.Full:
+                            logger.warning("Assinante da fila de mensagens atrasado; mensagem descartada")
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _serve_subscriber(self, conn):
+        pending = eventlet.queue.LightQueue(self.max_pending)
+        self._subscribers.add(pending)
+        try:
+            while True:
+                conn.sendall(pending.get())
+        except OSError:
+            pass
+        finally:
+            self._subscribers.discard(pending)
+
+class WorkerSupervisor:
+    """Modo multi-processo: N cópias de `python menu.py` atrás de uma porta só.
+
+    O supervisor abre a porta pública e os workers herdam o socket de escuta
+    (WORKER_LISTEN_FD): cada um aceita direto dele e o kernel distribui as
+    conexões, sem bytes passando pelo supervisor. Nada depende de sessão fixa:
+    o Socket.IO é só websocket, e uploads em etapas e jobs de relatório guardam
+    o estado no DATA_DIR. Com fila local, também roda o MessageBroker. Worker
+    que morre é reiniciado.
+    """
+
+    def __init__(self, workers, host, port, queue_url):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.queue_url = queue_url
+        self._listener = None
+        self._procs = [None] * workers
+
+    def _spawn(self, index):
+        fd = self._listener.fileno()
+        env = dict(os.environ,
+                   WORKER_INDEX=str(index),
+                   WORKER_LISTEN_FD=str(fd),
+                   SOCKETIO_MESSAGE_QUEUE=self.queue_url)
+        self._procs[index] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env, pass_fds=(fd,))
+        logger.info(f"Worker {index} iniciado (pid {self._procs[index].pid})")
+
+    def _monitor(self):
+        while True:
+            eventlet.sleep(1)
+            for index, proc in enumerate(self._procs):
+                if proc.poll() is not None:
+                    logger.error(f"Worker {index} saiu com código {proc.returncode}; reiniciando")
+                    self._spawn(index)
+
+    def _shutdown(self, signum, frame):
+        for proc in self._procs:
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+        sys.exit(0)
+
+    def run(self):
+        import signal
+        if self.queue_url.startswith('unix://'):
+            os.makedirs(os.path.dirname(self.queue_url[len('unix://'):]), exist_ok=True)
+            MessageBroker(self.queue_url[len('unix://'):]).start()
+        # Aberta antes dos workers: conexões que chegam enquanto sobem ficam no backlog
+        self._listener = eventlet.listen((self.host, self.port))
+        for index in range(self.workers):
+            self._spawn(index)
+        signal.signal(signal.SIGTERM, self._shutdown)
+        signal.signal(signal.SIGINT, self._shutdown)
+        logger.info(f"Supervisor em {self.host}:{self.port} com {self.workers} workers")
+        self._monitor()
+
+def inherited_listener(fd):
+    """Socket de escuta herdado do supervisor, como socket verde do eventlet."""
+    return eventlet.greenio.GreenSocket(eventlet.patcher.original('socket').socket(fileno=fd))
+
 if __name__ == '__main__':
-    init_db()
     host = '0.0.0.0'
     port = int(os.environ.get("PORT", 8080))
 
-    print(f"Running on {host}:{port}")
-
-    socketio.run(app, host=host, port=port, debug=False, use_reloader=False)
+    if WORKERS > 1 and WORKER_INDEX is None:
+        # Migrações já rodaram na importação, antes de qualquer worker subir
+        queue_url = SOCKETIO_MESSAGE_QUEUE or f"unix://{os.path.join(app.config['RUN_FOLDER'], 'socketio.sock')}"
+        WorkerSupervisor(WORKERS, host, port, queue_url).run()
+    else:
+        print(f"Running on {host}:{port}")
+        # GC de fotos em um processo só
+        if not WORKER_INDEX:
+            photo_gc.start(PHOTO_GC_INTERVAL)
+
+        if WORKER_INDEX is not None:
+            # Worker do supervisor: aceita no socket de escuta compartilhado
+            import eventlet.wsgi
+            eventlet.wsgi.server(inherited_listener(int(os.environ["WORKER_LISTEN_FD"])), app, log_output=False)
+        else:
+            socketio.run(app, host=host, port=port, debug=False, use_reloader=False)
 
 
 
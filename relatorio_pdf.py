@@ -0,0 +1,446 @@
+"""Geração do PDF do relatório de ocorrências/atendidos.
+
+Roda fora do processo web: menu.py mantém alguns processos `python relatorio_pdf.py`
+vivos e conversa com eles por stdin/stdout, uma linha JSON por job. Assim o layout
+do ReportLab e o gráfico do matplotlib (CPU puro) não travam o hub do eventlet.
+Este módulo não importa nada do app.
+"""
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger('relatorio_pdf')
+
+REPORT_THUMB_PX = 200  # lado da miniatura em pixels (70 pt no PDF ≈ 200 dpi)
+
+
+def report_thumbnail(fotos_folder, name, thumbs_folder, px=REPORT_THUMB_PX):
+    """Caminho da miniatura quadrada de `name` para o relatório, gerando se preciso.
+
+    O cache fica em `thumbs_folder` com chave nome + mtime + tamanho, então trocar a
+    foto original invalida a miniatura sozinho. Retorna None se a foto não existe;
+    se o Pillow falhar, devolve o caminho da original.
+    """
+    path = os.path.join(fotos_folder, name)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    thumb_path = os.path.join(thumbs_folder, f"{name}.{mtime_ns}.{px}.jpg")
+    if os.path.exists(thumb_path):
+        return thumb_path
+    try:
+        from PIL import Image as PILImage, ImageOps
+        with PILImage.open(path) as im:
+            im.draft('RGB', (px * 2, px * 2))  # JPEG: decodifica já reduzido
+            im = ImageOps.exif_transpose(im).convert('RGB')
+            im = ImageOps.fit(im, (px, px), PILImage.LANCZOS)
+        os.makedirs(thumbs_folder, exist_ok=True)
+        tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+        im.save(tmp_path, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp_path, thumb_path)
+    except Exception as e:
+        logger.warning(f"Miniatura de {name} falhou: {str(e)}; usando original.")
+        return path
+    # Remove miniaturas de versões anteriores da mesma foto
+    prefix = f"{name}."
+    for old in os.listdir(thumbs_folder):
+        if old.startswith(prefix) and old != os.path.basename(thumb_path) and not old.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(thumbs_folder, old))
+            except OSError:
+                pass
+    return thumb_path
+
+
+def build_relatorio_pdf(filtered, q_titulo, q_prioridade, q_atendida, fotos_folder, thumbs_folder=None):
+    """Gera PDF com Platypus (layout moderno):
+    - Cabeçalho com barra e filtros, sem poluição
+    - Tabela com textos formatados e espaçamentos coerentes
+    - Fotos em linha abaixo de cada solicitação (miniaturas do cache se
+      `thumbs_folder` for informado, senão as originais)
+    - Página de gráfico sem cabeçalho de colunas
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import (BaseDocTemplate, PageTemplate, Frame,
+                                    Table, TableStyle, Paragraph, Spacer, Image,
+                                    PageBreak, NextPageTemplate)
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    import io, os
+
+    width, height = A4
+    buf = io.BytesIO()
+
+    # Document with two page templates: Table and Chart
+    doc = BaseDocTemplate(
+        buf, pagesize=A4,
+        leftMargin=36, rightMargin=36, topMargin=130, bottomMargin=36
+    )
+    frame = Frame(doc.leftMargin, doc.bottomMargin,
+                  doc.width, doc.height, id='normal')
+
+    info = f"Filtros: titulo: '{q_titulo or 'Todos'}' | Prioridade: '{q_prioridade or 'Todas'}' | Atendida por: '{q_atendida or 'Todos'}'"
+    occ_count = sum(1 for it in filtered if (it.get('source') or '').lower() == 'ocorrencia')
+
+    def header_common(c):
+        c.setFillColorRGB(0.16, 0.22, 0.31)
+        c.rect(0, height-60, width, 60, fill=1, stroke=0)
+        c.setFillColor(colors.white)
+        c.setFont('Helvetica-Bold', 16)
+        c.drawString(40, height - 40, 'Relatorio de Ocorrencias e Atendidos')
+        # Filtros resumidos
+        c.setFillColor(colors.black)
+        c.setFont('Helvetica', 10)
+        c.drawString(40, height - 75, info)
+        c.drawString(40, height - 90, f"Total atendidos: {len(filtered)}")
+
+    def header_table(c, _doc):
+        header_common(c)
+        # Cabeçalho das colunas com cantos levemente arredondados
+        y = height - 110
+        c.setFillColorRGB(0.91, 0.95, 0.99)
+        try:
+            c.roundRect(36, y-4, width-72, 20, 6, fill=1, stroke=0)
+        except Exception:
+            c.rect(36, y-4, width-72, 20, fill=1, stroke=0)
+        c.setFillColor(colors.black)
+        c.setFont('Helvetica-Bold', 9)
+        avail = _doc.width
+        col1, col3, col4, col5 = 60, 80, 80, 80
+        col2 = max(120, avail - (col1 + col3 + col4 + col5))
+        xs = [40, 40 + col1, 40 + col1 + col2, 40 + col1 + col2 + col3, 40 + col1 + col2 + col3 + col4]
+        headers = ['Tipo', 'Solicitante/Titulo', 'Prioridade', 'Data', 'Atendida por']
+        for i, h in enumerate(headers):
+            c.drawString(xs[i], y, h)
+
+    def header_chart(c, _doc):
+        # Apenas barra e filtros; sem cabeçalho de colunas
+        header_common(c)
+
+    doc.addPageTemplates([
+        PageTemplate(id='Table', frames=[frame], onPage=header_table),
+        PageTemplate(id='Chart', frames=[frame], onPage=header_chart),
+    ])
+
+    styles = getSampleStyleSheet()
+    small = ParagraphStyle('small', parent=styles['Normal'], fontName='Helvetica', fontSize=9, leading=12)
+    meta = ParagraphStyle('meta', parent=styles['Normal'], fontName='Helvetica', fontSize=9, leading=12, textColor=colors.gray)
+    meta_bold = ParagraphStyle('meta_bold', parent=meta, fontName='Helvetica-Bold')
+
+    story = []
+    # Tabela (linhas) – usa PageTemplate 'Table'
+    story.append(NextPageTemplate('Table'))
+
+    avail = doc.width
+    col1, col3, col4, col5 = 60, 80, 80, 80
+    col2 = max(120, avail - (col1 + col3 + col4 + col5))
+
+    for idx, it in enumerate(filtered):
+        fonte = (it.get('source') or '').title()
+        raw_title = it.get('titulo') or ''
+        primary = (raw_title.split(' - ')[0] or raw_title)
+        prioridade = (it.get('prioridade') or '').title()
+        data_str = it.get('data_atendimento') or it.get('data_original') or ''
+        atendida = it.get('atendida_por') or '-'
+
+        row = [[Paragraph(fonte, small), Paragraph(primary, small), Paragraph(prioridade, small), Paragraph(data_str, small), Paragraph(atendida, small)]]
+        t = Table(row, colWidths=[col1, col2, col3, col4, col5])
+        bg = colors.whitesmoke if (idx % 2 == 0) else colors.white
+        t.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), bg),
+            ('VALIGN', (0, 0), (-1, 0), 'TOP'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, 0), 9),
+            ('LEFTPADDING', (0, 0), (-1, 0), 6),
+            ('RIGHTPADDING', (0, 0), (-1, 0), 6),
+            ('TOPPADDING', (0, 0), (-1, 0), 6),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+            ('BOX', (0, 0), (-1, -1), 0.3, colors.HexColor('#e6e9ef')),
+            ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#eef1f6')),
+        ]))
+        story.append(t)
+
+        # Sub-informações (Maquina e Item)
+        sub_parts = []
+        if (it.get('maquina') or '').strip():
+            sub_parts.append(f"Maquina: {it.get('maquina')}")
+        if (it.get('codigo_interno') or '').strip():
+            sub_parts.append(f"Item: {it.get('codigo_interno')}")
+        if sub_parts:
+            story.append(Spacer(1, 2))
+            story.append(Paragraph(' | '.join(sub_parts), meta))
+
+        # Descricao / Justificativa
+        if (it.get('descricao') or '').strip():
+            story.append(Spacer(1, 2))
+            story.append(Paragraph(f"<b>Descricao:</b> {(it.get('descricao') or '')}", meta))
+
+        # Fotos em linha (apenas insumo)
+        fotos = it.get('fotos') or []
+        if ((it.get('source') or '').lower() == 'insumo') and fotos:
+            thumb = 70
+            gap = 6
+            per_row = max(1, int((avail + gap) // (thumb + gap)))
+            rows, row_imgs = [], []
+            for name in fotos:
+                try:
+                    if thumbs_folder:
+                        path = report_thumbnail(fotos_folder, name, thumbs_folder)
+                    else:
+                        path = os.path.join(fotos_folder, name)
+                    if not path or not os.path.exists(path):
+                        continue
+                    row_imgs.append(Image(path, width=thumb, height=thumb))
+                    if len(row_imgs) >= per_row:
+                        rows.append(row_imgs)
+                        row_imgs = []
+                except Exception:
+                    continue
+            if row_imgs:
+                rows.append(row_imgs)
+            if rows:
+                story.append(Spacer(1, 4))
+                pt = Table(rows, colWidths=[thumb] * max(1, max(len(r) for r in rows)), hAlign='LEFT')
+                pt.setStyle(TableStyle([
+                    ('LEFTPADDING', (0, 0), (-1, -1), 0),
+                    ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+                    ('TOPPADDING', (0, 0), (-1, -1), 0),
+                    ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+                ]))
+                story.append(pt)
+
+        story.append(Spacer(1, 10))
+
+    # Página de gráfico – muda o template para não desenhar os cabeçalhos de colunas
+    story.append(NextPageTemplate('Chart'))
+    story.append(PageBreak())
+    try:
+        from collections import Counter
+        import matplotlib.pyplot as plt
+        counts = Counter([(it.get('prioridade') or 'baixa').lower() for it in filtered])
+        if counts:
+            labels = list(counts.keys())
+            values = [counts[l] for l in labels]
+            fig, ax = plt.subplots(figsize=(6.2, 3.8), dpi=150)
+            bars = ax.bar(labels, values, color=['#27ae60', '#f1c40f', '#e67e22', '#e74c3c', '#8e44ad', '#3498db'])
+            ax.set_title('Itens por Prioridade')
+            ax.set_xlabel('Prioridade')
+            ax.set_ylabel('Quantidade')
+            for bar in bars:
+                h = bar.get_height()
+                ax.annotate(f'{int(h)}', xy=(bar.get_x()+bar.get_width()/2, h), xytext=(0, 5),
+                            textcoords='offset points', ha='center', va='bottom', fontsize=9)
+            fig.tight_layout()
+            import io as _io
+            img_buf = _io.BytesIO()
+            fig.savefig(img_buf, format='png', dpi=160)
+            plt.close(fig)
+            img_buf.seek(0)
+            story.append(Image(img_buf, width=doc.width, height=doc.width * 0.6))
+    except Exception:
+        pass
+
+    doc.build(story)
+    buf.seek(0)
+    return buf
+
+
+def build_relatorio_pdf_legado(filtered, q_titulo, q_prioridade, q_atendida):
+    """Layout antigo com canvas, usado quando o Platypus falha."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+    from reportlab.lib.utils import ImageReader
+    import io
+    width, height = A4
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+
+    # Header bar
+    c.setFillColorRGB(0.16, 0.22, 0.31)  # #2c3e50
+    c.rect(0, height-60, width, 60, fill=1, stroke=0)
+    c.setFillColor(colors.white)
+    c.setFont('Helvetica-Bold', 16)
+    c.drawString(40, height - 40, 'Relatório de Ocorrências / Atendidos')
+
+    # Sub header with filters
+    c.setFillColor(colors.black)
+    c.setFont('Helvetica', 10)
+    info = f"Filtros: tÃ­tulo='{q_titulo or 'Todos'}' â€¢ prioridade='{q_prioridade or 'Todas'}' â€¢ atendida_por='{q_atendida or 'Todos'}'"
+    c.drawString(40, height - 75, info)
+    if not (q_titulo or q_prioridade or q_atendida):
+        c.setFillColorRGB(0.10, 0.60, 0.40)
+        c.drawString(40, height - 90, 'Sem filtros aplicados â€” listando todos os registros.')
+        c.setFillColor(colors.black)
+
+    # Resumo
+    occ_count = sum(1 for it in filtered if (it.get('source') or '').lower() == 'ocorrencia')
+    c.setFont('Helvetica', 10)
+    c.drawString(40, height - 100, f"Total atendidos: {len(filtered)}  |  Ocorrências atendidas: {occ_count}")
+
+    # Table header
+    y = height - 110
+    col_x = [40, 100, 340, 420, 500]  # Fonte, TÃ­tulo, Prioridade, Data, Atendida
+    col_w = [60, 240, 80, 80, 80]
+    headers = ['Fonte', 'TÃ­tulo', 'Prioridade', 'Data', 'Atendida por']
+    c.setFillColorRGB(0.91, 0.95, 0.99)
+    c.rect(36, y-4, width-72, 20, fill=1, stroke=0)
+    c.setFillColor(colors.black)
+    c.setFont('Helvetica-Bold', 9)
+    for i, h in enumerate(headers):
+        c.drawString(col_x[i], y, h)
+    y -= 16
+
+    # Rows with zebra striping
+    c.setFont('Helvetica', 9)
+    row_bg = (0.98, 0.98, 0.98)
+    for idx, it in enumerate(filtered):
+        # Space calculation for row height (with optional secondary line)
+        has_secondary = ((it.get('source') or '').lower() == 'insumo') and (((it.get('maquina') or '').strip()) or (it.get('codigo_interno') or '').strip())
+        space_needed = 30 if has_secondary else 18
+        if y - space_needed < 80:
+            c.showPage()
+            # repeat header on new page
+            c.setFillColorRGB(0.16, 0.22, 0.31)
+            c.rect(0, height-60, width, 60, fill=1, stroke=0)
+            c.setFillColor(colors.white)
+            c.setFont('Helvetica-Bold', 16)
+            c.drawString(40, height - 40, 'Relatório de Ocorrências / Atendidos')
+            c.setFillColor(colors.black)
+            c.setFont('Helvetica', 10)
+            c.drawString(40, height - 75, info)
+            c.setFont('Helvetica', 10)
+            occ_count = sum(1 for it2 in filtered if (it2.get('source') or '').lower() == 'ocorrencia')
+            c.drawString(40, height - 100, f"Total atendidos: {len(filtered)}  |  Ocorrências atendidas: {occ_count}")
+            y = height - 110
+            c.setFillColorRGB(0.91, 0.95, 0.99)
+            c.rect(36, y-4, width-72, 20, fill=1, stroke=0)
+            c.setFillColor(colors.black)
+            c.setFont('Helvetica-Bold', 9)
+            for i, h in enumerate(headers):
+                c.drawString(col_x[i], y, h)
+            y -= 16
+            c.setFont('Helvetica', 9)
+
+        if idx % 2 == 0:
+            c.setFillColorRGB(*row_bg)
+            c.rect(36, y-2, width-72, 18, fill=1, stroke=0)
+            c.setFillColor(colors.black)
+
+        fonte = (it.get('source') or '').title()
+        # Exibir titulo com destaque e incluir maquina em linha secundaria quando aplicavel
+        titulo = (it.get('titulo') or '')
+        if (it.get('source') or '').lower() == 'insumo' and (it.get('maquina') or ''):
+            titulo = f"{(titulo.split(' - ')[0] or titulo)[:60]}"
+        prioridade = (it.get('prioridade') or '').title()
+        data_str = it.get('data_atendimento') or it.get('data_original') or ''
+        atendida = it.get('atendida_por') or '-'
+
+        c.drawString(col_x[0], y, fonte)
+        # Titulo na primeira linha
+        c.drawString(col_x[1], y, (titulo or '')[:60])
+        # Linha secundaria com maquina e/ou item
+        y_secondary = y - 12
+        subparts = []
+        if (it.get('maquina') or ''):
+            subparts.append(f"Maquina: {it.get('maquina')}")
+        if (it.get('codigo_interno') or ''):
+            subparts.append(f"Item: {it.get('codigo_interno')}")
+        if subparts:
+            c.setFillColorRGB(0.30, 0.30, 0.30)
+            c.drawString(col_x[1], y_secondary, '  |  '.join(subparts)[:90])
+            c.setFillColor(colors.black)
+        c.drawString(col_x[2], y, prioridade)
+        c.drawString(col_x[3], y, data_str)
+        c.drawString(col_x[4], y, atendida)
+        # Ajusta altura da linha de acordo com conteudo secundario
+        y -= (30 if subparts else 18)
+
+        # Sem grade de fotos para manter layout limpo
+
+    # Charts page
+    try:
+        import matplotlib.pyplot as plt
+        from collections import Counter
+        # Estilo moderno
+        try:
+            plt.style.use('ggplot')
+        except Exception:
+            pass
+        counts = Counter([(it.get('prioridade') or 'baixa').lower() for it in filtered])
+        if counts:
+            labels = list(counts.keys())
+            values = [counts[l] for l in labels]
+            fig, ax = plt.subplots(figsize=(6.2, 3.8), dpi=150)
+            fig.patch.set_facecolor('white')
+            ax.set_facecolor('white')
+            palette = ['#27ae60', '#f1c40f', '#e67e22', '#e74c3c', '#8e44ad', '#3498db']
+            colors = [palette[i % len(palette)] for i in range(len(labels))]
+            bars = ax.bar(labels, values, color=colors, edgecolor='none')
+            # Valores no topo de cada barra
+            for bar in bars:
+                height = bar.get_height()
+                ax.annotate(f'{int(height)}',
+                            xy=(bar.get_x() + bar.get_width() / 2, height),
+                            xytext=(0, 6),
+                            textcoords='offset points',
+                            ha='center', va='bottom', fontsize=9, color='#2c3e50')
+            # Eixos e grade sutis
+            for spine in ['top', 'right']:
+                ax.spines[spine].set_visible(False)
+            ax.grid(True, axis='y', linestyle='--', alpha=0.25)
+            ax.set_axisbelow(True)
+            ax.set_title('Itens por Prioridade', fontsize=12, color='#2c3e50', pad=10)
+            ax.set_xlabel('Prioridade', fontsize=10)
+            ax.set_ylabel('Quantidade', fontsize=10)
+            fig.tight_layout()
+            import io as _io
+            img_buf = _io.BytesIO()
+            plt.savefig(img_buf, format='png', dpi=160)
+            plt.close(fig)
+            img_buf.seek(0)
+            img = ImageReader(img_buf)
+            c.showPage()
+            c.drawImage(img, 40, 160, width=520, height=380, preserveAspectRatio=True)
+    except Exception:
+        pass
+
+    c.save(); buf.seek(0)
+    return buf
+
+
+def render_relatorio(job):
+    """Gera o PDF do job e grava em job['path'] (arquivo temporário + rename)."""
+    args = (job['itens'], job.get('titulo') or '', job.get('prioridade') or '', job.get('atendida_por') or '')
+    try:
+        buf = build_relatorio_pdf(*args, job['fotos_folder'], job.get('thumbs_folder'))
+    except Exception as e:
+        logger.error(f"Falha no Platypus: {str(e)}; usando layout legado.")
+        buf = build_relatorio_pdf_legado(*args)
+    tmp_path = job['path'] + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(buf.getbuffer())
+    os.replace(tmp_path, job['path'])
+
+
+def serve():
+    """Loop do worker: lê um job JSON por linha e responde {"ok": ...} na mesma ordem."""
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            render_relatorio(json.loads(line))
+            result = {'ok': True}
+        except Exception as e:
+            logger.exception("Erro ao gerar relatório")
+            result = {'ok': False, 'error': str(e)}
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    serve()
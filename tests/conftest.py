@@ -0,0 +1,34 @@
+"""Fixtures dos testes: o app sobre uma base sintética de escala 10k (gerar_dados.py).
+
+O menu.py lê DATA_DIR e aplica as migrações na importação, então a base é
+gerada antes e o módulo só é importado pela fixture `menu`.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def menu():
+    from gerar_dados import ESCALAS, gerar
+    data_dir = tempfile.mkdtemp(prefix='gestao-testes-')
+    gerar(data_dir, **ESCALAS['10k'])
+    os.environ['DATA_DIR'] = data_dir
+    import menu as app_module
+    app_module.app.config['TESTING'] = True
+    yield app_module
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def client(menu):
+    client = menu.app.test_client()
+    with client.session_transaction() as session:
+        session['gestao_logged'] = True
+    return client
@@ -0,0 +1,146 @@
+"""Testes de fumaça: migrações, paginação por cursor e o feed /api/changes."""
+import sqlite3
+
+import pytest
+
+DATE_INDEXES = ('idx_insumos_data', 'idx_insumos_pendentes', 'idx_insumos_atendidos',
+                'idx_ocorrencias_data', 'idx_ocorrencias_fechadas')
+
+
+def test_migrations_applied(menu):
+    with menu.db_connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == menu.MIGRATIONS[-1][0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        indexes = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+    assert {'itens_cadastro', 'insumos', 'ocorrencias', 'app_meta', 'change_log', 'item_docs', 'foto_refs'} <= tables
+    for name in DATE_INDEXES:
+        assert '_iso' in indexes[name], indexes[name]
+    assert menu.db_writer.submit(menu.run_migrations) == []
+
+
+def test_migrations_from_empty_database(menu):
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    versions = [version for version, _, _ in menu.MIGRATIONS]
+    assert menu.run_migrations(conn) == versions
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == versions[-1]
+    assert menu.run_migrations(conn) == []
+    conn.close()
+
+
+def pages(client, url, limit):
+    """Percorre a busca do cadastro seguindo next_cursor; retorna os itens de todas as páginas."""
+    items, cursor = [], None
+    while True:
+        query = f'{url}&limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        resp = client.get(query)
+        assert resp.status_code == 200, resp.data[:200]
+        body = resp.get_json()
+        assert len(body['items']) <= limit
+        items += body['items']
+        cursor = body['next_cursor']
+        if cursor is None:
+            return items
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('nome', lambda it: (it['nome_descricao'], it['id'])),
+    ('-codigo', lambda it: (it['codigo_interno'], it['id'])),
+    ('recentes', lambda it: it['id']),
+])
+def test_catalog_search_cursor_pagination(menu, client, sort, key):
+    items = pages(client, f'/api/itens_cadastro/search?sort={sort}', 37)
+    ids = [it['id'] for it in items]
+    with menu.db_connection() as conn:
+        total = conn.execute('SELECT COUNT(*) FROM itens_cadastro').fetchone()[0]
+    assert len(ids) == len(set(ids)) == total
+    keys = [key(it) for it in items]
+    assert keys == sorted(keys, reverse=menu.CATALOG_SEARCH_SORTS[sort][1])
+
+
+def test_catalog_search_filtered_pagination(menu, client):
+    items = pages(client, '/api/itens_cadastro/search?tipo=ferramenta&sort=codigo', 25)
+    with menu.db_connection() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM itens_cadastro WHERE tipo_item = 'ferramenta'").fetchone()[0]
+    assert len({it['id'] for it in items}) == len(items) == total
+    assert client.get('/api/itens_cadastro/search?cursor=lixo').status_code == 400
+
+
+def atendidos_pages(client, query, limit):
+    items, cursor = [], None
+    while True:
+        url = f'/api/atendidos?{query}&limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        resp = client.get(url)
+        assert resp.status_code == 200, resp.data[:200]
+        page = resp.get_json()
+        assert len(page) <= limit
+        items += page
+        cursor = resp.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return items
+
+
+@pytest.mark.parametrize('query', ['', 'prioridade=alta', 'desde=2025-03-01&ate=2025-06-30'])
+def test_atendidos_pages_match_stream(client, query):
+    full = client.get(f'/api/atendidos?{query}').get_json()
+    assert full
+    paged = atendidos_pages(client, query, 97)
+    assert [(it['source'], it['id']) for it in paged] == [(it['source'], it['id']) for it in full]
+    assert len({(it['source'], it['id']) for it in paged}) == len(paged)
+    dates = [it['data_atendimento_iso'] or '' for it in paged]
+    assert dates == sorted(dates, reverse=True)
+    if 'desde' in query:
+        assert all('2025-03-01' <= d < '2025-07-01' for d in dates)
+
+
+def test_atendidos_rejects_bad_cursor(client):
+    assert client.get('/api/atendidos?limit=10&cursor=lixo').status_code == 400
+    assert client.get('/api/atendidos?desde=01/02/2025').status_code == 400
+
+
+def test_changes_reset_semantics(menu, client):
+    version = client.get('/api/changes').get_json()['version']
+    body = client.get(f'/api/changes?since={version}').get_json()
+    assert body['reset'] is False and body['insumos'] == {'upserts': [], 'deletes': []}
+
+    item_id = menu.db_writer.submit(
+        lambda conn: conn.execute("SELECT id FROM itens_cadastro WHERE tipo_item = 'insumo' LIMIT 1").fetchone()[0])
+    resp = client.post('/solicitar_insumo', headers={'Accept': 'application/json'}, data={
+        'item_id': item_id, 'nome': 'teste', 'operador': 'Ana', 'maquina': 'Torno CNC 01',
+        'quantidade': 1, 'urgencia': 'alta', 'justificativa': 'teste'})
+    insumo_id = resp.get_json()['id']
+    body = client.get(f'/api/changes?since={version}').get_json()
+    assert body['reset'] is False
+    assert [row['id'] for row in body['insumos']['upserts']] == [insumo_id]
+
+    assert client.delete(f'/api/insumo/{insumo_id}').status_code == 200
+    body = client.get(f'/api/changes?since={version}').get_json()
+    assert body['insumos'] == {'upserts': [], 'deletes': [insumo_id]}
+    current = body['version']
+    assert client.get(f'/api/changes?since={current + 1}').get_json()['reset'] is True
+    assert client.get('/api/changes?since=-1').status_code == 400
+
+    # Exclusão antiga podada: quem ainda está antes dela precisa recarregar tudo
+    menu.db_writer.submit(lambda conn: conn.execute(
+        "UPDATE change_log SET changed_at = '2000-01-01T00:00:00' WHERE op = 'delete'"))
+    menu._change_log_pruned_at = 0
+    assert client.get(f'/api/changes?since={version}').get_json()['reset'] is True
+    assert client.get(f'/api/changes?since={current}').get_json()['reset'] is False
+
+
+def test_atendidos_filters_escape_like_and_blank_priority(menu, client):
+    def insert(conn):
+        ids = []
+        for atendida_por in ('Op_1%', 'OpX1abc'):
+            cursor = conn.execute('''
+                INSERT INTO insumos (nome, data, status, urgencia, data_atendimento, atendida_por)
+                VALUES ('teste', '01/01/2025 10:00', 'Atendido', '', '01/01/2025 11:00', ?)
+            ''', (atendida_por,))
+            ids.append(cursor.lastrowid)
+        return ids
+    literal, other = menu.db_writer.submit(insert)
+
+    found = {it['id'] for it in client.get('/api/atendidos?atendida_por=op_1%25').get_json()}
+    assert literal in found and other not in found
+    baixa = {it['id'] for it in client.get('/api/atendidos?prioridade=baixa&atendida_por=op').get_json()}
+    assert {literal, other} <= baixa